@@ -0,0 +1,130 @@
+"""
+Time the per-call cost of parsing github urls, semver tags and
+requirement lines, comparing the precompiled regexes with the parse
+library implementations they replaced. The old implementations are
+only timed when the parse library is installed.
+
+Usage:
+    python misc/benchmark_parsing.py
+"""
+import logging
+import re
+import timeit
+
+import shaker.libs.github
+import shaker.libs.logger
+import shaker.libs.metadata
+
+try:
+    from parse import parse
+except ImportError:
+    parse = None
+
+NUMBER = 20000
+
+SAMPLE_URLS = ['git@github.com:test_organisation/test-formula.git==v1.2.3',
+               'git@github.com:test_organisation/test-formula.git']
+SAMPLE_TAGS = ['v1.2.3', 'v1.2.3-rc1', 'v1.2.3rc1', 'master']
+SAMPLE_REQUIREMENTS = ['test_organisation/test-formula==v1.2.3',
+                       'test_organisation/test-formula']
+
+
+def parse_github_url_before(url):
+    """
+    parse_github_url as it was with the parse library
+    """
+    github_root = "git@github.com:"
+    constraint = ''
+    if url.split('.git')[1] != '':
+        result = parse("%s{organisation}/{name}.git{constraint}" % (github_root), url)
+        constraint = result['constraint']
+    else:
+        result = parse("%s{organisation}/{name}.git" % (github_root), url)
+    organisation = result['organisation']
+    name = result['name']
+    return {
+        'source': "%s%s/%s.git" % (github_root, organisation, name),
+        'name': name,
+        'organisation': organisation,
+        'constraint': constraint,
+    }
+
+
+def parse_semver_tag_before(tag):
+    """
+    parse_semver_tag as it was with the parse library
+    """
+    retval = {"major": None, "minor": None, "patch": None, "postfix": None}
+    version_comparators = {
+        'release': 'v(\d+).(\d+).(\d+)$',
+        'prerelease': 'v(\d+).(\d+).(\d+)-(.+)',
+        'prerelease-compat': 'v(\d+).(\d+).(\d+)(.+)',
+    }
+    if re.match(version_comparators["release"], tag):
+        parsed_results = parse('v{major:d}.{minor:d}.{patch:d}', tag)
+        retval = {"major": parsed_results["major"],
+                  "minor": parsed_results["minor"],
+                  "patch": parsed_results["patch"],
+                  "postfix": None}
+    elif re.match(version_comparators["prerelease"], tag):
+        parsed_results = parse('v{major:d}.{minor:d}.{patch:d}-{postfix}', tag)
+        retval = {"major": parsed_results["major"],
+                  "minor": parsed_results["minor"],
+                  "patch": parsed_results["patch"],
+                  "postfix": parsed_results["postfix"]}
+    elif re.match(version_comparators["prerelease-compat"], tag):
+        parsed_results = re.match(version_comparators["prerelease-compat"], tag).groups()
+        retval = {"major": int(parsed_results[0]),
+                  "minor": int(parsed_results[1]),
+                  "patch": int(parsed_results[2]),
+                  "postfix": parsed_results[3]}
+    return retval
+
+
+def parse_requirement_before(requirement):
+    """
+    The requirement line match in parse_metadata_requirements as it was
+    """
+    return re.search('(.*)([=><]{2})\s*(.*)', requirement)
+
+
+def parse_requirement_after(requirement):
+    """
+    The requirement line match in parse_metadata_requirements
+    """
+    return shaker.libs.metadata.requirement_re.search(requirement)
+
+
+def time_call(function, samples):
+    """
+    Get the mean time in microseconds of calling a function on each sample
+    """
+    seconds = timeit.timeit(lambda: [function(sample) for sample in samples], number=NUMBER)
+    return seconds * 1000000 / (NUMBER * len(samples))
+
+
+def main():
+    shaker.libs.logger.Logger('salt-shaker').setLevel(logging.WARNING)
+    cases = [
+        ('parse_github_url', SAMPLE_URLS,
+         parse_github_url_before, shaker.libs.github.parse_github_url),
+        ('parse_semver_tag', SAMPLE_TAGS,
+         parse_semver_tag_before, shaker.libs.github.parse_semver_tag),
+        ('requirement line match', SAMPLE_REQUIREMENTS,
+         parse_requirement_before, parse_requirement_after),
+    ]
+    print "%28s %14s %14s" % ('function', 'before (us)', 'after (us)')
+    for name, samples, before, after in cases:
+        if parse is None:
+            before_time = '-'
+        else:
+            if name != 'requirement line match':
+                for sample in samples:
+                    assert before(sample) == after(sample), sample
+            before_time = '%.2f' % (time_call(before, samples))
+        after_time = '%.2f' % (time_call(after, samples))
+        print "%28s %14s %14s" % (name, before_time, after_time)
+
+
+if __name__ == '__main__':
+    main()
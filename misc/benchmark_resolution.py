@@ -0,0 +1,94 @@
+"""
+Time constraint resolution against repositories with 10, 1k and 10k tags,
+comparing a linear scan of the tags with lookups in a version index.
+
+Usage:
+    python misc/benchmark_resolution.py
+"""
+import logging
+import random
+import timeit
+
+import shaker.libs.github
+import shaker.libs.logger
+from shaker.libs.version_index import VersionIndex
+
+TAG_COUNTS = [10, 1000, 10000]
+LOOKUPS = 100
+CONSTRAINTS = ['>=v1.5.0', '<=v4.2.0', '==v3.1.4']
+
+
+def make_tags_data(tag_count):
+    """
+    Make github style tag data for a number of distinct versions,
+    with a pre-release for about one in ten of them
+    """
+    random.seed(tag_count)
+    versions = set()
+    while len(versions) < tag_count:
+        versions.add((random.randint(0, 9), random.randint(0, 99), random.randint(0, 99)))
+    tags_data = []
+    for index, (major, minor, patch) in enumerate(sorted(versions)):
+        name = 'v%s.%s.%s' % (major, minor, patch)
+        if index % 10 == 0:
+            name = '%s-rc1' % (name)
+        tags_data.append({'name': name, 'commit': {'sha': '%040x' % (index)}})
+    tags_data.append({'name': 'v3.1.4', 'commit': {'sha': '%040x' % (tag_count)}})
+    random.shuffle(tags_data)
+    return tags_data
+
+
+def resolve_linearly(tags_data, constraint):
+    """
+    Resolve a constraint by scanning every tag, as resolution did before
+    the version index
+    """
+    comparator, version = constraint[:2], constraint[3:]
+    versions = shaker.libs.github.get_tag_versions(tags_data)
+    found = None
+    for tag_version in reversed(versions):
+        if shaker.libs.github.is_tag_prerelease('v%s' % (tag_version)):
+            continue
+        if ((comparator == '==' and tag_version == version) or
+                (comparator == '>=' and tag_version >= version) or
+                (comparator == '<=' and tag_version <= version)):
+            found = 'v%s' % (tag_version)
+            break
+    for tag_data in tags_data:
+        if tag_data['name'] == found:
+            return tag_data
+    return None
+
+
+def main():
+    shaker.libs.logger.Logger('salt-shaker').setLevel(logging.WARNING)
+    print "%8s %12s %14s %14s %14s" % ('tags', 'constraint', 'linear (ms)', 'resolve (ms)', 'lookup (us)')
+    for tag_count in TAG_COUNTS:
+        tags_data = make_tags_data(tag_count)
+        valid_tags = shaker.libs.github.get_valid_tags_from_data(tags_data)
+        index = VersionIndex(tags_data)
+        for constraint in CONSTRAINTS:
+            number = max(1, LOOKUPS * 10 / tag_count)
+            linear_time = timeit.timeit(lambda: resolve_linearly(tags_data, constraint),
+                                        number=number) / number
+            resolve_time = timeit.timeit(lambda: shaker.libs.github.resolve_constraint_to_object('benchmark',
+                                                                                                 'test-formula',
+                                                                                                 constraint,
+                                                                                                 valid_tags),
+                                         number=number) / number
+            if constraint.startswith('>='):
+                lookup = lambda: index.find_at_least(constraint[3:])
+            elif constraint.startswith('<='):
+                lookup = lambda: index.find_at_most(constraint[3:])
+            else:
+                lookup = lambda: index.has_version(constraint[3:])
+            lookup_time = timeit.timeit(lookup, number=LOOKUPS * 100) / (LOOKUPS * 100)
+            print "%8s %12s %14.3f %14.3f %14.3f" % (tag_count,
+                                                     constraint,
+                                                     linear_time * 1000,
+                                                     resolve_time * 1000,
+                                                     lookup_time * 1000000)
+
+
+if __name__ == '__main__':
+    main()
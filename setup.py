@@ -14,7 +14,6 @@ setup(
         'requests[security]',
         'PyYAML',
         'pygit2 >= 0.21.4',
-        'parse'
     ],
     tests_require=[
         'responses',
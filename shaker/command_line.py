@@ -26,6 +26,52 @@ class ShakerCommandLine(object):
         parser.add_argument('--enable-remote-check',
                             action='store_true',
                             help="Enable remote checks when installing pinned versions")
+        parser.add_argument('--tag-cache-ttl',
+                            type=int,
+                            default=0,
+                            help=("Seconds to reuse cached repository tag lists for, "
+                                  "0 to disable the tag cache"))
+        parser.add_argument('--refresh-tags',
+                            action='store_true',
+                            help="Ignore cached repository tag lists and refetch them, updating the cache")
+        parser.add_argument('--graphql',
+                            action='store_true',
+                            help="Resolve dependencies in batches using the github GraphQL api")
+        parser.add_argument('--fetch-jobs',
+                            type=int,
+                            default=1,
+                            help="Number of formulas to fetch dependency metadata for concurrently")
+        parser.add_argument('--jobs',
+                            '-j',
+                            type=int,
+                            default=1,
+                            help="Number of formulas to install concurrently")
+        parser.add_argument('--clone-mode',
+                            choices=['full', 'shallow', 'tags'],
+                            default='full',
+                            help=("How to clone formula repositories, full history, "
+                                  "only the installed ref at depth 1, or only tags"))
+        parser.add_argument('--mirror',
+                            action='store_true',
+                            help="Create formula repositories from bare mirrors shared across the host")
+        parser.add_argument('--install-mode',
+                            choices=['git', 'tarball', 'sparse', 'store'],
+                            default='git',
+                            help=("Install formulas as git repositories, only their files "
+                                  "from github tarballs, git repositories with only the "
+                                  "exports and module directories checked out, or links "
+                                  "into the host's tree store"))
+        parser.add_argument('--clean',
+                            action='store_true',
+                            help="Delete installed formulas and clone them again, rather than updating them")
+        parser.add_argument('--solve',
+                            action='store_true',
+                            help=("Solve dependencies over the versions each formula has, "
+                                  "backtracking on conflicts, rather than merging constraints as found"))
+        parser.add_argument('--minimal',
+                            action='store_true',
+                            help=("Resolve each constraint to the lowest version that satisfies it, "
+                                  "checking only that tag exists rather than listing every tag"))
 
         parser_install = subparsers.add_parser('install',
                                                help=("Install formulas and requirements from metadata.yml, "
@@ -0,0 +1,57 @@
+import errno
+import os
+import tempfile
+
+
+def get_cache_directory(*subdirectories):
+    """
+    Get the path to a directory in salt-shaker's host-wide cache,
+    honouring XDG_CACHE_HOME if it is set, eg,
+        ~/.cache/salt-shaker/http
+
+    Args:
+        subdirectories(string): The path components below the cache root
+
+    Returns:
+        string: The path of the cache directory
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'salt-shaker', *subdirectories)
+
+
+def ensure_directory(path):
+    """
+    Create a directory and any parents if they do not exist
+
+    Args:
+        path(string): The directory to create
+    """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def write_file_atomically(path, data):
+    """
+    Write data to a file so that readers only ever see the old
+    or the complete new contents, never a partial write
+
+    Args:
+        path(string): The path of the file to write
+        data(string): The contents to write
+    """
+    directory = os.path.dirname(path)
+    ensure_directory(directory)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory,
+                                                  prefix='.tmp-')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as temp_file:
+            temp_file.write(data)
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
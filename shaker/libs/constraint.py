@@ -0,0 +1,457 @@
+import re
+import threading
+
+from shaker.libs.errors import ConstraintFormatException
+from shaker.libs.errors import ConstraintResolutionException
+from shaker.libs.version_index import get_version_key
+
+# A comparator and tag, eg, '>=v1.2.3'
+comparator_re = re.compile(r'([=><]+)\s*(.*)')
+
+# A version tag, with or without a postfix, eg, 'v1.2.3' or 'v1.2.3-rc1'
+version_tag_re = re.compile('^v(.+?)-(.+)$', re.IGNORECASE)
+plain_version_tag_re = re.compile('^v(.+)$', re.IGNORECASE)
+
+# Separates the bounds of a compound constraint, eg, '>=v1.0.0,<=v2.0.0'
+CONSTRAINT_SEPARATOR = ','
+
+_versions = {}
+_constraints = {}
+_intervals = {}
+_cache_lock = threading.Lock()
+
+
+class Version(object):
+    """
+    An immutable, parsed version tag. Versions are interned, so there is
+    only ever one object for a tag, and carry a precomputed key to
+    compare them numerically with, eg,
+        Version.parse('v1.9.0') < Version.parse('v1.10.0')
+
+    Attributes:
+        tag(string): The tag, eg, 'v1.2.3-rc1'
+        version(string): The version without the postfix, eg, '1.2.3',
+            None type if the tag is not a version tag
+        postfix(string): The postfix, eg, 'rc1', None type if there is none
+        key(tuple): The comparison key, as for version_index.get_version_key,
+            None type if the version is not numeric
+    """
+    __slots__ = ('tag', 'version', 'postfix', 'key')
+
+    def __init__(self, tag):
+        """
+        Parse a tag, use Version.parse to get the interned version
+
+        Args:
+            tag(string): The tag
+        """
+        version = None
+        postfix = None
+        match = version_tag_re.match(tag)
+        if match:
+            version, postfix = match.groups()
+        else:
+            match = plain_version_tag_re.match(tag)
+            if match:
+                version = match.group(1)
+        key = None
+        if version is not None:
+            key = get_version_key(version if postfix is None else "%s-%s" % (version, postfix))
+        object.__setattr__(self, 'tag', tag)
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'postfix', postfix)
+        object.__setattr__(self, 'key', key)
+
+    @classmethod
+    def parse(cls, tag):
+        """
+        Get the interned version of a tag
+
+        Args:
+            tag(string): The tag, eg, 'v1.2.3'
+
+        Returns:
+            Version: The version
+        """
+        version = _versions.get(tag, None)
+        if version is None:
+            version = cls(tag)
+            with _cache_lock:
+                version = _versions.setdefault(tag, version)
+        return version
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Version: Versions are immutable")
+
+    def __eq__(self, other):
+        if isinstance(other, Version):
+            return self.tag == other.tag
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, Version):
+            return self.tag != other.tag
+        return NotImplemented
+
+    def __lt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._compare_key() < other._compare_key()
+
+    def __le__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._compare_key() <= other._compare_key()
+
+    def __gt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._compare_key() > other._compare_key()
+
+    def __ge__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._compare_key() >= other._compare_key()
+
+    def __hash__(self):
+        return hash(self.tag)
+
+    def __str__(self):
+        return self.tag
+
+    def __repr__(self):
+        return "Version(%r)" % (self.tag)
+
+    def _compare_key(self):
+        """
+        Get the key to order by, falling back to the tag for versions
+        that aren't numeric, which order below those that are
+
+        Returns:
+            tuple: The ordering key
+        """
+        if self.key is None:
+            return (0, self.tag)
+        return (1, self.key)
+
+
+class Constraint(object):
+    """
+    An immutable, parsed constraint, eg, '>=v1.2.3'. Constraints are
+    interned, and can be used in place of the dictionary form that
+    parse_constraint used to return,
+        {'comparator': comparator, 'tag': tag, 'version': version, 'postfix': postfix}
+
+    Attributes:
+        constraint(string): The constraint, eg, '>=v1.2.3'
+        comparator(string): The comparator, eg, '>='
+        tag(string): The tag, eg, 'v1.2.3'
+        target(Version): The parsed tag
+    """
+    __slots__ = ('constraint', 'comparator', 'tag', 'target')
+
+    _fields = ('comparator', 'tag', 'version', 'postfix')
+
+    def __init__(self, constraint):
+        """
+        Parse a constraint, use Constraint.parse to get the interned
+        constraint
+
+        Args:
+            constraint(string): The constraint
+
+        Raises:
+            ConstraintFormatException: If there is no comparator
+        """
+        match = comparator_re.search(constraint or '')
+        if not match:
+            msg = ("Constraint: Could not find a comparator in '%s'"
+                   % (constraint))
+            raise ConstraintFormatException(msg)
+        object.__setattr__(self, 'constraint', constraint)
+        object.__setattr__(self, 'comparator', match.group(1))
+        object.__setattr__(self, 'tag', match.group(2))
+        object.__setattr__(self, 'target', Version.parse(match.group(2)))
+
+    @classmethod
+    def parse(cls, constraint):
+        """
+        Get the interned constraint for a constraint string, passing
+        constraints that are already parsed straight through
+
+        Args:
+            constraint(string): The constraint, eg, '>=v1.2.3'
+
+        Returns:
+            Constraint: The constraint
+        """
+        if isinstance(constraint, Constraint):
+            return constraint
+        parsed_constraint = _constraints.get(constraint, None)
+        if parsed_constraint is None:
+            parsed_constraint = cls(constraint)
+            with _cache_lock:
+                parsed_constraint = _constraints.setdefault(constraint, parsed_constraint)
+        return parsed_constraint
+
+    @property
+    def version(self):
+        return self.target.version
+
+    @property
+    def postfix(self):
+        return self.target.postfix
+
+    @property
+    def key(self):
+        return self.target.key
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Constraint: Constraints are immutable")
+
+    def __getitem__(self, name):
+        if name not in self._fields:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name):
+        return name in self._fields
+
+    def get(self, name, default=None):
+        if name not in self._fields:
+            return default
+        return getattr(self, name)
+
+    def keys(self):
+        return list(self._fields)
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self._fields]
+
+    def __eq__(self, other):
+        if isinstance(other, Constraint):
+            return self.constraint == other.constraint
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self.constraint)
+
+    def __str__(self):
+        return self.constraint
+
+    def __repr__(self):
+        return "Constraint(%r)" % (self.constraint)
+
+
+class VersionInterval(object):
+    """
+    An immutable version interval, with inclusive lowest and highest
+    bounds and an optional exact pin, that the constraints on a formula
+    are accumulated in. Intervals are interned, and merging constraints
+    is a constant time intersection, eg,
+        VersionInterval.parse('>=v1.0.0').intersect(VersionInterval.parse('<=v2.0.0'))
+    is the interval of the compound constraint '>=v1.0.0,<=v2.0.0'.
+
+    Branches can't be ordered, so a pinned branch is taken to lie
+    within any bounds.
+
+    Attributes:
+        lowest(Version): The lowest version, None type for no lower bound
+        highest(Version): The highest version, None type for no upper bound
+        pin(Version): The exact version, None type if there is no pin
+    """
+    __slots__ = ('lowest', 'highest', 'pin')
+
+    def __init__(self, lowest=None, highest=None, pin=None):
+        """
+        Initialise the interval, use VersionInterval.parse to get the
+        interned interval of a constraint
+
+        Args:
+            lowest(Version): (optional) The lowest version
+            highest(Version): (optional) The highest version
+            pin(Version): (optional) The exact version
+
+        Raises:
+            ConstraintResolutionException: If the interval is empty
+        """
+        if lowest is not None and highest is not None and lowest > highest:
+            msg = ("VersionInterval: No version is both at least '%s' and at most '%s'"
+                   % (lowest, highest))
+            raise ConstraintResolutionException(msg)
+        if pin is not None and pin.key is not None:
+            if ((lowest is not None and pin < lowest) or
+                    (highest is not None and pin > highest)):
+                msg = ("VersionInterval: Version '%s' is outside of '%s'"
+                       % (pin, self._format(lowest, highest, None)))
+                raise ConstraintResolutionException(msg)
+        object.__setattr__(self, 'lowest', lowest)
+        object.__setattr__(self, 'highest', highest)
+        object.__setattr__(self, 'pin', pin)
+
+    @classmethod
+    def parse(cls, constraint):
+        """
+        Get the interned interval of a constraint, which may be compound,
+        passing intervals straight through
+
+        Args:
+            constraint(string): The constraint, eg, '>=v1.0.0,<=v2.0.0',
+                empty for no constraint
+
+        Returns:
+            VersionInterval: The interval
+
+        Raises:
+            ConstraintFormatException: If a part has no comparator
+            ConstraintResolutionException: If the interval is empty
+        """
+        if isinstance(constraint, VersionInterval):
+            return constraint
+        constraint = str(constraint or '')
+        interval = _intervals.get(constraint, None)
+        if interval is None:
+            interval = cls()
+            for part in constraint.split(CONSTRAINT_SEPARATOR):
+                if part.strip():
+                    interval = interval.intersect_constraint(Constraint.parse(part.strip()))
+            with _cache_lock:
+                interval = _intervals.setdefault(constraint, interval)
+        return interval
+
+    def intersect(self, other):
+        """
+        Intersect with another interval
+
+        Args:
+            other(VersionInterval): The interval to intersect with
+
+        Returns:
+            VersionInterval: The versions in both intervals
+
+        Raises:
+            ConstraintResolutionException: If no version is in both
+        """
+        lowest = self.lowest
+        if other.lowest is not None and (lowest is None or other.lowest > lowest):
+            lowest = other.lowest
+        highest = self.highest
+        if other.highest is not None and (highest is None or other.highest < highest):
+            highest = other.highest
+        pin = self.pin
+        if other.pin is not None:
+            if pin is not None and pin != other.pin:
+                msg = ("VersionInterval: Version '%s' conflicts with version '%s'"
+                       % (other.pin, pin))
+                raise ConstraintResolutionException(msg)
+            pin = other.pin
+        return VersionInterval(lowest, highest, pin)
+
+    def intersect_constraint(self, constraint):
+        """
+        Intersect with the versions a single constraint allows
+
+        Args:
+            constraint(Constraint): The constraint, eg, '>=v1.0.0'
+
+        Returns:
+            VersionInterval: The versions in the interval the constraint allows
+
+        Raises:
+            ConstraintResolutionException: If no version is in both,
+                or the comparator is unknown
+        """
+        if constraint.comparator == '>=':
+            return self.intersect(VersionInterval(lowest=constraint.target))
+        elif constraint.comparator == '<=':
+            return self.intersect(VersionInterval(highest=constraint.target))
+        elif constraint.comparator == '==':
+            return self.intersect(VersionInterval(pin=constraint.target))
+        msg = ("VersionInterval: Unknown comparator in '%s'"
+               % (constraint))
+        raise ConstraintResolutionException(msg)
+
+    def contains(self, tag):
+        """
+        Check whether a tag is in the interval
+
+        Args:
+            tag(string): The tag, eg, 'v1.2.3'
+
+        Returns:
+            bool: True if the tag is in the interval, False otherwise
+        """
+        version = Version.parse(tag)
+        if self.pin is not None:
+            return version == self.pin
+        if version.key is None:
+            return True
+        if self.lowest is not None and (self.lowest.key is None or version < self.lowest):
+            return False
+        if self.highest is not None and (self.highest.key is None or version > self.highest):
+            return False
+        return True
+
+    def is_unbounded(self):
+        """
+        Check whether the interval allows every version
+
+        Returns:
+            bool: True if there are no bounds or pin, False otherwise
+        """
+        return self.lowest is None and self.highest is None and self.pin is None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("VersionInterval: Intervals are immutable")
+
+    def __eq__(self, other):
+        if isinstance(other, VersionInterval):
+            return (self.lowest, self.highest, self.pin) == (other.lowest, other.highest, other.pin)
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, VersionInterval):
+            return not self.__eq__(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.lowest, self.highest, self.pin))
+
+    def __str__(self):
+        return self._format(self.lowest, self.highest, self.pin)
+
+    def __repr__(self):
+        return "VersionInterval(%r)" % (str(self))
+
+    @staticmethod
+    def _format(lowest, highest, pin):
+        """
+        Format bounds as a constraint, a pin standing in for any bounds
+
+        Args:
+            lowest(Version): The lowest version, None type for no lower bound
+            highest(Version): The highest version, None type for no upper bound
+            pin(Version): The exact version, None type if there is no pin
+
+        Returns:
+            string: The constraint, eg, '>=v1.0.0,<=v2.0.0', empty if
+                there are no bounds
+        """
+        if pin is not None:
+            return '==%s' % (pin)
+        if lowest is not None and lowest == highest:
+            return '==%s' % (lowest)
+        bounds = []
+        if lowest is not None:
+            bounds.append('>=%s' % (lowest))
+        if highest is not None:
+            bounds.append('<=%s' % (highest))
+        return CONSTRAINT_SEPARATOR.join(bounds)
@@ -2,20 +2,98 @@ import json
 import requests
 import os
 import re
+import shutil
 import sys
+import tarfile
+import tempfile
+import threading
+import time
 import pygit2
-from parse import parse
 import urlparse
+import yaml
 from distutils.version import LooseVersion
+from multiprocessing.pool import ThreadPool
 import metadata
 from errors import ConstraintResolutionException
 from errors import GithubRepositoryConnectionException
+import shaker.libs.http_client
 import shaker.libs.logger
+import shaker.libs.mirror_cache
+import shaker.libs.tag_cache
+from shaker.libs.constraint import CONSTRAINT_SEPARATOR
+from shaker.libs.constraint import VersionInterval
+from shaker.libs.version_index import VersionIndex
 from shaker.libs.pygit2_utils import pygit2_parse_error
 
 
 const_re = re.compile('([=><]+)\s*(.*)')
 tag_re = re.compile('v[0-9]+\.[0-9]+\.[0-9]+')
+sha_re = re.compile('^[0-9a-f]{40}$')
+
+# Github urls, with and without a constraint, eg,
+# git@github.com:test_organisation/test3-formula.git==v3.0.2
+github_url_re = re.compile(r'^git@github\.com:(?P<organisation>.+?)/(?P<name>.+?)\.git(?P<constraint>.+?)?$',
+                           re.IGNORECASE | re.DOTALL)
+
+# Acceptable version tags, a release, eg, v1.2.3, a semver compliant
+# prerelease, eg, v1.2.3-pre1, or a non-compliant prerelease, eg, v1.2.3pre1
+release_tag_re = re.compile(r'v(\d+)\.(\d+)\.(\d+)$')
+prerelease_tag_re = re.compile(r'v(\d+)\.(\d+)\.(\d+)-(.+)')
+prerelease_compat_tag_re = re.compile(r'v(\d+)\.(\d+)\.(\d+)(.+)')
+
+# Any tag with a leading 'v', eg, v1.2.3
+version_tag_re = re.compile(r'^v(?P<tag>.+)$', re.IGNORECASE | re.DOTALL)
+
+# Github will not return more than 100 tags per page
+TAGS_PER_PAGE = 100
+TAG_PAGE_FETCH_JOBS = 8
+
+_tag_fetch_stats = {}
+_tag_fetch_stats_lock = threading.Lock()
+
+_tag_lookup_stats = {'lookups': 0, 'found': 0}
+_tag_lookup_stats_lock = threading.Lock()
+
+# The version index of each repository's tags, with the tag data it
+# was built from, so it is only rebuilt when the tags change
+_version_indexes = {}
+_version_indexes_lock = threading.Lock()
+
+# Ways of cloning a formula repository
+CLONE_MODE_FULL = 'full'
+CLONE_MODE_SHALLOW = 'shallow'
+CLONE_MODE_TAGS = 'tags'
+CLONE_MODES = [CLONE_MODE_FULL, CLONE_MODE_SHALLOW, CLONE_MODE_TAGS]
+
+# Every tag and branch, fetched when a ref couldn't be fetched on
+# its own, eg, a raw sha that the server or libgit2 won't fetch
+TAGS_AND_BRANCHES_REFSPECS = ['+refs/tags/*:refs/tags/*',
+                              '+refs/heads/*:refs/remotes/origin/*']
+
+# Ways of installing a formula, from a git repository, a tarball,
+# a git repository with only the paths salt uses checked out or
+# links into the host's tree store
+INSTALL_MODE_GIT = 'git'
+INSTALL_MODE_TARBALL = 'tarball'
+INSTALL_MODE_SPARSE = 'sparse'
+INSTALL_MODE_STORE = 'store'
+INSTALL_MODES = [INSTALL_MODE_GIT, INSTALL_MODE_TARBALL, INSTALL_MODE_SPARSE, INSTALL_MODE_STORE]
+
+# The file a sparse checkout reads a formula's exports from
+SPARSE_METADATA_FILE = 'metadata.yml'
+
+# The file tarball and tree store installs record their version in
+INSTALL_MARKER = '.shaker-sha'
+
+# The file in a clone's .git directory recording whether its working
+# tree is a full or sparse checkout
+CHECKOUT_MARKER = 'shaker-checkout'
+CHECKOUT_MODE_FULL = 'full'
+CHECKOUT_MODE_SPARSE = 'sparse'
+
+_clone_stats = {}
+_incremental_fetch_stats = {}
+_clone_stats_lock = threading.Lock()
 
 
 def parse_github_url(url):
@@ -52,21 +130,20 @@ def parse_github_url(url):
                % (url, e))
         raise IndexError(msg)
 
+    result = github_url_re.match(url)
+    if result is None:
+        msg = ("github::parse_github_url: Could not parse url '%s'"
+               % (url))
+        raise ValueError(msg)
     if have_constraint:
-        result = parse("%s{organisation}/{name}.git{constraint}"
-                       % (github_root),
-                       url)
-        constraint = result['constraint']
+        constraint = result.group('constraint')
     else:
-        result = parse("%s{organisation}/{name}.git"
-                       % (github_root),
-                       url)
         shaker.libs.logger.Logger().debug("github::parse_github_url:"
                                           "No constraint found for %s"
                                           % (url))
 
-    organisation = result['organisation']
-    name = result['name']
+    organisation = result.group('organisation')
+    name = result.group('name')
     source = "%s%s/%s.git" % (github_root, organisation, name)
 
     info = {
@@ -106,34 +183,23 @@ def parse_semver_tag(tag):
         "postfix": None,
     }
 
-    # Use these regexs to determine the accetable tag type
-    version_comparators = {
-        'release': 'v(\d+).(\d+).(\d+)$',
-        'prerelease': 'v(\d+).(\d+).(\d+)-(.+)',
-        'prerelease-compat': 'v(\d+).(\d+).(\d+)(.+)',
-    }
-
     # Check for a release v1.2.3
-    if re.match(version_comparators["release"], tag):
-        parsed_results = parse('v{major:d}.{minor:d}.{patch:d}', tag)
+    match = release_tag_re.match(tag)
+    if match:
+        parsed_results = match.groups()
         retval = {
-            "major": parsed_results["major"],
-            "minor": parsed_results["minor"],
-            "patch": parsed_results["patch"],
+            "major": int(parsed_results[0]),
+            "minor": int(parsed_results[1]),
+            "patch": int(parsed_results[2]),
             "postfix": None,
         }
-    # Check for a semver compliant prerelease v1.2.3-pre1
-    elif re.match(version_comparators["prerelease"], tag):
-        parsed_results = parse('v{major:d}.{minor:d}.{patch:d}-{postfix}', tag)
-        retval = {
-            "major": parsed_results["major"],
-            "minor": parsed_results["minor"],
-            "patch": parsed_results["patch"],
-            "postfix": parsed_results["postfix"],
-        }
-    # Check for a non-semver compliant prerelease v1.2.3pre1
-    elif re.match(version_comparators["prerelease-compat"], tag):
-        parsed_results = re.match(version_comparators["prerelease-compat"], tag).groups()
+        return retval
+
+    # Check for a semver compliant prerelease v1.2.3-pre1, then
+    # a non-semver compliant prerelease v1.2.3pre1
+    match = prerelease_tag_re.match(tag) or prerelease_compat_tag_re.match(tag)
+    if match:
+        parsed_results = match.groups()
         retval = {
             "major": int(parsed_results[0]),
             "minor": int(parsed_results[1]),
@@ -179,33 +245,46 @@ def convert_tag_to_semver(tag):
 
 def get_valid_tags(org_name,
                    formula_name,
-                   max_tag_count=1000):
+                   max_tag_count=None):
     """
     Get all semver compliant tags from a repository using the
-    formula organisation and name
+    formula organisation and name. If a tag cache is configured
+    and holds a fresh entry for the repository, github is not
+    contacted at all
 
     Args:
         org_name(string): The organisation name of the repository
         formula_name(string): The formula name of the repository
-        max_tag_count(int): Limit on amount of tags to fetch
+        max_tag_count(int): Limit on amount of tags to fetch, None
+            type to fetch every page of tags
 
     Returns:
         string: The tag that is calculated to be the 'preferred' one
         list: All the tag versions found that were semver compliant
         dictionary: Data for all tags, semver compliant or not
     """
+    tag_cache = shaker.libs.tag_cache.get_tag_cache()
+    if tag_cache is not None:
+        cached_tags = tag_cache.load(org_name, formula_name)
+        if cached_tags is not None:
+            wanted_tag, tags_data = cached_tags
+            tag_versions = get_tag_versions(tags_data)
+            shaker.libs.logger.Logger().debug("github::get_valid_tags: "
+                                              "cached wanted_tag=%s, tag_versions=%s"
+                                              % (wanted_tag, tag_versions))
+            return wanted_tag, tag_versions, tags_data
 
     github_token = get_valid_github_token()
     if not github_token:
         msg = "github::get_branch_data: No valid github token"
         raise GithubRepositoryConnectionException(msg)
 
-    tags_url = ('https://api.github.com/repos/%s/%s/tags?per_page=%s'
-                % (org_name, formula_name, max_tag_count))
+    tags_url = ('https://api.github.com/repos/%s/%s/tags'
+                % (org_name, formula_name))
     tag_versions = []
     tags_data = {}
-    tags_json = requests.get(tags_url,
-                             auth=(github_token, 'x-oauth-basic'))
+    fetch_start_time = time.time()
+    tags_json = _get_tags_page(tags_url, github_token, 1)
 
     shaker.libs.logger.Logger().debug("github::get_valid_tags: "
                                       "Calling validate_github_access with %s "
@@ -213,41 +292,59 @@ def get_valid_tags(org_name,
 
     # Check for successful access and any credential problems
     if validate_github_access(tags_json):
-        try:
-            tags_data = json.loads(tags_json.text)
-            for tag in tags_data:
-                raw_name = tag['name']
-
-                semver_info = convert_tag_to_semver(raw_name)
-                # If we have a semver valid tag, then add,
-                # otherwise ignore
-                if len(semver_info) > 0:
-                    parsed_tag_version_results = parse('v{tag}', raw_name)
-                    if parsed_tag_version_results:
-                        shaker.libs.logger.Logger().debug("github::get_valid_tags: "
-                                                          "Appending valid tag %s'"
-                                                          % (raw_name))
-                        parsed_tag_version = parsed_tag_version_results["tag"]
-                        tag_versions.append(parsed_tag_version)
-                else:
-                    shaker.libs.logger.Logger().warning("github::get_valid_tags: "
-                                                        "Ignoring semver invalid tag %s'"
-                                                        % (raw_name))
-
-            tag_versions.sort()
-            wanted_version = get_latest_tag(tag_versions,
-                                            include_prereleases=False)
-            if wanted_version:
-                wanted_tag = 'v{0}'.format(wanted_version)
-            else:
-                wanted_tag = None
+        tags_data = _load_tags_page(tags_json, tags_url)
+
+        # Github caps the page size, so fetch any further pages
+        # the first one links to concurrently
+        last_page = get_last_page(tags_json)
+        if max_tag_count:
+            last_page = min(last_page,
+                            max(1, (max_tag_count + TAGS_PER_PAGE - 1) // TAGS_PER_PAGE))
+        if last_page > 1:
+            pages = range(2, last_page + 1)
+            pool = ThreadPool(min(TAG_PAGE_FETCH_JOBS, len(pages)))
+            try:
+                page_responses = pool.map(lambda page: _get_tags_page(tags_url, github_token, page),
+                                          pages)
+            finally:
+                pool.close()
+                pool.join()
+
+            for page, page_response in zip(pages, page_responses):
+                if not validate_github_access(page_response):
+                    msg = ("github::get_valid_tags: "
+                           "Could not fetch page %s of %s for '%s'"
+                           % (page, last_page, tags_url))
+                    raise GithubRepositoryConnectionException(msg)
+                tags_data.extend(_load_tags_page(page_response, tags_url))
+
+            # Tags created while we were paging shift entries onto
+            # the next page, so drop any we have seen twice
+            seen_tag_names = set()
+            merged_tags_data = []
+            for tag_data in tags_data:
+                if tag_data['name'] not in seen_tag_names:
+                    seen_tag_names.add(tag_data['name'])
+                    merged_tags_data.append(tag_data)
+            tags_data = merged_tags_data
+
+        fetch_time = time.time() - fetch_start_time
+        with _tag_fetch_stats_lock:
+            _tag_fetch_stats["%s/%s" % (org_name, formula_name)] = {
+                'pages': last_page,
+                'seconds': fetch_time,
+            }
+        shaker.libs.logger.Logger().debug("github::get_valid_tags: "
+                                          "Fetched %s tags for %s/%s in %s pages, %.2fs"
+                                          % (len(tags_data),
+                                             org_name,
+                                             formula_name,
+                                             last_page,
+                                             fetch_time))
 
-        except ValueError as e:
-            msg = ("github::get_valid_tags: "
-                   "Invalid json for url '%s': %s"
-                   % (tags_url,
-                      e.message))
-            raise ValueError(msg)
+        wanted_tag, tag_versions, _ = get_valid_tags_from_data(tags_data)
+        if tag_cache is not None:
+            tag_cache.store(org_name, formula_name, wanted_tag, tags_data)
     else:
         wanted_tag = None
 
@@ -257,6 +354,167 @@ def get_valid_tags(org_name,
     return wanted_tag, tag_versions, tags_data
 
 
+def get_valid_tags_from_data(tags_data):
+    """
+    Calculate the preferred tag and semver compliant tag versions
+    from a list of tag data that has already been fetched
+
+    Args:
+        tags_data(list): Data for all tags, in the github format
+
+    Returns:
+        string: The tag that is calculated to be the 'preferred' one
+        list: All the tag versions found that were semver compliant
+        dictionary: Data for all tags, semver compliant or not
+    """
+    tag_versions = get_tag_versions(tags_data)
+    wanted_version = get_latest_tag(tag_versions,
+                                    include_prereleases=False)
+    if wanted_version:
+        wanted_tag = 'v{0}'.format(wanted_version)
+    else:
+        wanted_tag = None
+    return wanted_tag, tag_versions, tags_data
+
+
+def get_version_index(org_name, formula_name, tags_data):
+    """
+    Get the version index of a repository's tags, reusing the index
+    built for the repository earlier in the run if its tags are the same
+
+    Args:
+        org_name(string): The organisation name of the repository
+        formula_name(string): The formula name of the repository
+        tags_data(list): Data for all the repository's tags, in the
+            github format
+
+    Returns:
+        VersionIndex: The index of the tags
+    """
+    key = (org_name, formula_name)
+    with _version_indexes_lock:
+        cached = _version_indexes.get(key, None)
+    # Comparing the tag data is far cheaper than parsing and sorting it
+    if cached is not None and (cached[0] is tags_data or cached[0] == tags_data):
+        return cached[1]
+
+    index = VersionIndex(tags_data)
+    with _version_indexes_lock:
+        _version_indexes[key] = (tags_data, index)
+    return index
+
+
+def get_last_page(response):
+    """
+    Get the number of the last page of a paginated github response
+    from its Link header
+
+    Args:
+        response(requests.models.Response): The response of the first page
+
+    Returns:
+        int: The last page number, 1 if the response is not paginated
+    """
+    last_link = response.links.get('last', {}).get('url', None)
+    if not last_link:
+        return 1
+    query = urlparse.parse_qs(urlparse.urlparse(last_link).query)
+    try:
+        return int(query.get('page', ['1'])[0])
+    except ValueError:
+        shaker.libs.logger.Logger().warning("github::get_last_page: "
+                                            "Could not parse page from link '%s'"
+                                            % (last_link))
+    return 1
+
+
+def get_tag_fetch_stats():
+    """
+    Get the page count and fetch time of each repository's
+    tags fetched from github
+
+    Returns:
+        dictionary: Keys of <organisation>/<name> to a dictionary of
+            the form, {'pages': <page count>, 'seconds': <fetch time>}
+    """
+    with _tag_fetch_stats_lock:
+        return dict(_tag_fetch_stats)
+
+
+def _get_tags_page(tags_url, github_token, page):
+    """
+    Fetch a single page of tags
+
+    Args:
+        tags_url(string): The tags url of the repository
+        github_token(string): The github token to authenticate with
+        page(int): The page number to fetch
+
+    Returns:
+        requests.models.Response: The response from github
+    """
+    page_url = "%s?per_page=%s&page=%s" % (tags_url, TAGS_PER_PAGE, page)
+    return shaker.libs.http_client.get_client().get(page_url,
+                                                    auth=(github_token, 'x-oauth-basic'),
+                                                    use_cache=True)
+
+
+def _load_tags_page(response, tags_url):
+    """
+    Load the json tag data from a page of tags
+
+    Args:
+        response(requests.models.Response): The response from github
+        tags_url(string): The tags url of the repository
+
+    Returns:
+        list: The tag data on the page
+    """
+    try:
+        return json.loads(response.text)
+    except ValueError as e:
+        msg = ("github::get_valid_tags: "
+               "Invalid json for url '%s': %s"
+               % (tags_url,
+                  e.message))
+        raise ValueError(msg)
+
+
+def get_tag_versions(tags_data):
+    """
+    Get the sorted versions of all the semver compliant tags in
+    a list of github tag data
+
+    Args:
+        tags_data(list): Data for all tags, semver compliant or not
+
+    Returns:
+        list: All the tag versions found that were semver compliant
+    """
+    tag_versions = []
+    for tag in tags_data:
+        raw_name = tag['name']
+
+        semver_info = convert_tag_to_semver(raw_name)
+        # If we have a semver valid tag, then add,
+        # otherwise ignore
+        if len(semver_info) > 0:
+            parsed_tag_version_results = version_tag_re.match(raw_name)
+            if parsed_tag_version_results:
+                shaker.libs.logger.Logger().debug("github::get_tag_versions: "
+                                                  "Appending valid tag %s'"
+                                                  % (raw_name))
+                parsed_tag_version = parsed_tag_version_results.group("tag")
+                tag_versions.append(parsed_tag_version)
+        else:
+            shaker.libs.logger.Logger().warning("github::get_tag_versions: "
+                                                "Ignoring semver invalid tag %s'"
+                                                % (raw_name))
+
+    tag_versions.sort(key=LooseVersion)
+    return tag_versions
+
+
 def get_branch_data(org_name,
                     formula_name,
                     branch_name):
@@ -287,8 +545,9 @@ def get_branch_data(org_name,
     shaker.libs.logger.Logger().debug("github::get_branch_data: "
                                       "branch_url %s "
                                       % (branch_url))
-    branch_json = requests.get(branch_url,
-                               auth=(github_token, 'x-oauth-basic'))
+    branch_json = shaker.libs.http_client.get_client().get(branch_url,
+                                                           auth=(github_token, 'x-oauth-basic'),
+                                                           use_cache=True)
 
     shaker.libs.logger.Logger().debug("github::get_branch_data: "
                                       "Calling validate_github_access with %s "
@@ -309,6 +568,84 @@ def get_branch_data(org_name,
     return branch_data
 
 
+def get_tag_data(org_name,
+                 formula_name,
+                 tag_name):
+    """
+    Look up a single tag of a repository with the git refs api, rather
+    than listing all of its tags. Annotated tags are peeled to the
+    commit they tag
+
+    Args:
+        org_name(string): The organisation name of the repository
+        formula_name(string): The formula name of the repository
+        tag_name(string): Name of the tag, eg, 'v1.2.3'
+
+    Returns:
+        dictionary: Data for the tag, in the form of the tag list, eg,
+            {'name': 'v1.2.3', 'commit': {'sha': <sha>}}, None type if
+            there is no such tag
+    """
+    github_token = get_valid_github_token()
+    if not github_token:
+        msg = "github::get_tag_data: No valid github token"
+        raise GithubRepositoryConnectionException(msg)
+
+    ref_url = ('https://api.github.com/repos/%s/%s/git/ref/tags/%s'
+               % (org_name, formula_name, tag_name))
+    ref_json = shaker.libs.http_client.get_client().get(ref_url,
+                                                        auth=(github_token, 'x-oauth-basic'),
+                                                        use_cache=True)
+    tag_data = None
+    if validate_github_access(ref_json, ref_url):
+        try:
+            ref_object = json.loads(ref_json.text).get('object', {})
+            if ref_object.get('type', None) == 'tag':
+                tag_url = ('https://api.github.com/repos/%s/%s/git/tags/%s'
+                           % (org_name, formula_name, ref_object.get('sha', None)))
+                tag_json = shaker.libs.http_client.get_client().get(tag_url,
+                                                                    auth=(github_token, 'x-oauth-basic'),
+                                                                    use_cache=True)
+                if validate_github_access(tag_json, tag_url):
+                    ref_object = json.loads(tag_json.text).get('object', {})
+                else:
+                    ref_object = {}
+        except (ValueError, AttributeError) as e:
+            msg = ("github::get_tag_data: "
+                   "Invalid json for url '%s': %s"
+                   % (ref_url,
+                      e))
+            raise ValueError(msg)
+        if ref_object.get('sha', None):
+            tag_data = {
+                'name': tag_name,
+                'commit': {
+                    'sha': ref_object['sha'],
+                },
+            }
+
+    with _tag_lookup_stats_lock:
+        _tag_lookup_stats['lookups'] += 1
+        if tag_data is not None:
+            _tag_lookup_stats['found'] += 1
+    shaker.libs.logger.Logger().debug("github::get_tag_data: %s/%s: "
+                                      "Looked up tag '%s', found %s"
+                                      % (org_name, formula_name, tag_name, tag_data))
+    return tag_data
+
+
+def get_tag_lookup_stats():
+    """
+    Get the number of single tags looked up with the git refs api
+
+    Returns:
+        dictionary: Lookup statistics of the form,
+            {'lookups': <tags looked up>, 'found': <tags that existed>}
+    """
+    with _tag_lookup_stats_lock:
+        return dict(_tag_lookup_stats)
+
+
 def get_latest_tag(tag_versions,
                    include_prereleases=False):
     """
@@ -412,7 +749,7 @@ def is_tag_prerelease(tag):
     return False
 
 
-def resolve_constraint_to_object(org_name, formula_name, constraint):
+def resolve_constraint_to_object(org_name, formula_name, constraint, valid_tags=None):
     """
     For a given formula, take the constraint and compare it to
     the repositories available tags. Then try to find a tag that
@@ -425,7 +762,11 @@ def resolve_constraint_to_object(org_name, formula_name, constraint):
         org_name(string): The organisation name of the formula
         formula_name(string): The formula name
         constraint(string): The constraint to be applied, in the form
-            <comparator><tag>. eg, '==v1.0.1', '>=2.0.1'
+            <comparator><tag>. eg, '==v1.0.1', '>=2.0.1', or a compound
+            of bounds, eg, '>=v1.0.1,<=v2.0.1'
+        valid_tags(tuple): (optional) The wanted tag, tag versions and
+            tag data of the repository, as returned by get_valid_tags,
+            if they have already been fetched
 
     Returns:
         dictionary: Json data from github associated with the resolved tag
@@ -435,8 +776,8 @@ def resolve_constraint_to_object(org_name, formula_name, constraint):
                                       "resolve_constraint_to_object(%s, %s, %s)"
                                       % (org_name, formula_name, constraint))
 
-    # do we have a constraint?
-    if constraint:
+    # do we have a single constraint?
+    if constraint and CONSTRAINT_SEPARATOR not in constraint:
         # is it a branch or a tag?
         shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
                                           "constraint is not empty '%s'"
@@ -446,8 +787,8 @@ def resolve_constraint_to_object(org_name, formula_name, constraint):
                                           "parsed_constraint '%s'"
                                           % (org_name, formula_name, str(parsed_constraint)))
         # is it a branch (i.e. not a version)
-        if not parsed_constraint['version']:
-            branch_name = parsed_constraint['tag']
+        if not parsed_constraint.version:
+            branch_name = parsed_constraint.tag
             shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
                                               "There is no version, assuming this is "
                                               "a branch, name: '%s'"
@@ -461,28 +802,17 @@ def resolve_constraint_to_object(org_name, formula_name, constraint):
             return branch_data
 
     # carry on with version analyses
-    wanted_tag, tag_versions, tags_data = get_valid_tags(org_name, formula_name)
+    if valid_tags is None:
+        valid_tags = get_valid_tags(org_name, formula_name)
+    wanted_tag, _, tags_data = valid_tags
+    index = get_version_index(org_name, formula_name, tags_data)
     if not constraint or (constraint == ''):
         shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
                                           "No constraint specified, returning '%s'"
                                           % (org_name,
                                              formula_name,
                                              wanted_tag))
-        obj = None
-        shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
-                                          "type of tags_data: %s"
-                                          % (org_name,
-                                             formula_name,
-                                             type(tags_data)))
-        for tag_data in tags_data:
-            if tag_data["name"] == wanted_tag:
-                obj = tag_data
-                shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
-                                                  "type of (note no s!) tag_data: %s"
-                                                  % (org_name,
-                                                     formula_name,
-                                                     type(tag_data)))
-                break
+        obj = index.get(wanted_tag)
         shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
                                           "returning obj: '%s' type: %s"
                                           % (org_name,
@@ -490,26 +820,48 @@ def resolve_constraint_to_object(org_name, formula_name, constraint):
                                              str(obj), type(obj)))
         return obj
 
+    # A compound constraint, eg, '>=v1.0.0,<=v2.0.0', from merging bounds
+    if CONSTRAINT_SEPARATOR in constraint:
+        interval = VersionInterval.parse(constraint)
+        try:
+            valid_tag = index.find_latest_between(interval.lowest.tag[1:] if interval.lowest else None,
+                                                  interval.highest.tag[1:] if interval.highest else None)
+        except ValueError as e:
+            raise ConstraintResolutionException("github::resolve_constraint_to_object: %s/%s: "
+                                                "Could not compare constraint %s: %s"
+                                                % (org_name,
+                                                   formula_name,
+                                                   constraint,
+                                                   e))
+        if not valid_tag:
+            raise ConstraintResolutionException("github::resolve_constraint_to_object: %s/%s: "
+                                                " No non-prerelease version found %s"
+                                                % (org_name,
+                                                   formula_name,
+                                                   constraint))
+        shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
+                                          "Found valid version '%s' in '%s'"
+                                          % (org_name,
+                                             formula_name,
+                                             valid_tag,
+                                             constraint))
+        return index.get(valid_tag)
+
     parsed_constraint = metadata.parse_constraint(constraint)
-    parsed_comparator = parsed_constraint['comparator']
-    parsed_tag = parsed_constraint['tag']
-    parsed_version = parsed_constraint['version']
+    parsed_comparator = parsed_constraint.comparator
+    parsed_tag = parsed_constraint.tag
+    parsed_version = parsed_constraint.version
 
     # See if we can pick up a version
-    if tag_versions and parsed_version:
+    if len(index) and parsed_version:
         if parsed_comparator == '==':
-            if parsed_version in tag_versions:
+            if index.has_version(parsed_version):
                 shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
                                                   "Found exact version '%s'"
                                                   % (org_name,
                                                      formula_name,
                                                      parsed_version))
-                obj = None
-                for tag_data in tags_data:
-                    if tag_data["name"] == parsed_tag:
-                        obj = tag_data
-                        break
-                return obj
+                return index.get(parsed_tag)
             else:
                 raise ConstraintResolutionException("github::resolve_constraint_to_object: %s/%s: "
                                                     "Could not satisfy constraint for '%s', "
@@ -518,76 +870,41 @@ def resolve_constraint_to_object(org_name, formula_name, constraint):
                                                        formula_name,
                                                        constraint,
                                                        parsed_constraint,
-                                                       tag_versions))
+                                                       index.versions))
         else:
             # Get a versioned tag (eg, v1.1.0) that is most greater than,
-            # or least less than
+            # or least less than, skipping pre-releases
             # but also not another type of tag (eg 'fdfsdfdsfsd')
-            valid_version = None
-            if parsed_comparator == '>=':
-                # Get latest non pre-release version
-                for tag_version in reversed(tag_versions):
-                    if (tag_version >= parsed_version):
-                        if not is_tag_prerelease(tag_version):
-                            valid_version = tag_version
-                            break
-                        else:
-                            shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
-                                                              "Skipping pre-release version '%s'"
-                                                              % (org_name,
-                                                                 formula_name,
-                                                                 tag_version))
-                    else:
-                        raise ConstraintResolutionException("github::resolve_constraint_to_object: %s/%s: "
-                                                            " No non-prerelease version found %s"
-                                                            % (org_name,
-                                                               formula_name,
-                                                               constraint))
-
-            elif parsed_comparator == '<=':
-                valid_version = None
-                for tag_version in reversed(tag_versions):
-                    if (tag_version <= parsed_version):
-                        if not is_tag_prerelease(tag_version):
-                            valid_version = tag_version
-                            break
-                        else:
-                            shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
-                                                              "Skipping pre-release version '%s'"
-                                                              % (org_name,
-                                                                 formula_name,
-                                                                 tag_version))
-
-                if not valid_version:
-                    raise ConstraintResolutionException("github::resolve_constraint_to_object: %s/%s: "
-                                                        " No non-prerelease version found '%s'"
-                                                        % (org_name,
-                                                           formula_name,
-                                                           constraint))
-            else:
-                msg = ("github::resolve_constraint_to_object: "
-                       "Unknown comparator '%s/%s%s'" % (org_name,
-                                                         formula_name,
-                                                         parsed_comparator))
-                raise ConstraintResolutionException(msg)
+            try:
+                if parsed_comparator == '>=':
+                    # Get latest non pre-release version
+                    valid_tag = index.find_at_least(parsed_version)
+                elif parsed_comparator == '<=':
+                    valid_tag = index.find_at_most(parsed_version)
+                else:
+                    msg = ("github::resolve_constraint_to_object: "
+                           "Unknown comparator '%s/%s%s'" % (org_name,
+                                                             formula_name,
+                                                             parsed_comparator))
+                    raise ConstraintResolutionException(msg)
+            except ValueError as e:
+                raise ConstraintResolutionException("github::resolve_constraint_to_object: %s/%s: "
+                                                    "Could not compare constraint %s: %s"
+                                                    % (org_name,
+                                                       formula_name,
+                                                       constraint,
+                                                       e))
 
-            if valid_version:
+            if valid_tag:
                 shaker.libs.logger.Logger().debug("github::resolve_constraint_to_object: %s/%s: "
                                                   "resolve_constraint_to_object:Found valid version '%s'"
                                                   % (org_name,
                                                      formula_name,
-                                                     valid_version))
-                valid_tag = 'v%s' % valid_version
-                obj = None
-                for tag_data in tags_data:
-                    if tag_data["name"] == valid_tag:
-                        obj = tag_data
-                        break
-
-                return obj
+                                                     valid_tag))
+                return index.get(valid_tag)
             else:
                 raise ConstraintResolutionException("github::resolve_constraint_to_object: %s/%s: "
-                                                    'Constraint %s cannot be satisfied'
+                                                    " No non-prerelease version found %s"
                                                     % (org_name,
                                                        formula_name,
                                                        constraint))
@@ -595,11 +912,75 @@ def resolve_constraint_to_object(org_name, formula_name, constraint):
         msg = ("github::resolve_constraint_to_object: "
                "Unknown parsed constraint '%s' from '%s'" % (parsed_constraint, constraint))
         raise ConstraintResolutionException(msg)
-    raise ConstraintResolutionException("github::resolve_constraint_to_object: %s/%s: "
-                                        'Constraint {} cannot be satisfied'.format(org_name,
-                                                                                   formula_name,
-                                                                                   constraint))
-    return None
+
+
+def resolve_minimal_constraint_to_object(org_name, formula_name, constraint):
+    """
+    Resolve a constraint with minimal version selection, in the style
+    of go modules. A constraint resolves to the lowest version that
+    satisfies it, so '>=v1.2.0' resolves to 'v1.2.0' itself, and only
+    that tag's existence needs checking, rather than listing every tag
+    in the repository.
+
+    Constraints without a lower bound, on a branch, or whose lowest
+    version has no release tag, are resolved from the tag list, as
+    they are for resolve_constraint_to_object
+
+    Args:
+        org_name(string): The organisation name of the formula
+        formula_name(string): The formula name
+        constraint(string): The constraint to be applied, as for
+            resolve_constraint_to_object
+
+    Returns:
+        dictionary: Json data from github associated with the resolved tag
+
+    Raises:
+        ConstraintResolutionException: If no resolution was possible
+    """
+    interval = VersionInterval.parse(constraint)
+    if interval.pin is not None:
+        target = interval.pin
+        if target.version is None:
+            return resolve_constraint_to_object(org_name, formula_name, constraint)
+    else:
+        # Pre-releases never satisfy a range, so a pre-release bound
+        # needs the tag list to find the release above it
+        target = interval.lowest
+        if target is None or target.key is None or target.postfix is not None:
+            return resolve_constraint_to_object(org_name, formula_name, constraint)
+
+    tag_data = get_tag_data(org_name, formula_name, target.tag)
+    if tag_data:
+        shaker.libs.logger.Logger().debug("github::resolve_minimal_constraint_to_object: %s/%s: "
+                                          "Found minimal version '%s' for '%s'"
+                                          % (org_name, formula_name, target.tag, constraint))
+        return tag_data
+    if interval.pin is not None:
+        raise ConstraintResolutionException("github::resolve_minimal_constraint_to_object: %s/%s: "
+                                            "Could not satisfy constraint '%s', "
+                                            "tag '%s' not found"
+                                            % (org_name, formula_name, constraint, target.tag))
+
+    # The bound isn't a tag itself, eg, '>=v1.2' with a tag 'v1.2.0',
+    # so find the earliest release above it in the tag list
+    shaker.libs.logger.Logger().debug("github::resolve_minimal_constraint_to_object: %s/%s: "
+                                      "No tag '%s', searching the tag list"
+                                      % (org_name, formula_name, target.tag))
+    _, _, tags_data = get_valid_tags(org_name, formula_name)
+    index = get_version_index(org_name, formula_name, tags_data)
+    try:
+        valid_tag = index.find_earliest_between(interval.lowest.tag[1:],
+                                                interval.highest.tag[1:] if interval.highest else None)
+    except ValueError as e:
+        raise ConstraintResolutionException("github::resolve_minimal_constraint_to_object: %s/%s: "
+                                            "Could not compare constraint %s: %s"
+                                            % (org_name, formula_name, constraint, e))
+    if not valid_tag:
+        raise ConstraintResolutionException("github::resolve_minimal_constraint_to_object: %s/%s: "
+                                            " No non-prerelease version found %s"
+                                            % (org_name, formula_name, constraint))
+    return index.get(valid_tag)
 
 
 def get_valid_github_token(online_validation_enabled=False):
@@ -624,9 +1005,9 @@ def get_valid_github_token(online_validation_enabled=False):
         # valid and we're not locked out
         if online_validation_enabled:
             url = "https://api.github.com"
-            response = requests.get(url,
-                                    auth=(os.environ["GITHUB_TOKEN"],
-                                          'x-oauth-basic'))
+            response = shaker.libs.http_client.get_client().get(url,
+                                                                auth=(os.environ["GITHUB_TOKEN"],
+                                                                      'x-oauth-basic'))
 
             shaker.libs.logger.Logger().debug("github::get_valid_github_token:"
                                               "Calling validate_github_access with %s" % (str(response)))
@@ -716,7 +1097,10 @@ def validate_github_access(response, url=None):
 
 
 def open_repository(url,
-                    target_directory):
+                    target_directory,
+                    clone_mode=CLONE_MODE_FULL,
+                    ref=None,
+                    tag=None):
     """
     Make a connection from a remote git repository into a local
     directory.
@@ -724,9 +1108,20 @@ def open_repository(url,
     Args:
         url(string): The remote github url of the repository
         target_directory(string): The local target directory
+        clone_mode(string): How to clone a new repository, one of
+            'full' for the whole history of every branch, 'shallow' for
+            only the ref at depth 1 or 'tags' for only refs/tags/*
+        ref(string): The tag, branch or sha that will be checked out,
+            used to pick what to fetch in shallow mode, and fetched
+            into an existing repository that does not have it. With
+            a mirror cache configured, new repositories borrow the
+            mirror's objects whatever the clone mode
+        tag(string): The tag or branch a sha ref was resolved from,
+            fetched in its place, as a raw sha can't always be fetched
 
     Returns:
-        pygit2.repo: The repository object created
+        pygit2.repo: The repository object created, or False if an
+            existing repository could not be updated to have the ref
     """
     git_url = urlparse.urlparse(url)
     username = git_url.netloc.split('@')[0]\
@@ -738,13 +1133,36 @@ def open_repository(url,
 
     # If local directory exists, then make a connection to it
     # Otherwise, clone the remote repo into the new directory
-    if os.path.isdir(target_directory):
+    existing_repository = os.path.isdir(target_directory)
+    if existing_repository and not os.path.isdir(os.path.join(target_directory, '.git')):
+        # A tarball or tree store install has no repository to
+        # update, so replace it with a clone
+        shaker.libs.logger.Logger().debug("open_repository: "
+                                          "Removing '%s', it is not a git repository"
+                                          % (target_directory))
+        shutil.rmtree(target_directory)
+        existing_repository = False
+    if existing_repository:
         shaker.libs.logger.Logger().debug("open_repository: "
                                           "Opening url '%s' "
                                           "with existing local repository '%s'"
                                           % (url, target_directory))
         repo = pygit2.Repository(target_directory)
+    elif shaker.libs.mirror_cache.get_mirror_cache() is not None:
+        repo = shaker.libs.mirror_cache.get_mirror_cache().create_repository(url,
+                                                                             target_directory,
+                                                                             ref,
+                                                                             credentials)
+    elif clone_mode != CLONE_MODE_FULL:
+        repo = _clone_refs(url,
+                           target_directory,
+                           credentials,
+                           clone_mode,
+                           ref,
+                           tag)
     else:
+        start_time = time.time()
+        transfer = {}
         # Try to use pygit2 0.22 cloning
         try:
             shaker.libs.logger.Logger().debug("open_repository: "
@@ -760,11 +1178,15 @@ def open_repository(url,
                                               "Trying to open repository "
                                               "using pygit2 0.23 format")
             # Try to use pygit2 0.23 cloning
-            callbacks = pygit2.RemoteCallbacks(credentials)
+            callbacks = _get_remote_callbacks(credentials, transfer)
             repo = pygit2.clone_repository(url,
                                            target_directory,
                                            callbacks=callbacks)
 
+        _record_clone_stats(target_directory,
+                            clone_mode,
+                            transfer.get('received_bytes', 0),
+                            time.time() - start_time)
         shaker.libs.logger.Logger().debug(":open_repository: "
                                           "Cloning url '%s' into local repository '%s'"
                                           % (url, target_directory))
@@ -774,12 +1196,381 @@ def open_repository(url,
         origin = filter(lambda x: x.name == 'origin', repo.remotes)
     origin[0].credentials = credentials
 
+    # An existing repository may predate the ref we want, so ask the
+    # remote for just that ref, but only when we don't already have it.
+    # Branches can move upstream, so they are always fetched again
+    if not ref or has_fixed_ref(repo, ref):
+        return repo
+
+    if shaker.libs.mirror_cache.get_mirror_cache() is not None:
+        repo = shaker.libs.mirror_cache.get_mirror_cache().update_repository(repo,
+                                                                             url,
+                                                                             ref,
+                                                                             credentials)
+    else:
+        start_time = time.time()
+        depth = 1 if clone_mode == CLONE_MODE_SHALLOW else 0
+        received_bytes = 0
+        try:
+            received_bytes = fetch_refs(repo,
+                                        origin[0],
+                                        get_clone_refspecs(CLONE_MODE_SHALLOW, ref, tag),
+                                        credentials=credentials,
+                                        depth=depth,
+                                        follow_tags=False)
+        except GithubRepositoryConnectionException as e:
+            shaker.libs.logger.Logger().debug("github::open_repository: "
+                                              "Could not fetch '%s' into '%s': %s"
+                                              % (ref, target_directory, e))
+        if not has_ref(repo, ref):
+            # Not every server or libgit2 can fetch a raw sha, fall
+            # back to the tags and branches it could be reached from
+            shaker.libs.logger.Logger().debug("github::open_repository: "
+                                              "Fetching tags and branches into '%s' "
+                                              "for '%s'"
+                                              % (target_directory, ref))
+            try:
+                received_bytes += fetch_refs(repo,
+                                             origin[0],
+                                             TAGS_AND_BRANCHES_REFSPECS,
+                                             credentials=credentials)
+            except GithubRepositoryConnectionException as e:
+                shaker.libs.logger.Logger().warning("github::open_repository: "
+                                                    "Could not fetch tags and branches "
+                                                    "into '%s': %s"
+                                                    % (target_directory, e))
+        _record_incremental_fetch_stats(target_directory,
+                                        received_bytes,
+                                        time.time() - start_time)
+
+    # An existing repository that still doesn't have the ref can't
+    # be checked out, so let the caller clone it again. New clones
+    # are left to the checkout to report the missing ref
+    if existing_repository and not has_ref(repo, ref):
+        shaker.libs.logger.Logger().warning("github::open_repository: "
+                                            "Could not find '%s' in existing "
+                                            "repository '%s'"
+                                            % (ref, target_directory))
+        return False
+
     return repo
 
 
+def has_ref(repo, ref):
+    """
+    Check whether a repository has a tag, remote branch or sha
+
+    Args:
+        repo(pygit2.Repository): The repository to look in
+        ref(string): The tag, branch or sha to look for
+
+    Returns:
+        bool: True if the repository has the ref, False otherwise
+    """
+    if sha_re.match(ref):
+        return ref in repo
+    try:
+        repo.revparse_single(ref)
+        return True
+    except KeyError:
+        pass
+    branch = repo.lookup_branch(("origin/%s" % ref),
+                                pygit2.GIT_BRANCH_REMOTE)
+    return branch is not None
+
+
+def has_fixed_ref(repo, ref):
+    """
+    Check whether a repository has a tag or sha, the refs that
+    don't move upstream, so having one means it needn't be fetched
+
+    Args:
+        repo(pygit2.Repository): The repository to look in
+        ref(string): The tag, branch or sha to look for
+
+    Returns:
+        bool: True if the repository has the ref as a tag or sha,
+            False otherwise, including for any branch
+    """
+    if sha_re.match(ref):
+        return ref in repo
+    try:
+        repo.lookup_reference("refs/tags/%s" % (ref))
+        return True
+    except (KeyError, ValueError):
+        return False
+
+
+def get_clone_refspecs(clone_mode, ref=None, tag=None):
+    """
+    Get the refspecs to fetch for a clone mode
+
+    Args:
+        clone_mode(string): The clone mode, 'shallow' or 'tags'
+        ref(string): The tag, branch or sha to be checked out
+        tag(string): The tag or branch a sha ref was resolved from,
+            to fetch in place of the sha
+
+    Returns:
+        list: The refspecs to fetch
+    """
+    tags_refspec = '+refs/tags/*:refs/tags/*'
+    if clone_mode == CLONE_MODE_TAGS or not ref:
+        return [tags_refspec]
+    if sha_re.match(ref):
+        if not tag:
+            return [ref]
+        # libgit2 can't fetch a raw sha, but can fetch the tag
+        # it was resolved from
+        ref = tag
+    # We don't know if the ref is a tag or branch, but refspecs that
+    # match nothing on the remote are ignored, so ask for both
+    return ['+refs/tags/%s:refs/tags/%s' % (ref, ref),
+            '+refs/heads/%s:refs/remotes/origin/%s' % (ref, ref)]
+
+
+def fetch_refs(repo,
+               remote,
+               refspecs,
+               credentials=None,
+               depth=0,
+               follow_tags=True):
+    """
+    Fetch refspecs from a remote into a repository
+
+    Args:
+        repo(pygit2.Repository): The repository to fetch into
+        remote(pygit2.Remote): The remote to fetch from
+        refspecs(list): The refspecs to fetch
+        credentials(object): The credentials to connect with
+        depth(int): The depth of history to fetch, 0 for all of it
+        follow_tags(bool): False to drop the tags the fetch follows into
+            the history it brought down, so only the refs asked for are
+            left. Refspecs that name tags still fetch them
+
+    Returns:
+        int: The number of bytes received
+    """
+    transfer = {}
+    callbacks = _get_remote_callbacks(credentials, transfer)
+    shaker.libs.logger.Logger().debug("github::fetch_refs: "
+                                      "Fetching %s from '%s' at depth %s"
+                                      % (refspecs, remote.url, depth))
+    # pygit2 has no per fetch tag option, and setting the remote's
+    # tagopt would outlive the run, so note the tags we have to drop
+    # any new ones nobody asked for afterwards
+    previous_references = None if follow_tags else set(repo.listall_references())
+    try:
+        if depth:
+            try:
+                remote.fetch(refspecs, callbacks=callbacks, depth=depth)
+            except TypeError:
+                # Depth is only supported on newer pygit2, so
+                # fetch the full history of the refs instead
+                shaker.libs.logger.Logger().debug("github::fetch_refs: "
+                                                  "Shallow fetches not supported, "
+                                                  "fetching full history")
+                remote.fetch(refspecs, callbacks=callbacks)
+        else:
+            remote.fetch(refspecs, callbacks=callbacks)
+    except pygit2.GitError as e:
+        msg = ("github::fetch_refs: Problem fetching %s from '%s': %s"
+               % (refspecs, remote.url, e))
+        raise GithubRepositoryConnectionException(msg)
+
+    if previous_references is not None:
+        for reference_name in repo.listall_references():
+            if (reference_name.startswith('refs/tags/') and
+                    reference_name not in previous_references and
+                    not _is_refspec_destination(reference_name, refspecs)):
+                shaker.libs.logger.Logger().debug("github::fetch_refs: "
+                                                  "Dropping followed tag '%s'"
+                                                  % (reference_name))
+                repo.lookup_reference(reference_name).delete()
+    return transfer.get('received_bytes', 0)
+
+
+def _is_refspec_destination(reference_name, refspecs):
+    """
+    Check whether a reference is one a set of refspecs fetch into
+
+    Args:
+        reference_name(string): The reference, eg, 'refs/tags/v1.0.1'
+        refspecs(list): The refspecs, eg, ['+refs/tags/*:refs/tags/*']
+
+    Returns:
+        bool: True if a refspec fetches into the reference
+    """
+    for refspec in refspecs:
+        destination = refspec.lstrip('+').split(':')[-1]
+        if destination.endswith('*'):
+            if reference_name.startswith(destination[:-1]):
+                return True
+        elif reference_name == destination:
+            return True
+    return False
+
+
+def get_clone_stats():
+    """
+    Get the transfer statistics of the repositories cloned so far
+
+    Returns:
+        dictionary: Dictionary of repository paths to statistics of the form,
+            {
+                'mode': <clone mode>,
+                'bytes': <bytes received>,
+                'seconds': <time taken>,
+            }
+    """
+    with _clone_stats_lock:
+        return dict(_clone_stats)
+
+
+def get_incremental_fetch_stats():
+    """
+    Get the transfer statistics of the refs fetched into existing
+    repositories so far
+
+    Returns:
+        dictionary: Dictionary of repository paths to statistics of the form,
+            {
+                'bytes': <bytes received>,
+                'seconds': <time taken>,
+            }
+    """
+    with _clone_stats_lock:
+        return dict(_incremental_fetch_stats)
+
+
+def _clone_refs(url,
+                target_directory,
+                credentials,
+                clone_mode,
+                ref=None,
+                tag=None):
+    """
+    Clone a repository by initialising it and fetching only the
+    refs needed for a clone mode
+
+    Args:
+        url(string): The remote github url of the repository
+        target_directory(string): The local target directory
+        credentials(object): The credentials to connect with
+        clone_mode(string): The clone mode, 'shallow' or 'tags'
+        ref(string): The tag, branch or sha to be checked out
+        tag(string): The tag or branch a sha ref was resolved from
+
+    Returns:
+        pygit2.repo: The repository object created
+    """
+    shaker.libs.logger.Logger().debug("github::_clone_refs: "
+                                      "Cloning url '%s' into local repository '%s' "
+                                      "in %s mode for ref '%s'"
+                                      % (url, target_directory, clone_mode, ref))
+    start_time = time.time()
+    repo = pygit2.init_repository(target_directory)
+    remote = repo.create_remote('origin', url)
+    depth = 1 if clone_mode == CLONE_MODE_SHALLOW else 0
+    received_bytes = 0
+    try:
+        received_bytes = fetch_refs(repo,
+                                    remote,
+                                    get_clone_refspecs(clone_mode, ref, tag),
+                                    credentials=credentials,
+                                    depth=depth,
+                                    follow_tags=False)
+    except GithubRepositoryConnectionException as e:
+        if not (ref and sha_re.match(ref)):
+            raise
+        shaker.libs.logger.Logger().debug("github::_clone_refs: "
+                                          "Could not fetch sha '%s': %s"
+                                          % (ref, e))
+    if ref and not has_ref(repo, ref):
+        # Not every server or libgit2 can fetch a raw sha, and a
+        # tags clone has no branches, so fall back to the tags and
+        # branches the ref could be reached from
+        shaker.libs.logger.Logger().debug("github::_clone_refs: "
+                                          "Did not get '%s', fetching "
+                                          "tags and branches"
+                                          % (ref))
+        received_bytes += fetch_refs(repo,
+                                     remote,
+                                     TAGS_AND_BRANCHES_REFSPECS,
+                                     credentials=credentials)
+    _record_clone_stats(target_directory,
+                        clone_mode,
+                        received_bytes,
+                        time.time() - start_time)
+    return repo
+
+
+def _get_remote_callbacks(credentials, transfer):
+    """
+    Get the callbacks for talking to a remote, recording the
+    transfer progress as it goes
+
+    Args:
+        credentials(object): The credentials to connect with
+        transfer(dictionary): Dictionary to keep the 'received_bytes' in
+
+    Returns:
+        pygit2.RemoteCallbacks: The callbacks
+    """
+    callbacks = pygit2.RemoteCallbacks(credentials)
+
+    def transfer_progress(stats):
+        transfer['received_bytes'] = stats.received_bytes
+
+    callbacks.transfer_progress = transfer_progress
+    return callbacks
+
+
+def _record_incremental_fetch_stats(target_directory, received_bytes, seconds):
+    """
+    Record the transfer statistics of an incremental fetch
+
+    Args:
+        target_directory(string): The local directory fetched into
+        received_bytes(int): The number of bytes received
+        seconds(float): The time the fetch took
+    """
+    shaker.libs.logger.Logger().debug("github::open_repository: "
+                                      "Fetched missing ref into '%s', %s bytes in %.2fs"
+                                      % (target_directory, received_bytes, seconds))
+    with _clone_stats_lock:
+        _incremental_fetch_stats[target_directory] = {
+            'bytes': received_bytes,
+            'seconds': seconds,
+        }
+
+
+def _record_clone_stats(target_directory, clone_mode, received_bytes, seconds):
+    """
+    Record the transfer statistics of a clone
+
+    Args:
+        target_directory(string): The local directory cloned into
+        clone_mode(string): The clone mode used
+        received_bytes(int): The number of bytes received
+        seconds(float): The time the clone took
+    """
+    shaker.libs.logger.Logger().debug("github::open_repository: "
+                                      "Cloned '%s' in %s mode, %s bytes in %.2fs"
+                                      % (target_directory, clone_mode, received_bytes, seconds))
+    with _clone_stats_lock:
+        _clone_stats[target_directory] = {
+            'mode': clone_mode,
+            'bytes': received_bytes,
+            'seconds': seconds,
+        }
+
+
 def install_source(target_source,
                    target_directory,
-                   use_tag=False):
+                   use_tag=False,
+                   clone_mode=CLONE_MODE_FULL,
+                   sparse_paths=None):
     """
     Install the requirement as specified by the formula dictionary and
     return the directory symlinked into the roots_dir. The sha revision
@@ -794,10 +1585,16 @@ def install_source(target_source,
                 'url': '<target_url>',
                 'sha': <sha revision to checkout>,
                 'tag': <tag version to checkout>,
+                'version': <tag or branch the sha was resolved from>,
             }
         target_directory(string): THe directory to install into
         use_tag(bool): True to use the tag value for versioning,
             False otherwise
+        clone_mode(string): How to clone the repository if it is not
+            already, one of CLONE_MODES
+        sparse_paths(list): Paths to check out along with metadata.yml
+            and the formula's exports, for a sparse checkout. None type
+            to check out everything
     """
     shaker.libs.logger.Logger().debug("install_source(%s, %s, %s)"
                                       % (target_source,
@@ -817,7 +1614,27 @@ def install_source(target_source,
                                          target_url,
                                          target_sha,
                                          target_tag))
-    target_repository = open_repository(target_url, target_path)
+    target_ref = target_tag if use_tag else target_sha
+    checkout_mode = CHECKOUT_MODE_FULL if sparse_paths is None else CHECKOUT_MODE_SPARSE
+    # Fetch a sha by the tag it was resolved from, so shallow clones
+    # need not fall back to fetching every tag and branch
+    target_fetch_tag = None if use_tag else target_source.get('version', None)
+    target_repository = open_repository(target_url,
+                                        target_path,
+                                        clone_mode=clone_mode,
+                                        ref=target_ref,
+                                        tag=target_fetch_tag)
+    if target_repository is False:
+        # The existing clone couldn't get the ref, so start again
+        shaker.libs.logger.Logger().debug("github::install_source: Cloning '%s' again "
+                                          "into '%s' to find '%s'"
+                                          % (target_url, target_path, target_ref))
+        shutil.rmtree(target_path)
+        target_repository = open_repository(target_url,
+                                            target_path,
+                                            clone_mode=clone_mode,
+                                            ref=target_ref,
+                                            tag=target_fetch_tag)
 
     if use_tag:
         if target_tag is None:
@@ -835,6 +1652,17 @@ def install_source(target_source,
 
             shaker.libs.logger.Logger().debug("github::install_source: Found tag sha '%s' for tag '%s'"
                                               % (target_sha, target_tag))
+            # If we're already at the tag's commit, checked out the
+            # same way, skip
+            if (get_head_sha(target_repository) == target_sha and
+                    get_checkout_mode(target_repository) == checkout_mode):
+                shaker.libs.logger.Logger().debug("github::install_source: %s: "
+                                                  "Already at tag '%s'..."
+                                                  "skipping update: %s"
+                                                  % (target_path,
+                                                     target_tag,
+                                                     target_sha))
+                return True
         except KeyError:
             # Try to find the branch
             branch = target_repository.lookup_branch(("origin/%s" % target_tag),
@@ -858,11 +1686,12 @@ def install_source(target_source,
             shaker.libs.logger.Logger().error("github::install_source: Raw sha usage specified but is empty")
             return False
 
-        current_sha = get_repository_sha(target_path,
-                                         revision='HEAD')
-        # If the local and target shas are the same, skip
-        # otherwise, update the repository
-        if current_sha == target_sha:
+        current_sha = get_head_sha(target_repository)
+        # If the local and target shas are the same, and the working
+        # tree is checked out the same way, skip, otherwise, update
+        # the repository
+        if (current_sha == target_sha and
+                get_checkout_mode(target_repository) == checkout_mode):
             shaker.libs.logger.Logger().debug("github::install_source: %s: "
                                               "Target and current shas are equivalent..."
                                               "skipping update: %s"
@@ -876,23 +1705,283 @@ def install_source(target_source,
     # We should have a sha now, use it to setup the repos
     target_oid = pygit2.Oid(hex=target_sha)
 
-    target_repository.checkout_tree(target_repository[target_oid].tree)
-    shaker.libs.logger.Logger().debug("github::install_source: Checking out oid '%s' in '%s"
-                                      % (target_oid, target_path))
+    try:
+        target_tree = target_repository[target_oid].tree
+    except KeyError:
+        shaker.libs.logger.Logger().error("github::install_source: Could not find sha '%s' in '%s'"
+                                          % (target_sha, target_path))
+        return False
+    checkout_paths = None
+    if sparse_paths is not None:
+        checkout_paths = get_sparse_checkout_paths(target_repository, target_tree, sparse_paths)
+    previous_checkout_mode = get_checkout_mode(target_repository)
+
+    if checkout_paths is not None:
+        shaker.libs.logger.Logger().debug("github::install_source: Checking out paths %s of oid '%s' in '%s"
+                                          % (checkout_paths, target_oid, target_path))
+        # A path checkout leaves every other file as it was, and a
+        # clone has its default branch checked out, so start from
+        # an empty working tree
+        clear_working_tree(target_path)
+        try:
+            target_repository.checkout_tree(target_tree,
+                                            paths=checkout_paths,
+                                            strategy=pygit2.GIT_CHECKOUT_FORCE)
+        except TypeError:
+            # Older pygit2 can't check out a subset of paths
+            shaker.libs.logger.Logger().debug("github::install_source: Sparse checkout not "
+                                              "supported, checking out everything")
+            checkout_paths = None
+            target_repository.checkout_tree(target_tree,
+                                            strategy=pygit2.GIT_CHECKOUT_FORCE)
+    elif previous_checkout_mode != CHECKOUT_MODE_FULL:
+        # A sparse checkout, or one we don't know the mode of, may be
+        # missing files the index still lists, which only a forced
+        # checkout will bring back
+        target_repository.checkout_tree(target_tree,
+                                        strategy=pygit2.GIT_CHECKOUT_FORCE)
+        shaker.libs.logger.Logger().debug("github::install_source: Checking out all of oid '%s' in '%s"
+                                          % (target_oid, target_path))
+    else:
+        target_repository.checkout_tree(target_tree)
+        shaker.libs.logger.Logger().debug("github::install_source: Checking out oid '%s' in '%s"
+                                          % (target_oid, target_path))
     # The line below is *NOT* just setting a value.
     # Pygit2 internally resets the head of the filesystem to the OID we set.
     target_repository.set_head(target_oid)
 
-    if target_repository.head.get_object().hex != target_sha:
-        shaker.libs.logger.Logger().debug("Resetting sha mismatch on source '%s'"
+    # A hard reset would check out every path, so leave sparse checkouts be,
+    # but use one to bring the index of a once sparse checkout back in line
+    if checkout_paths is None and (get_head_sha(target_repository) != target_sha or
+                                   previous_checkout_mode != CHECKOUT_MODE_FULL):
+        shaker.libs.logger.Logger().debug("Resetting sha mismatch or partial checkout on source '%s'"
                                           % (target_name))
         target_repository.reset(target_sha, pygit2.GIT_RESET_HARD)
+    set_checkout_mode(target_repository,
+                      CHECKOUT_MODE_FULL if checkout_paths is None else CHECKOUT_MODE_SPARSE)
 
     shaker.libs.logger.Logger().debug("Source '%s' is at version '%s'"
                                       % (target_name, target_sha))
     return True
 
 
+def get_checkout_mode(repo):
+    """
+    Get how a clone's working tree was last checked out by install_source
+
+    Args:
+        repo(pygit2.Repository): The repository
+
+    Returns:
+        string: CHECKOUT_MODE_FULL or CHECKOUT_MODE_SPARSE, None type
+            if it was not recorded
+    """
+    marker_path = os.path.join(repo.path, CHECKOUT_MARKER)
+    try:
+        with open(marker_path, 'r') as marker_file:
+            return marker_file.read().strip() or None
+    except IOError:
+        return None
+
+
+def set_checkout_mode(repo, checkout_mode):
+    """
+    Record how a clone's working tree has been checked out, in its
+    .git directory so it is never part of the working tree
+
+    Args:
+        repo(pygit2.Repository): The repository
+        checkout_mode(string): CHECKOUT_MODE_FULL or CHECKOUT_MODE_SPARSE
+    """
+    marker_path = os.path.join(repo.path, CHECKOUT_MARKER)
+    try:
+        with open(marker_path, 'w') as marker_file:
+            marker_file.write('%s\n' % (checkout_mode))
+    except IOError as e:
+        shaker.libs.logger.Logger().warning("github::set_checkout_mode: "
+                                            "Could not record checkout mode in '%s': %s"
+                                            % (marker_path, e))
+
+
+def clear_working_tree(path):
+    """
+    Remove everything in a repository's working tree, leaving
+    its .git directory
+
+    Args:
+        path(string): The path of the repository
+    """
+    if not os.path.isdir(path):
+        return
+    for entry_name in os.listdir(path):
+        if entry_name == '.git':
+            continue
+        entry_path = os.path.join(path, entry_name)
+        if os.path.isdir(entry_path) and not os.path.islink(entry_path):
+            shutil.rmtree(entry_path)
+        else:
+            os.remove(entry_path)
+
+
+def get_sparse_checkout_paths(repo, tree, sparse_paths):
+    """
+    Get the paths of a formula's tree that salt uses, its
+    metadata.yml, the exports listed there and the given paths
+
+    Args:
+        repo(pygit2.Repository): The repository the tree is in
+        tree(pygit2.Tree): The tree of the formula's commit
+        sparse_paths(list): The paths to include as well as the exports
+
+    Returns:
+        list: The paths to check out, None type if the exports are
+            unknown and everything should be checked out
+    """
+    try:
+        metadata_entry = tree[SPARSE_METADATA_FILE]
+    except KeyError:
+        shaker.libs.logger.Logger().debug("github::get_sparse_checkout_paths: "
+                                          "No %s, exports unknown"
+                                          % (SPARSE_METADATA_FILE))
+        return None
+
+    try:
+        formula_metadata = yaml.load(repo[metadata_entry.hex].data)
+    except yaml.YAMLError as e:
+        shaker.libs.logger.Logger().debug("github::get_sparse_checkout_paths: "
+                                          "Could not parse %s, exports unknown: %s"
+                                          % (SPARSE_METADATA_FILE, e))
+        return None
+
+    exports = None
+    if isinstance(formula_metadata, dict):
+        exports = formula_metadata.get('exports', None)
+    if not exports:
+        shaker.libs.logger.Logger().debug("github::get_sparse_checkout_paths: "
+                                          "No exports in %s"
+                                          % (SPARSE_METADATA_FILE))
+        return None
+
+    return [SPARSE_METADATA_FILE] + list(exports) + list(sparse_paths)
+
+
+def install_tarball(target_source,
+                    target_directory,
+                    use_tag=False):
+    """
+    Install the requirement as specified by the formula dictionary by
+    streaming the github tarball of its sha, or tag, into the install
+    directory. There is no repository, just the file tree and a marker
+    file holding the version installed, so a formula already at the
+    target version is skipped without contacting github
+
+    Args:
+        target_source(dictionary): A keyed collection of information about the
+            source, as for install_source, with the 'organisation' too
+        target_directory(string): The directory to install into
+        use_tag(bool): True to use the tag value for versioning,
+            False otherwise
+
+    Returns:
+        bool: True if the requirement is installed, False otherwise
+    """
+    target_name = target_source.get('name', None)
+    target_org = target_source.get('organisation', None)
+    target_ref = target_source.get('tag', None) if use_tag else target_source.get('sha', None)
+    if target_ref is None:
+        shaker.libs.logger.Logger().error("github::install_tarball: No %s to install for '%s'"
+                                          % ('tag' if use_tag else 'sha', target_name))
+        return False
+
+    target_path = os.path.join(target_directory,
+                               target_name)
+    marker_path = os.path.join(target_path, INSTALL_MARKER)
+    if os.path.exists(marker_path):
+        with open(marker_path, 'r') as marker_file:
+            if marker_file.read().strip() == target_ref:
+                shaker.libs.logger.Logger().debug("github::install_tarball: %s: "
+                                                  "Already at '%s'...skipping update"
+                                                  % (target_path, target_ref))
+                return True
+
+    github_token = get_valid_github_token()
+    if not github_token:
+        shaker.libs.logger.Logger().error("github::install_tarball: No valid github token")
+        return False
+
+    # Github redirects this to codeload, where the tarball is served from
+    tarball_url = ("https://api.github.com/repos/%s/%s/tarball/%s"
+                   % (target_org, target_name, target_ref))
+    shaker.libs.logger.Logger().debug("github::install_tarball: Downloading '%s'"
+                                      % (tarball_url))
+    response = shaker.libs.http_client.get_client().get(tarball_url,
+                                                        auth=(github_token, 'x-oauth-basic'),
+                                                        stream=True)
+    if not validate_github_access(response, tarball_url):
+        shaker.libs.logger.Logger().error("github::install_tarball: Could not download '%s'"
+                                          % (tarball_url))
+        return False
+
+    # Extract beside the target so it can be swapped in with a rename
+    extract_path = tempfile.mkdtemp(dir=target_directory, prefix='.tmp-')
+    try:
+        _extract_tarball_stream(response.raw, extract_path)
+        with open(os.path.join(extract_path, INSTALL_MARKER), 'w') as marker_file:
+            marker_file.write("%s\n" % (target_ref))
+        if os.path.exists(target_path):
+            shutil.rmtree(target_path)
+        os.rename(extract_path, target_path)
+    except (tarfile.TarError, IOError, OSError) as e:
+        shaker.libs.logger.Logger().error("github::install_tarball: Problem extracting '%s': %s"
+                                          % (tarball_url, e))
+        return False
+    finally:
+        response.close()
+        if os.path.exists(extract_path):
+            shutil.rmtree(extract_path)
+
+    shaker.libs.logger.Logger().debug("Source '%s' is at version '%s'"
+                                      % (target_name, target_ref))
+    return True
+
+
+def _extract_tarball_stream(stream, target_path):
+    """
+    Extract a gzipped tarball from a stream as it is read, dropping
+    the top level directory github puts everything in
+
+    Args:
+        stream(file): The stream to read the tarball from
+        target_path(string): The directory to extract into
+    """
+    tarball = tarfile.open(fileobj=stream, mode='r|gz')
+    try:
+        for member in tarball:
+            path_parts = member.name.split('/')[1:]
+            if not path_parts or path_parts == ['']:
+                continue
+            if member.name.startswith('/') or '..' in path_parts:
+                msg = ("github::_extract_tarball_stream: Unsafe path '%s' in tarball"
+                       % (member.name))
+                raise tarfile.TarError(msg)
+            member.name = '/'.join(path_parts)
+            if member.islnk():
+                # Hard links name another member, which has lost its top level directory
+                member.linkname = '/'.join(member.linkname.split('/')[1:])
+            if member.issym() or member.islnk():
+                # Links must stay inside the formula too
+                link_path = member.linkname
+                if member.issym():
+                    link_path = os.path.join(os.path.dirname(member.name), link_path)
+                if member.linkname.startswith('/') or os.path.normpath(link_path).startswith('..'):
+                    msg = ("github::_extract_tarball_stream: Unsafe link '%s' in tarball"
+                           % (member.name))
+                    raise tarfile.TarError(msg)
+            tarball.extract(member, target_path)
+    finally:
+        tarball.close()
+
+
 def get_origin_for_remote(repository):
     """
     Find the origin of a remote repository
@@ -917,6 +2006,26 @@ def get_origin_for_remote(repository):
     return None
 
 
+def get_head_sha(repository):
+    """
+    Get the sha of HEAD in an open repository
+
+    Args:
+        repository(pygit2.Repository): The repository
+
+    Returns:
+        string: The sha of HEAD, None type if HEAD does not
+            point at a commit yet, eg, in a new repository
+    """
+    try:
+        return repository.revparse_single('HEAD').hex
+    except (KeyError, pygit2.GitError) as e:
+        shaker.libs.logger.Logger().debug("github::get_head_sha: "
+                                          "No HEAD commit: %s"
+                                          % (e))
+        return None
+
+
 def get_repository_sha(path,
                        revision='HEAD'):
     """
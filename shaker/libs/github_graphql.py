@@ -0,0 +1,328 @@
+import json
+import threading
+
+import shaker.libs.github
+import shaker.libs.http_client
+import shaker.libs.logger
+import shaker.libs.tag_cache
+from shaker.libs.errors import ConstraintResolutionException
+from shaker.libs.errors import GithubRepositoryConnectionException
+
+GRAPHQL_URL = 'https://api.github.com/graphql'
+
+# The files the dependency crawl reads from each formula
+PREFETCH_FILES = {
+    'requirements': 'formula-requirements.txt',
+    'metadata': 'metadata.yml',
+}
+
+_tags_fragment = """
+    refs(refPrefix: "refs/tags/", first: 100%s) {
+      pageInfo { hasNextPage endCursor }
+      nodes { name target { oid ... on Tag { target { oid } } } }
+    }"""
+
+_file_fragment = """
+    %s: object(expression: %s) { ... on Blob { text } }"""
+
+
+class GraphQLBackend(object):
+    """
+    Resolve constraints and fetch formula files using the github
+    GraphQL api. Where the REST api needs a call for the tags of each
+    formula and another for each file, a single query here fetches
+    the tags, or the metadata.yml and formula-requirements.txt
+    blobs, of a whole batch of formulas. Prefetching each level of
+    the dependency tree turns a crawl of N formulas into roughly
+    depth-many round trips.
+
+    Attributes:
+        batch_size(int): The number of repositories to put in one query
+        queries(int): The number of queries made to github
+    """
+    batch_size = 25
+    queries = 0
+
+    def __init__(self, batch_size=25):
+        """
+        Initialise the backend
+
+        Args:
+            batch_size(int): The number of repositories to put in one query
+        """
+        self.batch_size = batch_size
+        self.queries = 0
+        self._lock = threading.Lock()
+        self._tags = {}
+        self._files = {}
+
+    def prefetch(self, dependencies):
+        """
+        Fetch, in as few queries as possible, the tags of a collection
+        of dependencies, then the files at the tags their constraints
+        resolve to
+
+        Args:
+            dependencies(list): List of (organisation, name, constraint)
+                tuples to prefetch
+        """
+        repositories = []
+        for org_name, formula_name, _ in dependencies:
+            if (org_name, formula_name) not in repositories:
+                repositories.append((org_name, formula_name))
+        self._load_tags(repositories)
+
+        targets = []
+        for org_name, formula_name, constraint in dependencies:
+            with self._lock:
+                loaded = (org_name, formula_name) in self._tags
+            if not loaded:
+                # Leave it to the crawl to report the missing repository
+                continue
+            try:
+                target_obj = self.resolve(org_name, formula_name, constraint)
+            except ConstraintResolutionException as e:
+                # Leave it to the crawl to report when it gets there
+                shaker.libs.logger.Logger().debug("GraphQLBackend::prefetch: "
+                                                  "Not prefetching %s/%s:%s: %s"
+                                                  % (org_name, formula_name, constraint, e))
+                continue
+            if target_obj:
+                target = (org_name, formula_name, target_obj.get('name'))
+                if target not in targets:
+                    targets.append(target)
+        self._load_files(targets)
+
+    def resolve(self, org_name, formula_name, constraint):
+        """
+        Resolve a formula constraint to the github data object for
+        the matching tag, loading the repository's tags if they have
+        not been prefetched
+
+        Args:
+            org_name(string): The organisation name of the formula
+            formula_name(string): The formula name
+            constraint(string): The constraint to be applied, in the form
+                <comparator><tag>. eg, '==v1.0.1', '>=2.0.1'
+
+        Returns:
+            dictionary: Json data associated with the resolved tag, in
+                the same format the REST api returns
+
+        Raises:
+            GithubRepositoryConnectionException: If github did not
+                return the repository
+        """
+        self._load_tags([(org_name, formula_name)])
+        with self._lock:
+            tags_data = self._tags.get((org_name, formula_name), None)
+        if tags_data is None:
+            msg = ("GraphQLBackend::resolve: Repository %s/%s not found"
+                   % (org_name, formula_name))
+            raise GithubRepositoryConnectionException(msg)
+        valid_tags = shaker.libs.github.get_valid_tags_from_data(tags_data)
+        return shaker.libs.github.resolve_constraint_to_object(org_name,
+                                                               formula_name,
+                                                               constraint,
+                                                               valid_tags=valid_tags)
+
+    def get_file(self, org_name, formula_name, ref, filename):
+        """
+        Get the contents of a file in a formula at a ref, loading it
+        if it was not prefetched
+
+        Args:
+            org_name(string): The organisation name of the formula
+            formula_name(string): The formula name
+            ref(string): The tag, branch or sha to read the file at
+            filename(string): The path of the file in the formula
+
+        Returns:
+            string: The contents of the file, None type if it does not exist
+        """
+        key = (org_name, formula_name, ref, filename)
+        with self._lock:
+            loaded = key in self._files
+        if not loaded:
+            self._load_files([(org_name, formula_name, ref)],
+                             filenames={'file': filename})
+        with self._lock:
+            return self._files.get(key, None)
+
+    def get_stats(self):
+        """
+        Get the backend statistics
+
+        Returns:
+            dictionary: Statistics of the form,
+                {
+                    'queries': <queries made>,
+                    'repositories': <repositories with tags loaded>,
+                }
+        """
+        with self._lock:
+            return {
+                'queries': self.queries,
+                'repositories': len(self._tags),
+            }
+
+    def _load_tags(self, repositories):
+        """
+        Load the tags of any repositories we do not have yet, using
+        fresh tag cache entries where there are some. Repositories
+        github does not return are left unloaded, rather than
+        loaded and cached as having no tags
+
+        Args:
+            repositories(list): List of (organisation, name) tuples
+        """
+        tag_cache = shaker.libs.tag_cache.get_tag_cache()
+        wanted = []
+        for repository in repositories:
+            with self._lock:
+                if repository in self._tags:
+                    continue
+            cached_tags = None
+            if tag_cache is not None:
+                cached_tags = tag_cache.load(*repository)
+            if cached_tags is not None:
+                with self._lock:
+                    self._tags[repository] = cached_tags[1]
+            else:
+                wanted.append(repository)
+
+        cursors = dict((repository, None) for repository in wanted)
+        fetched = {}
+        while cursors:
+            pending = list(cursors.keys())
+            for batch_start in range(0, len(pending), self.batch_size):
+                batch = pending[batch_start:batch_start + self.batch_size]
+                fields = []
+                for index, (org_name, formula_name) in enumerate(batch):
+                    after = cursors[(org_name, formula_name)]
+                    after_argument = (", after: %s" % json.dumps(after)) if after else ""
+                    fields.append(self._repository_field("r%s" % (index),
+                                                         org_name,
+                                                         formula_name,
+                                                         _tags_fragment % (after_argument)))
+                data = self._query(fields)
+                for index, repository in enumerate(batch):
+                    repository_data = data.get("r%s" % (index), None)
+                    if not repository_data:
+                        shaker.libs.logger.Logger().warning("GraphQLBackend::_load_tags: "
+                                                            "Repository %s/%s not found"
+                                                            % repository)
+                        del cursors[repository]
+                        continue
+                    refs = repository_data['refs']
+                    fetched.setdefault(repository, [])
+                    for node in refs['nodes']:
+                        target = node['target']
+                        # Annotated tags point at a tag object, so peel them
+                        sha = target.get('target', {}).get('oid', None) or target['oid']
+                        fetched[repository].append({'name': node['name'],
+                                                    'commit': {'sha': sha}})
+                    if refs['pageInfo']['hasNextPage']:
+                        cursors[repository] = refs['pageInfo']['endCursor']
+                    else:
+                        del cursors[repository]
+
+        for repository, tags_data in fetched.items():
+            with self._lock:
+                self._tags[repository] = tags_data
+            if tag_cache is not None:
+                wanted_tag, _, _ = shaker.libs.github.get_valid_tags_from_data(tags_data)
+                tag_cache.store(repository[0], repository[1], wanted_tag, tags_data)
+
+    def _load_files(self, targets, filenames=PREFETCH_FILES):
+        """
+        Load files at refs of a collection of formulas
+
+        Args:
+            targets(list): List of (organisation, name, ref) tuples
+            filenames(dictionary): Keys of query aliases to the paths
+                of the files to load
+        """
+        with self._lock:
+            targets = [target for target in targets
+                       if any((target + (filename,)) not in self._files
+                              for filename in filenames.values())]
+        for batch_start in range(0, len(targets), self.batch_size):
+            batch = targets[batch_start:batch_start + self.batch_size]
+            fields = []
+            for index, (org_name, formula_name, ref) in enumerate(batch):
+                file_fields = ''.join(_file_fragment % (alias,
+                                                        json.dumps("%s:%s" % (ref, filename)))
+                                      for alias, filename in filenames.items())
+                fields.append(self._repository_field("f%s" % (index),
+                                                     org_name,
+                                                     formula_name,
+                                                     file_fields))
+            data = self._query(fields)
+            for index, target in enumerate(batch):
+                repository_data = data.get("f%s" % (index), None) or {}
+                for alias, filename in filenames.items():
+                    blob = repository_data.get(alias, None)
+                    with self._lock:
+                        self._files[target + (filename,)] = blob.get('text', None) if blob else None
+
+    def _repository_field(self, alias, org_name, formula_name, selection):
+        """
+        Build an aliased repository field for a query
+
+        Args:
+            alias(string): The alias of the field in the query
+            org_name(string): The organisation name of the repository
+            formula_name(string): The formula name of the repository
+            selection(string): The fields to select on the repository
+
+        Returns:
+            string: The repository field
+        """
+        return ("  %s: repository(owner: %s, name: %s) {%s\n  }"
+                % (alias, json.dumps(org_name), json.dumps(formula_name), selection))
+
+    def _query(self, fields):
+        """
+        Make a query to the github GraphQL api
+
+        Args:
+            fields(list): The top level fields of the query
+
+        Returns:
+            dictionary: The data returned by the query
+
+        Raises:
+            GithubRepositoryConnectionException: If the query failed, or
+                github returned errors for the query as a whole
+        """
+        github_token = shaker.libs.github.get_valid_github_token()
+        if not github_token:
+            msg = "GraphQLBackend::_query: No valid github token"
+            raise GithubRepositoryConnectionException(msg)
+
+        query = "query {\n%s\n}" % ('\n'.join(fields))
+        response = shaker.libs.http_client.get_client().post(GRAPHQL_URL,
+                                                             data=json.dumps({'query': query}),
+                                                             headers={'Authorization': 'bearer %s' % (github_token)})
+        with self._lock:
+            self.queries += 1
+        if not shaker.libs.github.validate_github_access(response, GRAPHQL_URL):
+            msg = ("GraphQLBackend::_query: Query failed with status %s"
+                   % (response.status_code))
+            raise GithubRepositoryConnectionException(msg)
+
+        result = json.loads(response.text)
+        errors = result.get('errors', None) or []
+        # Missing repositories and files are reported as errors with
+        # the path of their field, and the rest of the batch is still
+        # returned. Errors without a path mean the query itself failed
+        query_errors = [error for error in errors if not error.get('path', None)]
+        if query_errors or result.get('data', None) is None:
+            msg = ("GraphQLBackend::_query: Query failed: %s"
+                   % (query_errors or errors))
+            raise GithubRepositoryConnectionException(msg)
+        for error in errors:
+            shaker.libs.logger.Logger().debug("GraphQLBackend::_query: %s"
+                                              % (error.get('message', error)))
+        return result['data']
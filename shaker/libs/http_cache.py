@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import threading
+
+import shaker.libs.cache
+import shaker.libs.logger
+
+# Response headers kept with a cached body and restored when it is
+# served from a 304, eg, the Link header paginated responses need
+CACHED_HEADERS = ['Content-Type', 'Link']
+
+
+class HttpCache(object):
+    """
+    A persistent cache of http response bodies, keyed by url and the
+    credentials they were fetched with, and validated with the ETag
+    and Last-Modified headers the server sent. Cached entries are
+    revalidated with conditional requests, so unchanged resources
+    come back as a cheap 304 that github does not count against the
+    rate limit. Requests without credentials are never cached, so
+    nothing fetched with one token is served to a run with another.
+
+    Attributes:
+        cache_directory(string): The directory the entries are stored in
+        hits(int): Conditional requests answered with 304, with
+            the body served from the cache
+        misses(int): Requests made with no cache entry to validate
+        revalidated(int): Conditional requests made from a cache entry
+    """
+    cache_directory = None
+    hits = 0
+    misses = 0
+    revalidated = 0
+
+    def __init__(self, cache_directory=None):
+        """
+        Initialise the cache
+
+        Args:
+            cache_directory(string): (optional) The directory to store
+                entries in, defaults to ~/.cache/salt-shaker/http
+        """
+        if cache_directory is None:
+            cache_directory = shaker.libs.cache.get_cache_directory('http')
+        self.cache_directory = cache_directory
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def get(self, session, url, **kwargs):
+        """
+        Make a GET request, sending conditional headers if we have
+        a cached entry for the url and credentials, and serving the
+        cached body if the server answers 304 Not Modified
+
+        Args:
+            session(requests.Session): The session to make the request on
+            url(string): The url to request
+            kwargs: Any further arguments to pass on to requests
+
+        Returns:
+            requests.models.Response: The response, with a status
+                of 200 and the cached body and headers if it was
+                not modified
+        """
+        headers = dict(kwargs.pop('headers', None) or {})
+        identity = _get_identity(kwargs.get('auth', None), headers)
+        if identity is None:
+            self._count()
+            return session.get(url, headers=headers, **kwargs)
+
+        entry = self._load(url, identity)
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = session.get(url, headers=headers, **kwargs)
+
+        if entry and response.status_code == 304:
+            shaker.libs.logger.Logger().debug("HttpCache::get: "
+                                              "Not modified, using cached '%s'"
+                                              % (url))
+            response.status_code = 200
+            for header, value in entry['headers'].items():
+                response.headers[header] = value
+            response._content = entry['body'].encode('utf-8')
+            response.encoding = 'utf-8'
+            self._count(hit=True, revalidated=True)
+        else:
+            self._count(revalidated=entry is not None)
+            if response.status_code == 200:
+                self._store(url, identity, response)
+
+        return response
+
+    def get_stats(self):
+        """
+        Get the cache statistics
+
+        Returns:
+            dictionary: Cache statistics of the form,
+                {
+                    'hits': <hits>,
+                    'misses': <misses>,
+                    'revalidated': <revalidated>,
+                }
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+            }
+
+    def _count(self, hit=False, revalidated=False):
+        """
+        Update the cache statistics under lock
+
+        Args:
+            hit(bool): True if the body was served from the cache
+            revalidated(bool): True if a cache entry was revalidated,
+                False if there was no entry to revalidate
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            if revalidated:
+                self.revalidated += 1
+            else:
+                self.misses += 1
+
+    def _entry_path(self, url, identity):
+        """
+        Get the path of the cache entry for a url
+
+        Args:
+            url(string): The url of the entry
+            identity(string): The hash of the credentials the
+                entry was fetched with
+
+        Returns:
+            string: The path of the entry file
+        """
+        key = hashlib.sha1(("%s\n%s" % (identity, url)).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_directory, key[:2], "%s.json" % (key))
+
+    def _load(self, url, identity):
+        """
+        Load the cache entry for a url
+
+        Args:
+            url(string): The url of the entry
+            identity(string): The hash of the credentials the
+                entry was fetched with
+
+        Returns:
+            dictionary: The entry, None type if there is no
+                usable entry
+        """
+        entry_path = self._entry_path(url, identity)
+        if not os.path.exists(entry_path):
+            return None
+        try:
+            with open(entry_path, 'r') as entry_file:
+                entry = json.load(entry_file)
+        except (IOError, ValueError) as e:
+            shaker.libs.logger.Logger().debug("HttpCache::_load: "
+                                              "Ignoring unreadable entry '%s': %s"
+                                              % (entry_path, e))
+            return None
+        # Entries written before headers were cached would lose the
+        # Link header on a 304, and with it every page after the first
+        if entry.get('url') != url or 'headers' not in entry:
+            return None
+        return entry
+
+    def _store(self, url, identity, response):
+        """
+        Store a response in the cache if it carries a validator
+
+        Args:
+            url(string): The url of the entry
+            identity(string): The hash of the credentials the
+                entry was fetched with
+            response(requests.models.Response): The response to store
+        """
+        etag = response.headers.get('ETag', None)
+        last_modified = response.headers.get('Last-Modified', None)
+        if not (etag or last_modified):
+            return
+        entry = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'headers': dict((header, response.headers[header])
+                            for header in CACHED_HEADERS
+                            if header in response.headers),
+            'body': response.text,
+        }
+        try:
+            shaker.libs.cache.write_file_atomically(self._entry_path(url, identity),
+                                                    json.dumps(entry))
+        except (IOError, OSError) as e:
+            shaker.libs.logger.Logger().warning("HttpCache::_store: "
+                                                "Could not cache '%s': %s"
+                                                % (url, e))
+
+
+def _get_identity(auth, headers):
+    """
+    Get a hash identifying the credentials a request is made with,
+    so that entries are only served back to the same credentials
+    without the token itself being written to disk
+
+    Args:
+        auth(tuple): The requests basic auth, eg, (<token>, 'x-oauth-basic'),
+            None type if not set
+        headers(dictionary): The request headers
+
+    Returns:
+        string: The hash of the credentials, None type if the
+            request has none we can identify
+    """
+    if isinstance(auth, (tuple, list)) and auth[0]:
+        credentials = "basic:%s" % (":".join(auth))
+    elif headers.get('Authorization'):
+        credentials = "header:%s" % (headers['Authorization'])
+    else:
+        return None
+    return hashlib.sha256(credentials.encode('utf-8')).hexdigest()
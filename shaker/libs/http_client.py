@@ -0,0 +1,156 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import shaker.libs.logger
+
+
+class HttpClient(object):
+    """
+    A long-lived, keep-alive http client that all of the github
+    calls made during a run share. Connections are pooled per host,
+    so repeated calls to api.github.com and raw.githubusercontent.com
+    reuse an open connection instead of paying for a new TCP and TLS
+    handshake each time.
+
+    Attributes:
+        request_count(int): The number of requests made through
+            this client
+        cache(HttpCache): The cache for conditional requests, None
+            type if caching is disabled
+    """
+    request_count = 0
+    cache = None
+
+    def __init__(self,
+                 pool_connections=10,
+                 pool_maxsize=16,
+                 session=None,
+                 cache=None):
+        """
+        Initialise the client and mount the pooled adapters
+
+        Args:
+            pool_connections(int): The number of host pools to keep
+            pool_maxsize(int): The maximum number of connections to keep
+                open per host pool
+            session(requests.Session): (optional) The session to use,
+                a new one is created if not specified
+            cache(HttpCache): (optional) The cache to use for requests
+                that ask for it
+        """
+        self._lock = threading.Lock()
+        self._session = session if session is not None else requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=pool_connections,
+                                    pool_maxsize=pool_maxsize)
+        self._session.mount('https://', self._adapter)
+        self._session.mount('http://', self._adapter)
+        self.request_count = 0
+        self.cache = cache
+
+    def get(self, url, use_cache=False, **kwargs):
+        """
+        Make a GET request over a pooled connection
+
+        Args:
+            url(string): The url to request
+            use_cache(bool): True to make a conditional request against
+                the cache, if there is one, False to always make a
+                plain request
+            kwargs: Any further arguments to pass on to requests
+
+        Returns:
+            requests.models.Response: The response from the server
+        """
+        if use_cache and self.cache is not None:
+            response = self.cache.get(self._session, url, **kwargs)
+        else:
+            response = self._session.get(url, **kwargs)
+        with self._lock:
+            self.request_count += 1
+        return response
+
+    def post(self, url, **kwargs):
+        """
+        Make a POST request over a pooled connection
+
+        Args:
+            url(string): The url to post to
+            kwargs: Any further arguments to pass on to requests
+
+        Returns:
+            requests.models.Response: The response from the server
+        """
+        response = self._session.post(url, **kwargs)
+        with self._lock:
+            self.request_count += 1
+        return response
+
+    def get_pool_stats(self):
+        """
+        Get statistics on how well the connection pools are being used
+
+        Returns:
+            dictionary: Pool statistics of the form,
+                {
+                    'requests': <requests made through this client>,
+                    'pool_hits': <requests served on a reused connection>,
+                    'pool_misses': <new connections opened>,
+                }
+        """
+        pool_requests = 0
+        pool_misses = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                pool_requests += pool.num_requests
+                pool_misses += pool.num_connections
+
+        return {
+            'requests': self.request_count,
+            'pool_hits': max(pool_requests - pool_misses, 0),
+            'pool_misses': pool_misses,
+        }
+
+    def close(self):
+        """
+        Close all of the pooled connections
+        """
+        shaker.libs.logger.Logger().debug("HttpClient::close: "
+                                          "Closing pooled connections")
+        self._session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Get the http client shared by the whole run, creating it
+    on first use
+
+    Returns:
+        HttpClient: The shared client
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def set_client(client):
+    """
+    Replace the shared http client, eg, to inject a
+    preconfigured or test client
+
+    Args:
+        client(HttpClient): The client to share, None to
+            create a fresh default client on next use
+    """
+    global _client
+    with _client_lock:
+        _client = client
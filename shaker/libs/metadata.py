@@ -1,13 +1,15 @@
 import shaker.libs.logger
 import re
-from shaker.libs.errors import (ConstraintFormatException,
-                                ConstraintResolutionException,
+from shaker.libs.errors import (ConstraintResolutionException,
                                 ShakerRequirementsParsingException)
-from parse import parse
+from shaker.libs.constraint import Constraint
+from shaker.libs.constraint import VersionInterval
 
-comparator_re = re.compile('([=><]+)\s*(.*)')
 tag_re = re.compile('v[0-9]+\.[0-9]+\.[0-9]+')
 
+# A simple format requirement with a constraint, eg, test_organisation/some-formula==v1.0
+requirement_re = re.compile(r'(.*)([=><]{2})\s*(.*)')
+
 
 def parse_metadata(metadata):
     """
@@ -80,114 +82,77 @@ def resolve_metadata_duplicates(metadata):
 
 def parse_constraint(constraint):
     """
-    Parse a constraint of form
-    into an info dictionary of form
+    Parse a constraint of form <comparator><tag>, eg, '>=v1.2.3',
+    into an interned Constraint, which can also be used as the
+    info dictionary of form
     {'comparator': comparator, 'tag': tag, 'version': version, 'postfix': postfix}
 
     Args:
-        constraint(string): The string representing the constratint
+        constraint(string): The string representing the constratint,
+            or an already parsed Constraint
 
     Returns:
-        dictionary: The information dictionary
+        Constraint: The parsed constraint
     """
-    match = comparator_re.search(constraint)
-    comparator = match.group(1)
-    tag = match.group(2)
-
-    version = None
-    postfix = None
-    parsed_results = parse('v{version}-{postfix}', tag)
-    if parsed_results:
-        version = parsed_results["version"]
-        postfix = parsed_results["postfix"]
-    else:
-        parsed_results = parse('v{version}', tag)
-        if parsed_results:
-            version = parsed_results["version"]
-            postfix = None
-
-    return {'comparator': comparator,
-            'tag': tag,
-            'version': version,
-            'postfix': postfix}
+    return Constraint.parse(constraint)
 
 
 def resolve_constraints(new_constraint,
                         current_constraint):
         """
-        Resolve the dependencies uniquely using the precedence ==, >=, <=
-        i.e,
-        * '==' Equality takes priority over all other constraints, current
-            equalities override any new
+        Resolve the dependencies uniquely by intersecting the version
+        intervals the constraints allow, i.e,
+        * '==' Equalities pin a version, which must lie within any bounds
         * '>=' The highest greater than bound takes precedence over the lower
         * '<=' least less-than bound takes precedence over the higher
-        * '>=, <=' Opposite contraints will throw an exception, although these
-            may be resolvable in practice
+        * '>=, <=' Opposite constraints combine into a compound constraint,
+            eg, '>=v1.0.0,<=v2.0.0'
 
         Args:
-            new_constraint(string): New comparator and version
-            current_constraint(string): Current comparator and version
+            new_constraint(string): New comparator and version, or a
+                VersionInterval
+            current_constraint(string): Current comparator and version, or a
+                VersionInterval
 
         Returns:
-            string: The constraint that took precedence
+            string: The constraint allowing only the versions both allow
 
         Raises:
             ConstraintFormatException
-            ConstraintResolutionException
+            ConstraintResolutionException: If no version satisfies both
         """
         shaker.libs.logger.Logger().debug("metadata.resolve_constraints(%s, %s)"
                                           % (new_constraint,
                                              current_constraint))
-        # Deal with simple cases first, if we have an empty
-        # constraint and a non-empty one, use the non-empty
-        # one, if both are empty then just no versioning
-        # is required
-        have_new_constraint = (new_constraint and (len(new_constraint) > 0))
-        have_current_constraint = (current_constraint and (len(current_constraint) > 0))
-        if not have_new_constraint and not have_current_constraint:
-            return ''
-        elif not have_new_constraint and have_current_constraint:
-            return current_constraint
-        elif have_new_constraint and not have_current_constraint:
-            return new_constraint
-
-        new_constraint_result = parse_constraint(new_constraint)
-        current_constraint_result = parse_constraint(current_constraint)
-        shaker.libs.logger.Logger().debug("metadata.resolve_constraints: %s\n%s\n"
-                                          % (new_constraint_result,
-                                             current_constraint_result))
-        if new_constraint_result and current_constraint_result:
-            new_comparator = new_constraint_result["comparator"]
-            current_comparator = current_constraint_result["comparator"]
-            # Deal with equality case
-            if current_comparator == '==':
-                return current_constraint
-            elif new_comparator == '==':
-                return new_constraint
-            elif new_comparator != current_comparator:
-                raise ConstraintResolutionException
-            elif new_comparator == '>=':
-                # Get highest version
-                version = max(new_constraint_result["tag"],
-                              current_constraint_result["tag"])
-                return '>=%s' % (version)
-            elif new_comparator == '<=':
-                # Get highest version
-                version = min(new_constraint_result["tag"],
-                              current_constraint_result["tag"])
-                return '<=%s' % (version)
-            else:
-                msg = ("metadata.resolve_constraints: %s\n%s\n"
-                       % (new_constraint_result,
-                          current_constraint_result))
-                raise ConstraintFormatException(msg)
-        else:
-            msg = ("metadata.resolve_constraints: %s\n%s\n"
-                   % (new_constraint_result,
-                      current_constraint_result))
-            raise ConstraintFormatException(msg)
+        return str(resolve_constraint_interval(new_constraint, current_constraint))
+
+
+def resolve_constraint_interval(new_constraint,
+                                current_constraint):
+    """
+    Intersect the version intervals of two constraints. Intersection
+    is commutative, so the result, or the failure, doesn't depend on
+    which constraint was found first
 
-        return None
+    Args:
+        new_constraint(string): New constraint, or a VersionInterval
+        current_constraint(string): Current constraint, or a VersionInterval
+
+    Returns:
+        VersionInterval: The interval of versions both allow
+
+    Raises:
+        ConstraintFormatException
+        ConstraintResolutionException: If no version satisfies both
+    """
+    current_interval = VersionInterval.parse(current_constraint)
+    new_interval = VersionInterval.parse(new_constraint)
+    try:
+        return current_interval.intersect(new_interval)
+    except ConstraintResolutionException as e:
+        msg = ("metadata.resolve_constraints: Could not resolve '%s' with '%s': %s"
+               % (new_interval, current_interval, e))
+        raise ConstraintResolutionException(msg)
 
 
 def parse_metadata_requirements(metadata_dependencies):
@@ -233,7 +198,7 @@ def parse_metadata_requirements(metadata_dependencies):
                                               % (metadata_dependency))
             metadata_info = shaker.libs.github.parse_github_url(metadata_dependency)
         else:
-            parsed_entry = re.search('(.*)([=><]{2})\s*(.*)', metadata_dependency)
+            parsed_entry = requirement_re.search(metadata_dependency)
             if parsed_entry and len(parsed_entry.groups()) >= 3:
                 parsed_formula = parsed_entry.group(1).strip()
                 parsed_comparator = parsed_entry.group(2).strip()
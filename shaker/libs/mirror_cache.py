@@ -0,0 +1,248 @@
+import fcntl
+import os
+import re
+import threading
+import time
+
+import pygit2
+
+import shaker.libs.cache
+import shaker.libs.github
+import shaker.libs.logger
+
+# The organisation and repository name at the end of a git url, eg,
+# git@github.com:test_organisation/test-formula.git
+repository_re = re.compile(r'[:/]([^/:]+)/([^/]+?)(\.git)?/?$')
+
+# Mirrors keep the remote's branches and tags under their own names
+MIRROR_REFSPECS = ['+refs/heads/*:refs/heads/*',
+                   '+refs/tags/*:refs/tags/*']
+
+
+class MirrorCache(object):
+    """
+    A host-wide cache of bare mirrors of formula repositories. Each
+    mirror is fetched into only when a ref we need is missing, and
+    project repositories borrow the mirror's objects through git
+    alternates rather than downloading their own copy, so an object
+    is downloaded once per host, however many vendor directories
+    use it.
+
+    Attributes:
+        cache_directory(string): The directory the mirrors are kept in
+        hits(int): Refs found in an existing mirror
+        misses(int): Refs that had to be fetched into a mirror
+        received_bytes(int): The bytes fetched into mirrors
+    """
+    cache_directory = None
+    hits = 0
+    misses = 0
+    received_bytes = 0
+
+    def __init__(self, cache_directory=None):
+        """
+        Initialise the cache
+
+        Args:
+            cache_directory(string): (optional) The directory to keep
+                mirrors in, defaults to ~/.cache/salt-shaker/mirrors
+        """
+        if cache_directory is None:
+            cache_directory = shaker.libs.cache.get_cache_directory('mirrors')
+        self.cache_directory = cache_directory
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.received_bytes = 0
+
+    def create_repository(self, url, target_directory, ref=None, credentials=None):
+        """
+        Create a project repository whose objects come from the mirror
+        of a remote repository
+
+        Args:
+            url(string): The remote url of the repository
+            target_directory(string): The local directory to create it in
+            ref(string): The tag, branch or sha that will be checked out
+            credentials(object): The credentials to fetch with
+
+        Returns:
+            pygit2.Repository: The repository created
+        """
+        mirror_path = self.update(url, ref, credentials)
+        shaker.libs.logger.Logger().debug("MirrorCache::create_repository: "
+                                          "Creating '%s' from mirror '%s'"
+                                          % (target_directory, mirror_path))
+        repo = pygit2.init_repository(target_directory)
+        repo.create_remote('origin', url)
+        return self._link_repository(repo, mirror_path)
+
+    def update_repository(self, repo, url, ref, credentials=None):
+        """
+        Make a ref available to a project repository, fetching it into
+        the mirror if the mirror does not have it either
+
+        Args:
+            repo(pygit2.Repository): The project repository
+            url(string): The remote url of the repository
+            ref(string): The tag, branch or sha that will be checked out
+            credentials(object): The credentials to fetch with
+
+        Returns:
+            pygit2.Repository: The repository, reopened if it was linked
+                to the mirror
+        """
+        mirror_path = self.update(url, ref, credentials)
+        return self._link_repository(repo, mirror_path)
+
+    def update(self, url, ref=None, credentials=None):
+        """
+        Make sure the mirror of a remote repository exists and has a ref,
+        fetching all of the remote's branches and tags if it does not,
+        or if the ref is a branch that may have moved
+
+        Args:
+            url(string): The remote url of the repository
+            ref(string): The tag, branch or sha that is needed, None type
+                to only make sure the mirror exists
+            credentials(object): The credentials to fetch with
+
+        Returns:
+            string: The path of the mirror
+        """
+        mirror_path = self.get_mirror_path(url)
+        shaker.libs.cache.ensure_directory(os.path.dirname(mirror_path))
+        # Other shaker processes on the host may be using the same mirror
+        with open("%s.lock" % (mirror_path), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if os.path.isdir(mirror_path):
+                mirror = pygit2.Repository(mirror_path)
+            else:
+                mirror = pygit2.init_repository(mirror_path, bare=True)
+                mirror.create_remote('origin', url)
+
+            # Branches can move upstream, so only tags and shas
+            # already in the mirror are served from it
+            if ref and shaker.libs.github.has_fixed_ref(mirror, ref):
+                with self._lock:
+                    self.hits += 1
+                shaker.libs.logger.Logger().debug("MirrorCache::update: "
+                                                  "Found '%s' in mirror '%s'"
+                                                  % (ref, mirror_path))
+            else:
+                start_time = time.time()
+                origin = filter(lambda x: x.name == 'origin', mirror.remotes)
+                received_bytes = shaker.libs.github.fetch_refs(mirror,
+                                                               origin[0],
+                                                               MIRROR_REFSPECS,
+                                                               credentials=credentials)
+                with self._lock:
+                    self.misses += 1
+                    self.received_bytes += received_bytes
+                shaker.libs.logger.Logger().debug("MirrorCache::update: "
+                                                  "Fetched into mirror '%s' for '%s', "
+                                                  "%s bytes in %.2fs"
+                                                  % (mirror_path,
+                                                     ref,
+                                                     received_bytes,
+                                                     time.time() - start_time))
+        return mirror_path
+
+    def get_mirror_path(self, url):
+        """
+        Get the path of the mirror of a remote repository
+
+        Args:
+            url(string): The remote url of the repository
+
+        Returns:
+            string: The path of the mirror, eg,
+                ~/.cache/salt-shaker/mirrors/<organisation>/<name>.git
+        """
+        match = repository_re.search(url)
+        if not match:
+            msg = ("MirrorCache::get_mirror_path: Could not find repository name in '%s'"
+                   % (url))
+            raise ValueError(msg)
+        return os.path.join(self.cache_directory,
+                            match.group(1),
+                            "%s.git" % (match.group(2)))
+
+    def get_stats(self):
+        """
+        Get the cache statistics
+
+        Returns:
+            dictionary: Cache statistics of the form,
+                {
+                    'hits': <hits>,
+                    'misses': <misses>,
+                    'bytes': <bytes fetched>,
+                }
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes': self.received_bytes,
+            }
+
+    def _link_repository(self, repo, mirror_path):
+        """
+        Point a project repository's alternates at a mirror and copy
+        in the mirror's refs, branches becoming origin's remote branches
+
+        Args:
+            repo(pygit2.Repository): The project repository
+            mirror_path(string): The path of the mirror
+
+        Returns:
+            pygit2.Repository: The repository, reopened so that it
+                sees the mirror's objects
+        """
+        alternates_path = os.path.join(repo.path, 'objects', 'info', 'alternates')
+        mirror_objects = os.path.abspath(os.path.join(mirror_path, 'objects'))
+        alternates = []
+        if os.path.exists(alternates_path):
+            with open(alternates_path, 'r') as alternates_file:
+                alternates = alternates_file.read().splitlines()
+        if mirror_objects not in alternates:
+            shaker.libs.cache.write_file_atomically(alternates_path,
+                                                    '\n'.join(alternates + [mirror_objects]) + '\n')
+            repo = pygit2.Repository(repo.path)
+
+        mirror = pygit2.Repository(mirror_path)
+        for reference_name in mirror.listall_references():
+            target = mirror.lookup_reference(reference_name).resolve().target
+            if reference_name.startswith('refs/heads/'):
+                reference_name = 'refs/remotes/origin/%s' % (reference_name[len('refs/heads/'):])
+            elif not reference_name.startswith('refs/tags/'):
+                continue
+            repo.create_reference(reference_name, target, force=True)
+        return repo
+
+
+_mirror_cache = None
+
+
+def get_mirror_cache():
+    """
+    Get the mirror cache configured for the run
+
+    Returns:
+        MirrorCache: The configured cache, None type if
+            mirroring is disabled
+    """
+    return _mirror_cache
+
+
+def set_mirror_cache(mirror_cache):
+    """
+    Configure the mirror cache to use for the run
+
+    Args:
+        mirror_cache(MirrorCache): The cache to use, None type
+            to disable mirroring
+    """
+    global _mirror_cache
+    _mirror_cache = mirror_cache
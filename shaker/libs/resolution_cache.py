@@ -0,0 +1,105 @@
+import threading
+
+import shaker.libs.github
+import shaker.libs.logger
+
+
+class ResolutionCache(object):
+    """
+    Memoise the resolution of formula constraints to github tag
+    objects for the lifetime of a run. The same organisation, name
+    and constraint is resolved several times as metadata, requirements
+    and shas are looked up, so all but the first lookup become a
+    dictionary access.
+
+    Attributes:
+        backend(object): The backend to resolve with, eg, a GraphQLBackend,
+            None type to use the github REST api directly
+        minimal(bool): True to resolve constraints to the lowest version
+            that satisfies them, with minimal version selection, False to
+            resolve them to the highest
+        hits(int): Resolutions answered from the cache
+        misses(int): Resolutions that had to call out to github
+    """
+    backend = None
+    minimal = False
+    hits = 0
+    misses = 0
+
+    def __init__(self, backend=None, minimal=False):
+        """
+        Initialise an empty cache
+
+        Args:
+            backend(object): (optional) The backend to resolve with, it
+                must provide resolve(org_name, formula_name, constraint)
+            minimal(bool): (optional) True to resolve constraints with
+                minimal version selection, which needs no backend
+        """
+        self.backend = backend
+        self.minimal = minimal
+        self._lock = threading.Lock()
+        self._resolutions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, org_name, formula_name, constraint):
+        """
+        Resolve a formula constraint to the github data object for
+        the matching tag or branch, using the cached resolution if
+        we have one
+
+        Args:
+            org_name(string): The organisation name of the formula
+            formula_name(string): The formula name
+            constraint(string): The constraint to be applied, in the form
+                <comparator><tag>. eg, '==v1.0.1', '>=2.0.1'
+
+        Returns:
+            dictionary: Json data from github associated with the resolved tag
+
+        Raises:
+            ConstraintResolutionException: If no resolution was possible
+        """
+        key = (org_name, formula_name, constraint or '')
+        with self._lock:
+            if key in self._resolutions:
+                self.hits += 1
+                shaker.libs.logger.Logger().debug("ResolutionCache::resolve: "
+                                                  "Using cached resolution for %s/%s:%s"
+                                                  % key)
+                return self._resolutions[key]
+
+        if self.minimal:
+            resolved_object = shaker.libs.github.resolve_minimal_constraint_to_object(org_name,
+                                                                                      formula_name,
+                                                                                      constraint)
+        elif self.backend is not None:
+            resolved_object = self.backend.resolve(org_name,
+                                                   formula_name,
+                                                   constraint)
+        else:
+            resolved_object = shaker.libs.github.resolve_constraint_to_object(org_name,
+                                                                              formula_name,
+                                                                              constraint)
+        with self._lock:
+            self.misses += 1
+            self._resolutions[key] = resolved_object
+        return resolved_object
+
+    def get_stats(self):
+        """
+        Get the cache statistics
+
+        Returns:
+            dictionary: Cache statistics of the form,
+                {
+                    'hits': <hits>,
+                    'misses': <misses>,
+                }
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,331 @@
+import shaker.libs.logger
+from shaker.libs.constraint import VersionInterval
+from shaker.libs.errors import ConstraintResolutionException
+
+
+def satisfies(constraint, tag):
+    """
+    Check whether a tag satisfies a constraint. Branches can't be
+    ordered, so, as with VersionInterval, a pinned branch is taken
+    to satisfy any range constraint
+
+    Args:
+        constraint(string): The constraint, eg, '>=v1.2.3' or
+            '>=v1.2.3,<=v2.0.0', empty for no constraint
+        tag(string): The tag, eg, 'v1.2.4', None type for the
+            repository's default version
+
+    Returns:
+        bool: True if the tag satisfies the constraint, False otherwise
+    """
+    if not constraint:
+        return True
+    if tag is None:
+        return False
+    return VersionInterval.parse(constraint).contains(tag)
+
+
+class Solver(object):
+    """
+    A backtracking dependency solver, working over the tags each formula
+    actually has. Constraints are treated as version ranges, and every
+    constraint on a formula is taken into account together, so the result
+    doesn't depend on the order formulas are visited in. Formulas are
+    decided one at a time, trying their versions latest first, or lowest
+    first for minimal version selection, and if a
+    version's dependencies conflict with a formula already decided, the
+    next version is tried, backing up to earlier decisions when a formula
+    runs out of versions.
+
+    Tags and dependencies are loaded lazily, so only the repositories and
+    versions the search actually reaches are fetched, and each is fetched
+    at most once.
+
+    Attributes:
+        minimal(bool): True to try each formula's versions lowest first
+        backtracks(int): Versions given up on during the solve
+        fetches(int): Versions whose dependencies were fetched
+        repositories(int): Repositories whose tags were fetched
+    """
+    minimal = False
+    backtracks = 0
+    fetches = 0
+    repositories = 0
+
+    def __init__(self,
+                 get_index,
+                 get_dependencies,
+                 root_key=None,
+                 minimal=False):
+        """
+        Initialise the solver
+
+        Args:
+            get_index(function): Called with the key and info of a formula,
+                returns the VersionIndex of its tags
+            get_dependencies(function): Called with the key and info of a
+                formula and a tag, None type for the default version,
+                returns the formula's dependencies at that tag, in the
+                format of metadata.parse_metadata_requirements
+            root_key(string): (optional) The key of the root formula, to
+                ignore where it's depended on
+            minimal(bool): (optional) True to try versions lowest first,
+                False to try them latest first
+        """
+        self.minimal = minimal
+        self._get_index = get_index
+        self._get_dependencies = get_dependencies
+        self._root_key = root_key
+        self._indexes = {}
+        self._dependencies = {}
+        self.backtracks = 0
+        self.fetches = 0
+        self.repositories = 0
+
+    def solve(self, base_dependencies):
+        """
+        Find a version of every formula reachable from the base
+        dependencies that satisfies all the constraints on it
+
+        Args:
+            base_dependencies(dictionary): The dependencies to solve from,
+                in the format of metadata.parse_metadata_requirements
+
+        Returns:
+            dictionary: The solved dependencies, each pinned to its version
+                with an '==' constraint, with the constraints that led to it
+                as the sourced constraints, eg,
+                'test_organisation/some-formula':
+                {
+                    'source': 'git@github.com:test_organisation/some-formula.git',
+                    'constraint': '==v1.2.0',
+                    'sourced_constraints': ['>=v1.0.0', '<=v1.2.0'],
+                    'organisation': 'test_organisation',
+                    'name': 'some-formula'
+                }
+
+        Raises:
+            ConstraintResolutionException: If there is no set of versions
+                that satisfies every constraint
+        """
+        infos = {}
+        requirements = {}
+        order = []
+        for dependency_key in sorted(base_dependencies.keys()):
+            self._add_requirement(dependency_key,
+                                  base_dependencies[dependency_key],
+                                  infos,
+                                  requirements,
+                                  order)
+
+        solution = self._search({}, infos, requirements, order)
+        if solution is None:
+            msg = ("Solver::solve: No versions satisfy the constraints on %s, "
+                   "after %s backtracks"
+                   % (', '.join(order), self.backtracks))
+            raise ConstraintResolutionException(msg)
+        decided, infos, requirements = solution
+
+        dependencies = {}
+        for dependency_key, tag in decided.items():
+            dependency_info = infos[dependency_key]
+            dependencies[dependency_key] = {
+                'source': dependency_info.get('source', None),
+                'constraint': '==%s' % (tag) if tag else '',
+                'sourced_constraints': list(requirements[dependency_key]),
+                'organisation': dependency_info.get('organisation', None),
+                'name': dependency_info.get('name', None)
+            }
+        return dependencies
+
+    def get_stats(self):
+        """
+        Get the solve statistics
+
+        Returns:
+            dictionary: Solve statistics of the form,
+                {
+                    'backtracks': <backtracks>,
+                    'fetches': <versions fetched>,
+                    'repositories': <repositories fetched>,
+                }
+        """
+        return {
+            'backtracks': self.backtracks,
+            'fetches': self.fetches,
+            'repositories': self.repositories,
+        }
+
+    def _search(self, decided, infos, requirements, order):
+        """
+        Decide the next undecided formula, recursing on to the rest
+
+        Args:
+            decided(dictionary): The tags decided so far, by formula key
+            infos(dictionary): The info of each formula found so far
+            requirements(dictionary): The constraints on each formula found so far
+            order(list): The formula keys in the order they were found
+
+        Returns:
+            tuple: The decided tags, the info of each formula and the
+                requirements the tags satisfy, None type if there is
+                no solution from here
+        """
+        undecided_keys = [dependency_key for dependency_key in order
+                          if dependency_key not in decided]
+        if not undecided_keys:
+            return decided, infos, requirements
+        dependency_key = undecided_keys[0]
+        dependency_info = infos[dependency_key]
+
+        for tag in self._get_candidates(dependency_key,
+                                        dependency_info,
+                                        requirements[dependency_key]):
+            next_infos = dict(infos)
+            next_requirements = dict(requirements)
+            next_order = list(order)
+            conflict = None
+            dependencies = self._fetch_dependencies(dependency_key, dependency_info, tag)
+            for sub_key in sorted(dependencies.keys()):
+                sub_info = dependencies[sub_key]
+                if sub_key == self._root_key:
+                    continue
+                self._add_requirement(sub_key,
+                                      sub_info,
+                                      next_infos,
+                                      next_requirements,
+                                      next_order)
+                sub_constraint = sub_info.get('constraint', None)
+                if sub_key in decided and not satisfies(sub_constraint, decided[sub_key]):
+                    conflict = "%s%s" % (sub_key, sub_constraint)
+                    break
+
+            if conflict is None:
+                next_decided = dict(decided)
+                next_decided[dependency_key] = tag
+                solution = self._search(next_decided,
+                                        next_infos,
+                                        next_requirements,
+                                        next_order)
+                if solution is not None:
+                    return solution
+                conflict = "the formulas depending on it"
+            self.backtracks += 1
+            shaker.libs.logger.Logger().debug("Solver::_search: "
+                                              "Backtracking from %s at '%s', conflicts with %s"
+                                              % (dependency_key, tag, conflict))
+        return None
+
+    def _add_requirement(self,
+                         dependency_key,
+                         dependency_info,
+                         infos,
+                         requirements,
+                         order):
+        """
+        Add a formula's constraint to the requirements found so far
+
+        Args:
+            dependency_key(string): The key of the formula
+            dependency_info(dictionary): The info of the formula
+            infos(dictionary): The info of each formula, updated in place
+            requirements(dictionary): The constraints on each formula,
+                updated in place
+            order(list): The formula keys in the order found, updated in place
+        """
+        if dependency_key not in infos:
+            infos[dependency_key] = dependency_info
+            requirements[dependency_key] = ()
+            order.append(dependency_key)
+        constraint = dependency_info.get('constraint', None)
+        if constraint and constraint not in requirements[dependency_key]:
+            requirements[dependency_key] = requirements[dependency_key] + (constraint,)
+
+    def _get_candidates(self,
+                        dependency_key,
+                        dependency_info,
+                        constraints):
+        """
+        Get the tags of a formula that satisfy all the constraints on it
+
+        Args:
+            dependency_key(string): The key of the formula
+            dependency_info(dictionary): The info of the formula
+            constraints(tuple): The constraints on the formula
+
+        Returns:
+            list: The tags, in the order to try them
+
+        Raises:
+            ConstraintResolutionException: If a constraint can't be compared
+        """
+        interval = VersionInterval()
+        try:
+            for constraint in constraints:
+                interval = interval.intersect(VersionInterval.parse(constraint))
+        except ConstraintResolutionException:
+            return []
+        if interval.pin is not None:
+            tag = interval.pin.tag
+            if interval.pin.version is None:
+                # A branch, which can't be looked up in the tags
+                return [tag]
+            if self._load_index(dependency_key, dependency_info).get(tag) is None:
+                return []
+            return [tag]
+
+        for bound in (interval.lowest, interval.highest):
+            if bound is not None and bound.key is None:
+                msg = ("Solver::_get_candidates: %s: Could not compare constraint '%s'"
+                       % (dependency_key, interval))
+                raise ConstraintResolutionException(msg)
+        candidates = self._load_index(dependency_key, dependency_info).find_between(
+            interval.lowest.tag[1:] if interval.lowest else None,
+            interval.highest.tag[1:] if interval.highest else None)
+        if not candidates and interval.is_unbounded():
+            # No releases to choose from, so take the default version
+            return [None]
+        if self.minimal:
+            candidates.reverse()
+        return candidates
+
+    def _load_index(self, dependency_key, dependency_info):
+        """
+        Get the version index of a formula, fetching it the first time
+
+        Args:
+            dependency_key(string): The key of the formula
+            dependency_info(dictionary): The info of the formula
+
+        Returns:
+            VersionIndex: The index of the formula's tags
+        """
+        if dependency_key not in self._indexes:
+            self.repositories += 1
+            self._indexes[dependency_key] = self._get_index(dependency_key, dependency_info)
+        return self._indexes[dependency_key]
+
+    def _fetch_dependencies(self, dependency_key, dependency_info, tag):
+        """
+        Get the dependencies of a formula at a tag, fetching them the
+        first time
+
+        Args:
+            dependency_key(string): The key of the formula
+            dependency_info(dictionary): The info of the formula
+            tag(string): The tag, None type for the default version
+
+        Returns:
+            dictionary: The dependencies, in the format of
+                metadata.parse_metadata_requirements
+        """
+        cache_key = (dependency_key, tag)
+        if cache_key not in self._dependencies:
+            self.fetches += 1
+            shaker.libs.logger.Logger().debug("Solver::_fetch_dependencies: "
+                                              "Fetching dependencies of %s at '%s'"
+                                              % (dependency_key, tag))
+            self._dependencies[cache_key] = self._get_dependencies(dependency_key,
+                                                                   dependency_info,
+                                                                   tag) or {}
+        return self._dependencies[cache_key]
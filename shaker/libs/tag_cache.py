@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+
+import shaker.libs.cache
+import shaker.libs.logger
+
+
+class TagCache(object):
+    """
+    A persistent, per-repository cache of the tag lists fetched from
+    github. Entries hold the raw tag names, their commit shas and the
+    calculated wanted tag, and are used without contacting github
+    until they are older than the time-to-live.
+
+    Attributes:
+        cache_directory(string): The directory the entries are stored in
+        ttl(int): The number of seconds an entry stays fresh
+        refresh(bool): True to ignore existing entries and refetch
+        hits(int): Tag lists served from fresh entries
+        misses(int): Tag lists with no fresh entry to serve
+    """
+    cache_directory = None
+    ttl = 3600
+    refresh = False
+    hits = 0
+    misses = 0
+
+    def __init__(self,
+                 cache_directory=None,
+                 ttl=3600,
+                 refresh=False):
+        """
+        Initialise the cache
+
+        Args:
+            cache_directory(string): (optional) The directory to store
+                entries in, defaults to ~/.cache/salt-shaker/tags
+            ttl(int): The number of seconds an entry stays fresh
+            refresh(bool): True to ignore existing entries, so that every
+                tag list is refetched and the cache updated
+        """
+        if cache_directory is None:
+            cache_directory = shaker.libs.cache.get_cache_directory('tags')
+        self.cache_directory = cache_directory
+        self.ttl = ttl
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, org_name, formula_name):
+        """
+        Load the fresh cache entry for a repository
+
+        Args:
+            org_name(string): The organisation name of the repository
+            formula_name(string): The formula name of the repository
+
+        Returns:
+            tuple: Tuple of the wanted tag and a list of tag data in the
+                github format, eg,
+                    ('v1.0.1', [{'name': 'v1.0.1', 'commit': {'sha': <sha>}}])
+                None type if there is no fresh entry
+        """
+        entry = None
+        if not self.refresh:
+            entry = self._read(org_name, formula_name)
+
+        if entry is None or (time.time() - entry.get('fetched_at', 0)) > self.ttl:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        shaker.libs.logger.Logger().debug("TagCache::load: "
+                                          "Using cached tags for %s/%s"
+                                          % (org_name, formula_name))
+        tags_data = [{'name': tag['name'], 'commit': {'sha': tag['sha']}}
+                     for tag in entry.get('tags', [])]
+        return entry.get('wanted_tag', None), tags_data
+
+    def store(self, org_name, formula_name, wanted_tag, tags_data):
+        """
+        Store the tags of a repository in the cache
+
+        Args:
+            org_name(string): The organisation name of the repository
+            formula_name(string): The formula name of the repository
+            wanted_tag(string): The tag calculated to be the preferred one
+            tags_data(list): The tag data from github
+        """
+        entry = {
+            'fetched_at': time.time(),
+            'wanted_tag': wanted_tag,
+            'tags': [{'name': tag['name'], 'sha': tag['commit']['sha']}
+                     for tag in tags_data],
+        }
+        try:
+            shaker.libs.cache.write_file_atomically(self._entry_path(org_name, formula_name),
+                                                    json.dumps(entry))
+        except (IOError, OSError) as e:
+            shaker.libs.logger.Logger().warning("TagCache::store: "
+                                                "Could not cache tags for %s/%s: %s"
+                                                % (org_name, formula_name, e))
+
+    def get_stats(self):
+        """
+        Get the cache statistics
+
+        Returns:
+            dictionary: Cache statistics of the form,
+                {
+                    'hits': <hits>,
+                    'misses': <misses>,
+                }
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _entry_path(self, org_name, formula_name):
+        """
+        Get the path of the cache entry for a repository
+
+        Args:
+            org_name(string): The organisation name of the repository
+            formula_name(string): The formula name of the repository
+
+        Returns:
+            string: The path of the entry file
+        """
+        return os.path.join(self.cache_directory,
+                            org_name,
+                            "%s.json" % (formula_name))
+
+    def _read(self, org_name, formula_name):
+        """
+        Read the cache entry for a repository, regardless of age
+
+        Args:
+            org_name(string): The organisation name of the repository
+            formula_name(string): The formula name of the repository
+
+        Returns:
+            dictionary: The entry, None type if there is no readable entry
+        """
+        entry_path = self._entry_path(org_name, formula_name)
+        if not os.path.exists(entry_path):
+            return None
+        try:
+            with open(entry_path, 'r') as entry_file:
+                return json.load(entry_file)
+        except (IOError, ValueError) as e:
+            shaker.libs.logger.Logger().debug("TagCache::_read: "
+                                              "Ignoring unreadable entry '%s': %s"
+                                              % (entry_path, e))
+        return None
+
+
+_tag_cache = None
+
+
+def get_tag_cache():
+    """
+    Get the tag cache configured for the run
+
+    Returns:
+        TagCache: The configured cache, None type if tag
+            caching is disabled
+    """
+    return _tag_cache
+
+
+def set_tag_cache(tag_cache):
+    """
+    Configure the tag cache to use for the run
+
+    Args:
+        tag_cache(TagCache): The cache to use, None type
+            to disable tag caching
+    """
+    global _tag_cache
+    _tag_cache = tag_cache
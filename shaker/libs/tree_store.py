@@ -0,0 +1,371 @@
+import errno
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+import pygit2
+
+import shaker.libs.cache
+import shaker.libs.github
+import shaker.libs.logger
+import shaker.libs.mirror_cache
+
+# Git file modes of tree entries
+FILEMODE_TREE = 0040000
+FILEMODE_LINK = 0120000
+FILEMODE_COMMIT = 0160000
+
+
+class TreeStore(object):
+    """
+    A host-wide, content-addressed store of formula file trees, keyed
+    by git tree sha. Each formula version is written out once from its
+    bare mirror, then hardlinked into each project's install directory,
+    so another project needing a stored version costs only the links.
+    An index of commit shas to tree shas means a stored version can be
+    found without opening the mirror at all.
+
+    Stored files are made read-only, as every install shares them.
+
+    Attributes:
+        cache_directory(string): The directory the store is kept in
+        hits(int): Versions found in the store
+        misses(int): Versions that had to be written to the store
+        linked_files(int): Files hardlinked into install directories
+        copied_files(int): Files copied where they could not be linked
+    """
+    cache_directory = None
+    hits = 0
+    misses = 0
+    linked_files = 0
+    copied_files = 0
+
+    def __init__(self, cache_directory=None, mirror_cache=None):
+        """
+        Initialise the store
+
+        Args:
+            cache_directory(string): (optional) The directory to keep the
+                store in, defaults to ~/.cache/salt-shaker/trees
+            mirror_cache(MirrorCache): (optional) The mirrors to read
+                versions from, defaults to the run's mirror cache or a
+                new one
+        """
+        if cache_directory is None:
+            cache_directory = shaker.libs.cache.get_cache_directory('trees')
+        if mirror_cache is None:
+            mirror_cache = shaker.libs.mirror_cache.get_mirror_cache()
+        if mirror_cache is None:
+            mirror_cache = shaker.libs.mirror_cache.MirrorCache()
+        self.cache_directory = cache_directory
+        self.mirror_cache = mirror_cache
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.linked_files = 0
+        self.copied_files = 0
+
+    def install(self,
+                target_source,
+                target_directory,
+                use_tag=False):
+        """
+        Install the requirement as specified by the formula dictionary
+        by linking its stored tree into the install directory
+
+        Args:
+            target_source(dictionary): A keyed collection of information about the
+                source, as for github.install_source
+            target_directory(string): The directory to install into
+            use_tag(bool): True to use the tag value for versioning,
+                False otherwise
+
+        Returns:
+            bool: True if the requirement is installed, False otherwise
+        """
+        target_name = target_source.get('name', None)
+        target_url = target_source.get('source', None)
+        target_path = os.path.join(target_directory, target_name)
+
+        if use_tag:
+            target_tag = target_source.get('tag', None)
+            if target_tag is None:
+                shaker.libs.logger.Logger().error("TreeStore::install: Tag usage specified but is empty")
+                return False
+            target_sha = self._resolve_ref(target_url, target_tag)
+            if target_sha is None:
+                shaker.libs.logger.Logger().error("TreeStore::install: Could not find tag or branch %s"
+                                                  % (target_tag))
+                return False
+        else:
+            target_sha = target_source.get('sha', None)
+            if target_sha is None:
+                shaker.libs.logger.Logger().error("TreeStore::install: Raw sha usage specified but is empty")
+                return False
+
+        if self._read_marker(target_path) == target_sha:
+            shaker.libs.logger.Logger().debug("TreeStore::install: %s: "
+                                              "Already at '%s'...skipping update"
+                                              % (target_path, target_sha))
+            return True
+
+        tree_path = self._get_stored_tree(target_url, target_sha)
+        if tree_path is None:
+            return False
+
+        # Link beside the target so it can be swapped in with a rename
+        link_path = tempfile.mkdtemp(dir=target_directory, prefix='.tmp-')
+        try:
+            self._link_tree(tree_path, link_path)
+            with open(os.path.join(link_path, shaker.libs.github.INSTALL_MARKER), 'w') as marker_file:
+                marker_file.write("%s\n" % (target_sha))
+            if os.path.islink(target_path) or os.path.isfile(target_path):
+                os.remove(target_path)
+            elif os.path.exists(target_path):
+                shutil.rmtree(target_path)
+            os.rename(link_path, target_path)
+        finally:
+            if os.path.exists(link_path):
+                shutil.rmtree(link_path)
+
+        shaker.libs.logger.Logger().debug("Source '%s' is at version '%s'"
+                                          % (target_name, target_sha))
+        return True
+
+    def get_stats(self):
+        """
+        Get the store statistics
+
+        Returns:
+            dictionary: Store statistics of the form,
+                {
+                    'hits': <hits>,
+                    'misses': <misses>,
+                    'linked': <files linked>,
+                    'copied': <files copied>,
+                }
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'linked': self.linked_files,
+                'copied': self.copied_files,
+            }
+
+    def _resolve_ref(self, url, ref):
+        """
+        Resolve a tag or branch to a commit sha using the mirror
+
+        Args:
+            url(string): The remote url of the repository
+            ref(string): The tag or branch to resolve
+
+        Returns:
+            string: The commit sha, None type if the ref was not found
+        """
+        mirror = pygit2.Repository(self.mirror_cache.update(url, ref))
+        try:
+            target = mirror.revparse_single(ref)
+        except KeyError:
+            return None
+        if target.type == pygit2.GIT_OBJ_TAG:
+            target = target.peel(pygit2.GIT_OBJ_COMMIT)
+        return target.hex
+
+    def _get_stored_tree(self, url, commit_sha):
+        """
+        Get the path of the stored tree of a commit, writing it out
+        from the mirror if it is not stored yet
+
+        Args:
+            url(string): The remote url of the repository
+            commit_sha(string): The commit sha to get the tree of
+
+        Returns:
+            string: The path of the stored tree, None type if the
+                commit could not be found
+        """
+        tree_sha = self._read_index(commit_sha)
+        if tree_sha is not None and os.path.isdir(self._tree_path(tree_sha)):
+            with self._lock:
+                self.hits += 1
+            return self._tree_path(tree_sha)
+
+        mirror = pygit2.Repository(self.mirror_cache.update(url, commit_sha))
+        try:
+            tree = mirror[commit_sha].tree
+        except (KeyError, ValueError):
+            shaker.libs.logger.Logger().error("TreeStore::_get_stored_tree: Could not find commit %s"
+                                              % (commit_sha))
+            return None
+        tree_sha = tree.hex
+        tree_path = self._tree_path(tree_sha)
+        if os.path.isdir(tree_path):
+            with self._lock:
+                self.hits += 1
+        else:
+            with self._lock:
+                self.misses += 1
+            shaker.libs.cache.ensure_directory(os.path.dirname(tree_path))
+            write_path = tempfile.mkdtemp(dir=os.path.dirname(tree_path), prefix='.tmp-')
+            try:
+                self._write_tree(mirror, tree, write_path)
+                try:
+                    os.rename(write_path, tree_path)
+                except OSError as e:
+                    # Another process stored the same tree first
+                    if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                        raise
+            finally:
+                if os.path.exists(write_path):
+                    shutil.rmtree(write_path)
+        shaker.libs.cache.write_file_atomically(self._index_path(commit_sha), tree_sha)
+        return tree_path
+
+    def _write_tree(self, repo, tree, path):
+        """
+        Write the files of a tree out into a directory, read-only
+
+        Args:
+            repo(pygit2.Repository): The repository holding the tree
+            tree(pygit2.Tree): The tree to write
+            path(string): The directory to write into
+        """
+        for entry in tree:
+            entry_path = os.path.join(path, entry.name)
+            if entry.filemode == FILEMODE_TREE:
+                os.mkdir(entry_path)
+                self._write_tree(repo, repo[entry.hex], entry_path)
+            elif entry.filemode == FILEMODE_LINK:
+                os.symlink(repo[entry.hex].data, entry_path)
+            elif entry.filemode == FILEMODE_COMMIT:
+                # Submodules aren't part of the formula's tree
+                continue
+            else:
+                with open(entry_path, 'wb') as entry_file:
+                    entry_file.write(repo[entry.hex].data)
+                os.chmod(entry_path, (entry.filemode & 0777) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    def _link_tree(self, tree_path, path):
+        """
+        Hardlink the files of a stored tree into a directory, copying
+        them where they can't be linked, eg, across filesystems
+
+        Args:
+            tree_path(string): The path of the stored tree
+            path(string): The directory to link into
+        """
+        linked_files = 0
+        copied_files = 0
+        for source_directory, directory_names, file_names in os.walk(tree_path):
+            relative_directory = os.path.relpath(source_directory, tree_path)
+            target_directory = os.path.normpath(os.path.join(path, relative_directory))
+            for directory_name in directory_names:
+                source = os.path.join(source_directory, directory_name)
+                target = os.path.join(target_directory, directory_name)
+                if os.path.islink(source):
+                    os.symlink(os.readlink(source), target)
+                else:
+                    os.mkdir(target)
+            for file_name in file_names:
+                source = os.path.join(source_directory, file_name)
+                target = os.path.join(target_directory, file_name)
+                if os.path.islink(source):
+                    os.symlink(os.readlink(source), target)
+                    continue
+                try:
+                    os.link(source, target)
+                    linked_files += 1
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        raise
+                    shutil.copy2(source, target)
+                    copied_files += 1
+        with self._lock:
+            self.linked_files += linked_files
+            self.copied_files += copied_files
+
+    def _read_marker(self, target_path):
+        """
+        Read the version recorded in an installed formula
+
+        Args:
+            target_path(string): The installed formula's directory
+
+        Returns:
+            string: The recorded sha, None type if there is none
+        """
+        marker_path = os.path.join(target_path, shaker.libs.github.INSTALL_MARKER)
+        if not os.path.isfile(marker_path):
+            return None
+        with open(marker_path, 'r') as marker_file:
+            return marker_file.read().strip()
+
+    def _read_index(self, commit_sha):
+        """
+        Look up the tree sha of a commit in the index
+
+        Args:
+            commit_sha(string): The commit sha to look up
+
+        Returns:
+            string: The tree sha, None type if the commit is not indexed
+        """
+        index_path = self._index_path(commit_sha)
+        if not os.path.isfile(index_path):
+            return None
+        with open(index_path, 'r') as index_file:
+            return index_file.read().strip() or None
+
+    def _index_path(self, commit_sha):
+        """
+        Get the path of a commit's index entry
+
+        Args:
+            commit_sha(string): The commit sha
+
+        Returns:
+            string: The path of the index entry
+        """
+        return os.path.join(self.cache_directory, 'commits', commit_sha[:2], commit_sha)
+
+    def _tree_path(self, tree_sha):
+        """
+        Get the path of a stored tree
+
+        Args:
+            tree_sha(string): The tree sha
+
+        Returns:
+            string: The path of the stored tree
+        """
+        return os.path.join(self.cache_directory, 'trees', tree_sha[:2], tree_sha)
+
+
+_tree_store = None
+
+
+def get_tree_store():
+    """
+    Get the tree store configured for the run
+
+    Returns:
+        TreeStore: The configured store, None type if no
+            store is configured
+    """
+    return _tree_store
+
+
+def set_tree_store(tree_store):
+    """
+    Configure the tree store to use for the run
+
+    Args:
+        tree_store(TreeStore): The store to use, None type
+            for no store
+    """
+    global _tree_store
+    _tree_store = tree_store
@@ -0,0 +1,229 @@
+import bisect
+import re
+
+# A tag version, eg, 1.2.3, 1.2.3-rc1 or the non-compliant 1.2.3rc1.
+# Missing minor and patch numbers are taken as 0, so that constraints
+# like '>=v1.1' can be compared
+version_re = re.compile(r'^(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:-?(.+))?$')
+
+# A tag the resolver ranks, as github.convert_tag_to_semver accepts
+# them, eg, v1.2.3, v1.2.3-rc1 or the non-compliant v1.2.3rc1, but
+# not tags short of a patch number like v2 or v1.0
+semver_tag_re = re.compile(r'^v\d+\.\d+\.\d+(?:-?.+)?$')
+
+
+def get_version_key(version):
+    """
+    Convert a tag version into a key that sorts numerically, with
+    pre-releases sorting below the release they lead up to, eg,
+        '1.9.0' < '1.10.0-rc1' < '1.10.0'
+
+    Args:
+        version(string): The version, without the leading 'v'
+
+    Returns:
+        tuple: The key of form (major, minor, patch, is_release, postfix),
+            None type if the version is not numeric
+    """
+    match = version_re.match(version or '')
+    if not match:
+        return None
+    major, minor, patch, postfix = match.groups()
+    return (int(major),
+            int(minor or 0),
+            int(patch or 0),
+            0 if postfix else 1,
+            postfix or '')
+
+
+class VersionIndex(object):
+    """
+    An index of a repository's version tags, parsed once into numeric
+    keys and sorted, so that constraints can be resolved with binary
+    searches rather than scans of the tag list.
+
+    Attributes:
+        versions(list): The versions of all the semver tags,
+            numerically sorted
+    """
+    versions = []
+
+    def __init__(self, tags_data):
+        """
+        Build the index from a repository's tag data
+
+        Args:
+            tags_data(list): Data for all tags, in the github format
+        """
+        self._tags_by_name = {}
+        self._versions = set()
+        keyed_versions = []
+        for tag_data in tags_data:
+            tag_name = tag_data['name']
+            self._tags_by_name.setdefault(tag_name, tag_data)
+            if not semver_tag_re.match(tag_name):
+                continue
+            version = tag_name[1:]
+            self._versions.add(version)
+            keyed_versions.append((get_version_key(version), tag_name))
+        keyed_versions.sort()
+
+        self.versions = [version_tag[1:] for _, version_tag in keyed_versions]
+        # Constraints only ever resolve to releases, so keep those
+        # apart to search them directly
+        self._release_keys = [release_key for release_key, _ in keyed_versions
+                              if release_key[3]]
+        self._release_tags = [release_tag for release_key, release_tag in keyed_versions
+                              if release_key[3]]
+
+    def __len__(self):
+        return len(self._versions)
+
+    def get(self, tag_name):
+        """
+        Get the data of a tag by name
+
+        Args:
+            tag_name(string): The tag name, eg, 'v1.2.3'
+
+        Returns:
+            dictionary: The tag data, None type if there is no such tag
+        """
+        return self._tags_by_name.get(tag_name, None)
+
+    def has_version(self, version):
+        """
+        Check for a tag of a version
+
+        Args:
+            version(string): The version, eg, '1.2.3'
+
+        Returns:
+            bool: True if the repository has a tag v<version>
+        """
+        return version in self._versions
+
+    def find_latest(self):
+        """
+        Find the latest release tag
+
+        Returns:
+            string: The tag name, None type if there are no releases
+        """
+        if not self._release_tags:
+            return None
+        return self._release_tags[-1]
+
+    def find_at_least(self, version):
+        """
+        Find the latest release tag, as long as it is at least a version
+
+        Args:
+            version(string): The lowest acceptable version
+
+        Returns:
+            string: The tag name, None type if there is no such release
+        """
+        key = self._get_constraint_key(version)
+        if not self._release_keys or self._release_keys[-1] < key:
+            return None
+        return self._release_tags[-1]
+
+    def find_at_most(self, version):
+        """
+        Find the latest release tag that is at most a version
+
+        Args:
+            version(string): The highest acceptable version
+
+        Returns:
+            string: The tag name, None type if there is no such release
+        """
+        key = self._get_constraint_key(version)
+        position = bisect.bisect_right(self._release_keys, key)
+        if position == 0:
+            return None
+        return self._release_tags[position - 1]
+
+    def find_latest_between(self, lowest=None, highest=None):
+        """
+        Find the latest release tag between two versions, inclusive
+
+        Args:
+            lowest(string): The lowest acceptable version, None type
+                for no lower bound
+            highest(string): The highest acceptable version, None type
+                for no upper bound
+
+        Returns:
+            string: The tag name, None type if there is no such release
+        """
+        position = len(self._release_keys)
+        if highest is not None:
+            position = bisect.bisect_right(self._release_keys, self._get_constraint_key(highest))
+        if position == 0:
+            return None
+        if lowest is not None and self._release_keys[position - 1] < self._get_constraint_key(lowest):
+            return None
+        return self._release_tags[position - 1]
+
+    def find_earliest_between(self, lowest=None, highest=None):
+        """
+        Find the earliest release tag between two versions, inclusive
+
+        Args:
+            lowest(string): The lowest acceptable version, None type
+                for no lower bound
+            highest(string): The highest acceptable version, None type
+                for no upper bound
+
+        Returns:
+            string: The tag name, None type if there is no such release
+        """
+        position = 0
+        if lowest is not None:
+            position = bisect.bisect_left(self._release_keys, self._get_constraint_key(lowest))
+        if position == len(self._release_keys):
+            return None
+        if highest is not None and self._release_keys[position] > self._get_constraint_key(highest):
+            return None
+        return self._release_tags[position]
+
+    def find_between(self, lowest=None, highest=None):
+        """
+        Find all the release tags between two versions, inclusive
+
+        Args:
+            lowest(string): The lowest acceptable version, None type
+                for no lower bound
+            highest(string): The highest acceptable version, None type
+                for no upper bound
+
+        Returns:
+            list: The tag names, latest first
+        """
+        start = 0
+        end = len(self._release_keys)
+        if lowest is not None:
+            start = bisect.bisect_left(self._release_keys, self._get_constraint_key(lowest))
+        if highest is not None:
+            end = bisect.bisect_right(self._release_keys, self._get_constraint_key(highest))
+        return list(reversed(self._release_tags[start:end]))
+
+    def _get_constraint_key(self, version):
+        """
+        Get the key of a version in a constraint
+
+        Args:
+            version(string): The version, eg, '1.2.3'
+
+        Returns:
+            tuple: The version key
+
+        Raises:
+            ValueError: If the version is not numeric
+        """
+        key = get_version_key(version)
+        if key is None:
+            raise ValueError("VersionIndex: Version '%s' is not numeric" % (version))
+        return key
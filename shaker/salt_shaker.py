@@ -3,9 +3,17 @@ import os
 import sys
 import warnings
 
+from shaker.libs import github
+from shaker.libs import github_graphql
+from shaker.libs import http_cache
+from shaker.libs import http_client
 from shaker.libs import logger
 from shaker.libs import metadata
+from shaker.libs import mirror_cache
 from shaker.libs import pygit2_utils
+from shaker.libs import tag_cache
+from shaker.libs import tree_store
+from shaker.libs.resolution_cache import ResolutionCache
 from shaker_metadata import ShakerMetadata
 from shaker_remote import ShakerRemote
 from shaker.libs.errors import ShakerRequirementsUpdateException
@@ -53,7 +61,12 @@ class Shaker(object):
 
     """
     def __init__(self, root_dir, salt_root_path='vendor',
-                 clone_path='formula-repos', salt_root='_root'):
+                 clone_path='formula-repos', salt_root='_root',
+                 use_graphql=False, fetch_jobs=1, jobs=1,
+                 clone_mode=github.CLONE_MODE_FULL,
+                 install_mode=github.INSTALL_MODE_GIT,
+                 solve=False,
+                 minimal=False):
         """
         Initialise application paths and collect together the
         metadata
@@ -64,6 +77,20 @@ class Shaker(object):
                 root
             clone_path(string): The directory to put formula into
             salt_root(string): The directory to link formula into
+            use_graphql(bool): True to resolve and fetch metadata in
+                batches with the github GraphQL api, False to use
+                the REST api
+            fetch_jobs(int): The number of formulas to fetch dependency
+                metadata for concurrently
+            jobs(int): The number of formulas to install concurrently
+            clone_mode(string): How to clone formula repositories, one
+                of 'full', 'shallow' or 'tags'
+            install_mode(string): How to install formulas, 'git', 'tarball',
+                'sparse' or 'store'
+            solve(bool): True to solve dependencies over the versions each
+                formula has, False to merge constraints as they are found
+            minimal(bool): True to resolve each constraint to the lowest
+                version that satisfies it, False to resolve to the highest
         """
         # Run sanity checks on pygit2
         pygit2_utils.pygit2_check()
@@ -72,7 +99,23 @@ class Shaker(object):
         self.repos_dir = os.path.join(root_dir, salt_root_path, clone_path)
 
         self._root_dir = root_dir
-        self._shaker_metadata = ShakerMetadata(root_dir)
+        self._jobs = jobs
+        self._clone_mode = clone_mode
+        self._install_mode = install_mode
+        backend = None
+        if use_graphql and minimal:
+            # GraphQL batches fetch every tag, which minimal version
+            # selection exists to avoid
+            logger.Logger().warning("Shaker::__init__: Not using the GraphQL api "
+                                    "with minimal version selection")
+        elif use_graphql:
+            backend = github_graphql.GraphQLBackend()
+        self.resolution_cache = ResolutionCache(backend=backend,
+                                                minimal=minimal)
+        self._shaker_metadata = ShakerMetadata(root_dir,
+                                               resolution_cache=self.resolution_cache,
+                                               fetch_jobs=fetch_jobs,
+                                               solve=solve)
 
     def install_requirements(self,
                              simulate=False,
@@ -88,12 +131,20 @@ class Shaker(object):
                              "dependencies will be installed "
                              "from the stored formula requirements")
         self._load_local_requirements()
+        if enable_remote_check:
+            # Locked shas need no resolving against github
+            locked = self._shaker_remote.load_lockfile()
+            if locked:
+                logger.Logger().info("Shaker::install_requirements: "
+                                     "Using %s locked shas from the formula lockfile"
+                                     % (locked))
         self._install_versioned_requirements(overwrite=False,
                                              simulate=simulate,
                                              enable_remote_check=enable_remote_check)
 
     def update_requirements(self,
-                            simulate=False):
+                            simulate=False,
+                            clean=False):
         """
         Update the formula-requirements from the metadata,
         then install them
@@ -101,13 +152,15 @@ class Shaker(object):
         Args:
             simulate(bool): True to only simulate the run,
                 false to carry it through for real
+            clean(bool): True to delete the installed formula and
+                clone them again, False to update existing clones
         """
         logger.Logger().info("Shaker::install_requirements: "
                              "Updating and Installing requirements..."
                              "all dependencies will be "
                              "re-calculated from the metadata")
         self._update_local_requirements()
-        self._install_versioned_requirements(overwrite=True,
+        self._install_versioned_requirements(overwrite=clean,
                                              simulate=simulate,
                                              enable_remote_check=True)
 
@@ -160,7 +213,11 @@ class Shaker(object):
                 recalculate shas
         """
         logger.Logger().info("Shaker: Loading the current formula requirements...")
-        self._shaker_remote = ShakerRemote(self._shaker_metadata.local_requirements)
+        self._shaker_remote = ShakerRemote(self._shaker_metadata.local_requirements,
+                                           resolution_cache=self.resolution_cache,
+                                           jobs=self._jobs,
+                                           clone_mode=self._clone_mode,
+                                           install_mode=self._install_mode)
         if enable_remote_check:
             logger.Logger().info("Shaker: Updating the current formula requirements "
                                  "dependencies...")
@@ -174,7 +231,11 @@ class Shaker(object):
         logger.Logger().info("Shaker: Updating the formula requirements...")
 
         self._shaker_metadata.update_dependencies(ignore_local_requirements=True)
-        self._shaker_remote = ShakerRemote(self._shaker_metadata.dependencies)
+        self._shaker_remote = ShakerRemote(self._shaker_metadata.dependencies,
+                                           resolution_cache=self.resolution_cache,
+                                           jobs=self._jobs,
+                                           clone_mode=self._clone_mode,
+                                           install_mode=self._install_mode)
         self._shaker_remote.update_dependencies()
 
     def _install_versioned_requirements(self,
@@ -213,6 +274,7 @@ class Shaker(object):
             if enable_remote_check:
                 logger.Logger().info("Shaker: Writing requirements file...")
                 self._shaker_remote.write_requirements(overwrite=True, backup=False)
+                self._shaker_remote.write_lockfile()
         else:
             requirements = '\n'.join(self._shaker_remote.get_requirements())
             logger.Logger().warning("Shaker: Simulation mode enabled, "
@@ -220,6 +282,125 @@ class Shaker(object):
                                     % (requirements))
 
 
+def _log_run_summary(shaker_instance):
+    """
+    Log a summary of the network activity of this run
+
+    Args:
+        shaker_instance(Shaker): The instance that carried out the run
+    """
+    resolution_stats = shaker_instance.resolution_cache.get_stats()
+    logger.Logger().info("Shaker: Constraint resolutions cached %s, resolved %s"
+                         % (resolution_stats['hits'],
+                            resolution_stats['misses']))
+    backend = shaker_instance.resolution_cache.backend
+    if backend is not None:
+        backend_stats = backend.get_stats()
+        logger.Logger().info("Shaker: GraphQL queries %s for %s repositories"
+                             % (backend_stats['queries'],
+                                backend_stats['repositories']))
+    crawl_timings = shaker_instance._shaker_metadata.crawl_timings
+    if crawl_timings:
+        logger.Logger().info("Shaker: Crawled %s dependency levels in %.2fs"
+                             % (len(crawl_timings),
+                                sum(timing['seconds'] for timing in crawl_timings)))
+        for timing in crawl_timings:
+            logger.Logger().debug("Shaker: Crawled level %s, %s formulas in %.2fs"
+                                  % (timing['level'],
+                                     timing['nodes'],
+                                     timing['seconds']))
+    for solve_stats in shaker_instance._shaker_metadata.solve_stats:
+        logger.Logger().info("Shaker: Solved dependencies with %s backtracks, "
+                             "%s versions fetched from %s repositories in %.2fs"
+                             % (solve_stats['backtracks'],
+                                solve_stats['fetches'],
+                                solve_stats['repositories'],
+                                solve_stats['seconds']))
+    shaker_remote = getattr(shaker_instance, '_shaker_remote', None)
+    if shaker_remote is not None and shaker_remote.install_results:
+        install_results = shaker_remote.install_results
+        logger.Logger().info("Shaker: Installed %s formulas, %s failed"
+                             % (len([name for name, success in install_results.items() if success]),
+                                len([name for name, success in install_results.items() if not success])))
+    if shaker_remote is not None and shaker_remote.root_link_stats:
+        root_link_stats = shaker_remote.root_link_stats
+        logger.Logger().info("Shaker: Salt root links created %s, updated %s, removed %s"
+                             % (root_link_stats['created'],
+                                root_link_stats['updated'],
+                                root_link_stats['removed']))
+    clone_stats = github.get_clone_stats()
+    for clone_mode in github.CLONE_MODES:
+        mode_stats = [stats for stats in clone_stats.values() if stats['mode'] == clone_mode]
+        if mode_stats:
+            logger.Logger().info("Shaker: Cloned %s repositories in %s mode, %s bytes in %.2fs"
+                                 % (len(mode_stats),
+                                    clone_mode,
+                                    sum(stats['bytes'] for stats in mode_stats),
+                                    sum(stats['seconds'] for stats in mode_stats)))
+    for repository, stats in sorted(clone_stats.items()):
+        logger.Logger().debug("Shaker: Cloned %s in %s mode, %s bytes in %.2fs"
+                              % (repository,
+                                 stats['mode'],
+                                 stats['bytes'],
+                                 stats['seconds']))
+    fetch_stats = github.get_incremental_fetch_stats()
+    if fetch_stats:
+        logger.Logger().info("Shaker: Fetched missing refs into %s repositories, %s bytes in %.2fs"
+                             % (len(fetch_stats),
+                                sum(stats['bytes'] for stats in fetch_stats.values()),
+                                sum(stats['seconds'] for stats in fetch_stats.values())))
+    run_mirror_cache = mirror_cache.get_mirror_cache()
+    if run_mirror_cache is not None:
+        mirror_stats = run_mirror_cache.get_stats()
+        logger.Logger().info("Shaker: Mirror cache hits %s, misses %s, fetched %s bytes"
+                             % (mirror_stats['hits'],
+                                mirror_stats['misses'],
+                                mirror_stats['bytes']))
+    run_tree_store = tree_store.get_tree_store()
+    if run_tree_store is not None:
+        store_stats = run_tree_store.get_stats()
+        logger.Logger().info("Shaker: Tree store hits %s, misses %s, files linked %s, copied %s"
+                             % (store_stats['hits'],
+                                store_stats['misses'],
+                                store_stats['linked'],
+                                store_stats['copied']))
+    client = http_client.get_client()
+    pool_stats = client.get_pool_stats()
+    logger.Logger().info("Shaker: HTTP requests %s, "
+                         "pooled connections reused %s, opened %s"
+                         % (pool_stats['requests'],
+                            pool_stats['pool_hits'],
+                            pool_stats['pool_misses']))
+    tag_fetch_stats = github.get_tag_fetch_stats()
+    if tag_fetch_stats:
+        logger.Logger().info("Shaker: Fetched tags for %s repositories in %s pages, %.2fs"
+                             % (len(tag_fetch_stats),
+                                sum(stats['pages'] for stats in tag_fetch_stats.values()),
+                                sum(stats['seconds'] for stats in tag_fetch_stats.values())))
+        for repository, stats in sorted(tag_fetch_stats.items()):
+            logger.Logger().debug("Shaker: Fetched tags for %s in %s pages, %.2fs"
+                                  % (repository,
+                                     stats['pages'],
+                                     stats['seconds']))
+    tag_lookup_stats = github.get_tag_lookup_stats()
+    if tag_lookup_stats['lookups']:
+        logger.Logger().info("Shaker: Looked up %s tags, %s found"
+                             % (tag_lookup_stats['lookups'],
+                                tag_lookup_stats['found']))
+    run_tag_cache = tag_cache.get_tag_cache()
+    if run_tag_cache is not None:
+        tag_stats = run_tag_cache.get_stats()
+        logger.Logger().info("Shaker: Tag cache hits %s, misses %s"
+                             % (tag_stats['hits'],
+                                tag_stats['misses']))
+    if client.cache is not None:
+        cache_stats = client.cache.get_stats()
+        logger.Logger().info("Shaker: HTTP cache hits %s, misses %s, revalidated %s"
+                             % (cache_stats['hits'],
+                                cache_stats['misses'],
+                                cache_stats['revalidated']))
+
+
 def _setup_logging(level):
     """
     Initialise the default application logging
@@ -238,7 +419,18 @@ def shaker(root_dir='.',
            pinned=False,
            simulate=False,
            check_requirements=False,
-           enable_remote_check=False):
+           enable_remote_check=False,
+           tag_cache_ttl=0,
+           refresh_tags=False,
+           graphql=False,
+           fetch_jobs=1,
+           jobs=1,
+           clone_mode='full',
+           mirror=False,
+           install_mode='git',
+           clean=False,
+           solve=False,
+           minimal=False):
     """
     Utility task to initiate Shaker, setting up logging and
     running the neccessary commands to install requirements
@@ -257,6 +449,34 @@ def shaker(root_dir='.',
             formula requirements
         enable_remote_check(bool): True to enable remote
             checks when installing pinned versions
+        tag_cache_ttl(int): The number of seconds cached repository
+            tag lists are used for before being refetched, 0 to
+            disable the tag cache
+        refresh_tags(bool): True to ignore cached tag lists and
+            refetch them all, updating the cache
+        graphql(bool): True to use the github GraphQL api to batch
+            dependency resolution
+        fetch_jobs(int): The number of formulas to fetch dependency
+            metadata for concurrently
+        jobs(int): The number of formulas to install concurrently
+        clone_mode(string): How to clone formula repositories, 'full'
+            for their whole history, 'shallow' for only the ref being
+            installed or 'tags' for only their tags
+        mirror(bool): True to create formula repositories from bare
+            mirrors shared by every project on the host
+        install_mode(string): 'git' to install formulas as git
+            repositories, 'tarball' to install only their files from
+            github tarballs, 'sparse' to install git repositories
+            with only the paths salt uses checked out, or 'store' to
+            hardlink them from the host's tree store
+        clean(bool): True to delete installed formulas and clone
+            them again, False to update existing clones in place
+        solve(bool): True to solve dependencies over the versions each
+            formula has, backtracking on conflicts, False to merge
+            constraints in the order they are found
+        minimal(bool): True to resolve each constraint to the lowest
+            version that satisfies it, checking only that tag exists,
+            False to resolve to the highest from the full tag list
     """
     if (debug):
         _setup_logging(logging.DEBUG)
@@ -268,14 +488,41 @@ def shaker(root_dir='.',
     if not os.path.exists(root_dir):
         os.makedirs(root_dir, 0755)
 
-    shaker_instance = Shaker(root_dir=root_dir)
+    http_client.set_client(http_client.HttpClient(cache=http_cache.HttpCache()))
+    if tag_cache_ttl > 0:
+        # Checks against the remote must see newly pushed tags, so
+        # only refresh the cache for them, never serve from it
+        refresh_tags = refresh_tags or check_requirements or enable_remote_check
+        tag_cache.set_tag_cache(tag_cache.TagCache(ttl=tag_cache_ttl,
+                                                   refresh=refresh_tags))
+    else:
+        tag_cache.set_tag_cache(None)
+    if mirror:
+        mirror_cache.set_mirror_cache(mirror_cache.MirrorCache())
+    else:
+        mirror_cache.set_mirror_cache(None)
+    if install_mode == github.INSTALL_MODE_STORE:
+        tree_store.set_tree_store(tree_store.TreeStore())
+    else:
+        tree_store.set_tree_store(None)
+
+    shaker_instance = Shaker(root_dir=root_dir,
+                             use_graphql=graphql,
+                             fetch_jobs=fetch_jobs,
+                             jobs=jobs,
+                             clone_mode=clone_mode,
+                             install_mode=install_mode,
+                             solve=solve,
+                             minimal=minimal)
     if check_requirements:
         shaker_instance.check_requirements()
     elif pinned:
         shaker_instance.install_requirements(simulate=simulate,
                                              enable_remote_check=enable_remote_check)
     else:
-        shaker_instance.update_requirements(simulate=simulate)
+        shaker_instance.update_requirements(simulate=simulate,
+                                            clean=clean)
+    _log_run_summary(shaker_instance)
 
 
 def get_deps(root_dir, root_formula=None, constraint=None, force=False):
@@ -1,13 +1,20 @@
+import copy
 import os
 import re
-import requests
+import time
 import yaml
+from multiprocessing.pool import ThreadPool
 
+from shaker.libs.errors import ConstraintResolutionException
 from shaker.libs.errors import ShakerConfigException
 from shaker.libs.errors import GithubRepositoryConnectionException
+from shaker.libs.constraint import VersionInterval
 import shaker.libs.github
+import shaker.libs.http_client
 import shaker.libs.metadata
 import shaker.libs.logger
+from shaker.libs.resolution_cache import ResolutionCache
+from shaker.libs.solver import Solver
 
 
 class ShakerMetadata:
@@ -64,11 +71,18 @@ class ShakerMetadata:
     root_metadata = {}
     local_requirements = {}
     dependencies = {}
+    fetch_jobs = 1
+    crawl_timings = []
+    solve = False
+    solve_stats = []
 
     def __init__(self,
                  working_directory='.',
                  metadata_filename='metadata.yml',
-                 autoload=True):
+                 autoload=True,
+                 resolution_cache=None,
+                 fetch_jobs=1,
+                 solve=False):
         """
         Initialise the instance from a metadata config file
 
@@ -77,10 +91,23 @@ class ShakerMetadata:
             metadata_filename(string): The filename of the metadata file
             autoload(bool): If True, then try to load local data, do nothing
                 on False
+            resolution_cache(ResolutionCache): (optional) The constraint
+                resolution cache to share for the run
+            fetch_jobs(int): The number of formulas to fetch concurrently
+                when crawling dependencies, 1 to crawl them one at a time
+            solve(bool): True to solve the dependencies over the versions each
+                formula has, False to merge their constraints as they are found
         """
         self.working_directory = working_directory
+        self.fetch_jobs = fetch_jobs
+        self.crawl_timings = []
+        self.solve = solve
+        self.solve_stats = []
         self.metadata_filename = metadata_filename
         self.requirements_filename = metadata_filename
+        if resolution_cache is None:
+            resolution_cache = ResolutionCache()
+        self._resolution_cache = resolution_cache
         if autoload:
             self.load_local_metadata()
             self.load_local_requirements()
@@ -136,8 +163,8 @@ class ShakerMetadata:
             shaker.libs.logger.Logger().debug('ShakerMetadata::update_dependencies: '
                                               'Updating from requirements')
             self.dependencies = self.local_requirements
-            self._fetch_dependencies(self.dependencies,
-                                     ignore_dependency_requirements)
+            self._update_from_base(self.dependencies,
+                                   ignore_dependency_requirements)
         else:
             shaker.libs.logger.Logger().debug('ShakerMetadata::update_dependencies: '
                                               'Updating from metadata')
@@ -147,9 +174,34 @@ class ShakerMetadata:
                 shaker.libs.logger.Logger().debug("ShakerMetadata::update_dependencies: "
                                                   "No dependencies found in metadata")
             else:
-                self.dependencies = root_dependencies
-                self._fetch_dependencies(self.dependencies,
-                                         ignore_dependency_requirements)
+                # Copy them, so merging leaves the root's own pins as they were
+                self.dependencies = copy.deepcopy(root_dependencies)
+                self._update_from_base(self.dependencies,
+                                       ignore_dependency_requirements)
+
+    def _update_from_base(self,
+                          base_dependencies,
+                          ignore_dependency_requirements=False):
+        """
+        Fetch the dependencies of the base dependencies, solving them if
+        we're in solve mode, and otherwise concurrently if we have more
+        than one fetch job
+
+        Args:
+            base_dependencies(dictionary): A metadata dictionary to use
+                as the base of our dependency loading
+            ignore_dependency_requirements(bool): True if we skip parsing the requirements file
+                for the dependencies and use their metadata directly, false otherwise
+        """
+        if self.solve:
+            self._solve_dependencies(base_dependencies,
+                                     ignore_dependency_requirements)
+        elif self.fetch_jobs > 1:
+            self._crawl_dependencies(base_dependencies,
+                                     ignore_dependency_requirements)
+        else:
+            self._fetch_dependencies(base_dependencies,
+                                     ignore_dependency_requirements)
 
     def load_local_requirements(self,
                                 input_directory='.',
@@ -309,62 +361,20 @@ class ShakerMetadata:
         shaker.libs.logger.Logger().debug('ShakerMetadata::fetch_dependencies: '
                                           'Fetching for base dependencies\n %s'
                                           % base_dependencies)
-        root_metadata = self.root_metadata.get('formula', None)
+        self._prefetch_dependencies(base_dependencies)
         for dependency_key, dependency_info in base_dependencies.items():
                 shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
                                                   "Processing '%s': "
                                                   % (dependency_key))
                 constraint = dependency_info.get('constraint', '')
-
-                if dependency_key in self.dependencies:
-                    # If we've already sourced this constrained version then we're done
-                    sourced_constraints = self.dependencies.get(dependency_key).get('sourced_constraints', [])
-                    if constraint in sourced_constraints:
-                        shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
-                                                          "Already have requirements constraint, '%s' in "
-                                                          "sourced constraints '%s'"
-                                                          % (constraint,
-                                                             sourced_constraints))
-                        continue
-
-                    elif dependency_key == root_metadata:
-                        shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
-                                                          "Root key dependency found %s = %s, skipping"
-                                                          % (dependency_key, root_metadata))
-                        continue
+                if self._is_dependency_sourced(dependency_key, constraint):
+                    continue
 
                 # We've checked whether we have this dependency, and whether we
                 # need to skip it. So now get it
-                org_name = dependency_info.get('organisation', None)
-                formula_name = dependency_info.get('name', None)
-
-                shaker.libs.logger.Logger().debug('ShakerMetadata::fetch_dependencies: '
-                                                  'Processing %s' % dependency_key)
-
-                # Try to fetch the formula requirements file, if its not found,
-                # fallback to fetching the metadata directly
-                remote_metadata = None
-                if not ignore_dependency_requirements:
-                    shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
-                                                      "Looking for requirements for %s:%s"
-                                                      % (dependency_key, constraint))
-                    remote_requirements = self._fetch_remote_requirements(org_name,
-                                                                          formula_name,
-                                                                          constraint=constraint)
-
-                    if remote_requirements:
-                        shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
-                                                          "Found requirements %s"
-                                                          % (remote_requirements))
-                        remote_metadata = {"dependencies": remote_requirements}
-
-                if not remote_metadata:
-                    shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
-                                                      "Looking for metadata for %s"
-                                                      % (dependency_key))
-                    remote_metadata = self._fetch_remote_metadata(org_name,
-                                                                  formula_name,
-                                                                  constraint=constraint)
+                remote_metadata = self._fetch_dependency_metadata(dependency_key,
+                                                                  dependency_info,
+                                                                  ignore_dependency_requirements)
 
                 # Need to ensure we don't try to re-get this one
                 constraint = dependency_info.get('constraint', '')
@@ -381,6 +391,302 @@ class ShakerMetadata:
                                                       "No requirements or metadata found for %s, skipping"
                                                       % (dependency_key))
 
+    def _crawl_dependencies(self,
+                            base_dependencies,
+                            ignore_dependency_requirements=False):
+        """
+        Fetch all of the base formulas dependencies and sub-dependencies
+        level by level, fetching each level's formulas concurrently.
+        Constraints are merged on the calling thread. Each constraint
+        found is fetched once, as in _fetch_dependencies, and merging is
+        an intersection, with root pins applied before it, so the
+        resolved constraints match those of _fetch_dependencies even
+        though the formulas are visited in a different order
+
+        Args:
+            base_dependencies(dictionary):
+                A metadata dictionary to use as the base of our
+                dependency loading, as for _fetch_dependencies
+            ignore_dependency_requirements(bool):
+                True if we want to skip parsing a remote requirements file
+                and go straight to metadata for the base dependencies,
+                False otherwise
+        """
+        self.crawl_timings = []
+        frontier = base_dependencies.items()
+        pool = ThreadPool(self.fetch_jobs)
+        try:
+            self._crawl_levels(pool, frontier, ignore_dependency_requirements)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _crawl_levels(self,
+                      pool,
+                      frontier,
+                      ignore_dependency_requirements):
+        """
+        Crawl the dependency tree a level at a time from a frontier
+
+        Args:
+            pool(ThreadPool): The pool to fetch formulas with
+            frontier(list): List of (dependency_key, dependency_info) tuples
+                on the first level
+            ignore_dependency_requirements(bool):
+                True if we want to skip parsing a remote requirements file
+                and go straight to metadata for the first level
+        """
+        level = 0
+        while frontier:
+            level_start_time = time.time()
+            # Pick out the nodes on this level that still need fetching,
+            # a formula can be reached by more than one parent
+            nodes = []
+            for dependency_key, dependency_info in frontier:
+                constraint = dependency_info.get('constraint', '')
+                if self._is_dependency_sourced(dependency_key, constraint):
+                    continue
+                if (dependency_key, constraint) in [(node_key, node_info.get('constraint', ''))
+                                                    for node_key, node_info in nodes]:
+                    continue
+                nodes.append((dependency_key, dependency_info))
+
+            next_frontier = []
+            if nodes:
+                self._prefetch_dependencies(dict(nodes))
+                # Only the base level honours the requirements flag, as
+                # _fetch_dependencies does not pass it on when recursing
+                ignore_requirements = ignore_dependency_requirements and level == 0
+                results = pool.map(lambda node: self._fetch_dependency_metadata(node[0],
+                                                                                node[1],
+                                                                                ignore_requirements),
+                                   nodes)
+
+                for (dependency_key, dependency_info), remote_metadata in zip(nodes, results):
+                    self._add_dependency_sourced(dependency_key,
+                                                 dependency_info.get('constraint', ''))
+                    if remote_metadata:
+                        remote_dependencies = self._add_dependencies_from_metadata(remote_metadata)
+                        next_frontier.extend(remote_dependencies.items())
+                    else:
+                        shaker.libs.logger.Logger().debug("ShakerMetadata::_crawl_dependencies: "
+                                                          "No requirements or metadata found for %s, skipping"
+                                                          % (dependency_key))
+
+            level_time = time.time() - level_start_time
+            self.crawl_timings.append({
+                'level': level,
+                'nodes': len(nodes),
+                'seconds': level_time,
+            })
+            shaker.libs.logger.Logger().debug("ShakerMetadata::_crawl_dependencies: "
+                                              "Fetched level %s, %s formulas in %.2fs"
+                                              % (level, len(nodes), level_time))
+            frontier = next_frontier
+            level += 1
+
+    def _solve_dependencies(self,
+                            base_dependencies,
+                            ignore_dependency_requirements=False):
+        """
+        Solve the base formulas dependencies and sub-dependencies over the
+        versions each formula has, replacing our dependencies with the
+        solution, each pinned to a version
+
+        Args:
+            base_dependencies(dictionary):
+                A metadata dictionary to use as the base of our
+                dependency loading, as for _fetch_dependencies
+            ignore_dependency_requirements(bool):
+                True if we want to skip parsing remote requirements files
+                and go straight to metadata, False otherwise
+
+        Raises:
+            ConstraintResolutionException: If there is no set of versions
+                that satisfies every constraint
+        """
+        solve_start_time = time.time()
+        solver = Solver(self._get_version_index,
+                        lambda dependency_key, dependency_info, tag:
+                            self._fetch_versioned_dependencies(dependency_info,
+                                                               tag,
+                                                               ignore_dependency_requirements),
+                        root_key=self.root_metadata.get('formula', None),
+                        minimal=self._resolution_cache.minimal)
+        try:
+            self.dependencies = solver.solve(base_dependencies)
+        finally:
+            solve_stats = solver.get_stats()
+            solve_stats['seconds'] = time.time() - solve_start_time
+            self.solve_stats.append(solve_stats)
+            shaker.libs.logger.Logger().debug("ShakerMetadata::_solve_dependencies: "
+                                              "Solved with %s backtracks, %s versions "
+                                              "fetched from %s repositories in %.2fs"
+                                              % (solve_stats['backtracks'],
+                                                 solve_stats['fetches'],
+                                                 solve_stats['repositories'],
+                                                 solve_stats['seconds']))
+
+    def _get_version_index(self,
+                           dependency_key,
+                           dependency_info):
+        """
+        Get the index of the tags of a dependency
+
+        Args:
+            dependency_key(string): The key name of the dependency
+            dependency_info(dictionary): The metadata of the dependency
+
+        Returns:
+            VersionIndex: The index of the dependency's tags
+        """
+        org_name = dependency_info.get('organisation', None)
+        formula_name = dependency_info.get('name', None)
+        _, _, tags_data = shaker.libs.github.get_valid_tags(org_name, formula_name)
+        return shaker.libs.github.get_version_index(org_name, formula_name, tags_data)
+
+    def _fetch_versioned_dependencies(self,
+                                      dependency_info,
+                                      tag,
+                                      ignore_dependency_requirements=False):
+        """
+        Fetch the dependencies of a dependency at a version, from its
+        requirements file or, failing that, its metadata
+
+        Args:
+            dependency_info(dictionary): The metadata of the dependency
+            tag(string): The tag or branch to fetch at, None type for
+                the default version
+            ignore_dependency_requirements(bool):
+                True if we want to skip parsing a remote requirements file
+                and go straight to metadata, False otherwise
+
+        Returns:
+            dictionary: The dependencies found, in the format of
+                metadata.parse_metadata_requirements
+        """
+        org_name = dependency_info.get('organisation', None)
+        formula_name = dependency_info.get('name', None)
+        constraint = '==%s' % (tag) if tag else ''
+
+        remote_dependencies = None
+        if not ignore_dependency_requirements:
+            remote_dependencies = self._fetch_remote_requirements(org_name,
+                                                                  formula_name,
+                                                                  constraint=constraint)
+        if not remote_dependencies:
+            remote_metadata = self._fetch_remote_file(org_name,
+                                                      formula_name,
+                                                      "metadata.yml",
+                                                      constraint)
+            remote_dependencies = {}
+            if remote_metadata and remote_metadata.get('dependencies', None):
+                remote_dependencies = shaker.libs.metadata.parse_metadata_requirements(remote_metadata['dependencies'])
+        return remote_dependencies
+
+    def _is_dependency_sourced(self,
+                               dependency_key,
+                               constraint):
+        """
+        Check whether a dependency needs no fetching, either because
+        we have already sourced it at this constraint or because it
+        is the root formula
+
+        Args:
+            dependency_key(string): The key name of the dependency
+            constraint(string): The constraint to source it at
+
+        Returns:
+            bool: True if the dependency should be skipped, False otherwise
+        """
+        root_metadata = self.root_metadata.get('formula', None)
+        if dependency_key in self.dependencies:
+            # If we've already sourced this constrained version then we're done
+            sourced_constraints = self.dependencies.get(dependency_key).get('sourced_constraints', [])
+            if constraint in sourced_constraints:
+                shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
+                                                  "Already have requirements constraint, '%s' in "
+                                                  "sourced constraints '%s'"
+                                                  % (constraint,
+                                                     sourced_constraints))
+                return True
+
+            elif dependency_key == root_metadata:
+                shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
+                                                  "Root key dependency found %s = %s, skipping"
+                                                  % (dependency_key, root_metadata))
+                return True
+        return False
+
+    def _fetch_dependency_metadata(self,
+                                   dependency_key,
+                                   dependency_info,
+                                   ignore_dependency_requirements=False):
+        """
+        Fetch the dependencies of a single dependency, from its
+        requirements file or, failing that, its metadata
+
+        Args:
+            dependency_key(string): The key name of the dependency
+            dependency_info(dictionary): The metadata of the dependency
+            ignore_dependency_requirements(bool):
+                True if we want to skip parsing a remote requirements file
+                and go straight to metadata, False otherwise
+
+        Returns:
+            dictionary: Metadata with the dependencies found, None type
+                if none could be found
+        """
+        org_name = dependency_info.get('organisation', None)
+        formula_name = dependency_info.get('name', None)
+        constraint = dependency_info.get('constraint', '')
+
+        shaker.libs.logger.Logger().debug('ShakerMetadata::fetch_dependencies: '
+                                          'Processing %s' % dependency_key)
+
+        # Try to fetch the formula requirements file, if its not found,
+        # fallback to fetching the metadata directly
+        remote_metadata = None
+        if not ignore_dependency_requirements:
+            shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
+                                              "Looking for requirements for %s:%s"
+                                              % (dependency_key, constraint))
+            remote_requirements = self._fetch_remote_requirements(org_name,
+                                                                  formula_name,
+                                                                  constraint=constraint)
+
+            if remote_requirements:
+                shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
+                                                  "Found requirements %s"
+                                                  % (remote_requirements))
+                remote_metadata = {"dependencies": remote_requirements}
+
+        if not remote_metadata:
+            shaker.libs.logger.Logger().debug("ShakerMetadata::fetch_dependencies: "
+                                              "Looking for metadata for %s"
+                                              % (dependency_key))
+            remote_metadata = self._fetch_remote_metadata(org_name,
+                                                          formula_name,
+                                                          constraint=constraint)
+        return remote_metadata
+
+    def _prefetch_dependencies(self, dependencies):
+        """
+        Let the resolution backend, if it supports it, fetch everything
+        needed for a collection of dependencies in a single batch
+
+        Args:
+            dependencies(dictionary): A metadata dictionary of the
+                dependencies to prefetch
+        """
+        backend = self._resolution_cache.backend
+        if backend is None or not dependencies:
+            return
+        backend.prefetch([(dependency_info.get('organisation', None),
+                           dependency_info.get('name', None),
+                           dependency_info.get('constraint', ''))
+                          for dependency_info in dependencies.values()])
+
     def _fetch_remote_metadata(self,
                                org_name,
                                formula_name,
@@ -518,7 +824,7 @@ class ShakerMetadata:
             msg = "github::get_branch_data: No valid github token"
             raise GithubRepositoryConnectionException(msg)
 
-        target_obj = shaker.libs.github.resolve_constraint_to_object(org_name, formula_name, constraint)
+        target_obj = self._resolution_cache.resolve(org_name, formula_name, constraint)
         if not target_obj:
             msg = ("ShakerMetadata::_fetch_remote_file: "
                    "%s/%s:%s: No target object found, check it exists "
@@ -529,6 +835,19 @@ class ShakerMetadata:
 
         target_tag = target_obj.get("name", None)
 
+        backend = self._resolution_cache.backend
+        if backend is not None:
+            remote_content = backend.get_file(org_name,
+                                              formula_name,
+                                              target_tag,
+                                              remote_file)
+            if remote_content:
+                return yaml.load(remote_content)
+            shaker.libs.logger.Logger().debug("ShakerMetadata::_fetch_remote_file: "
+                                              "No '%s' found in %s/%s at '%s'"
+                                              % (remote_file, org_name, formula_name, target_tag))
+            return None
+
         remote_file_url = ("https://raw.githubusercontent.com/%s/%s/%s/%s"
                            % (org_name,
                               formula_name,
@@ -536,9 +855,9 @@ class ShakerMetadata:
                               remote_file))
 
         # Check for successful access and any credential problems
-        raw_data = requests.get(remote_file_url,
-                                auth=(github_token, 'x-oauth-basic')
-                                )
+        raw_data = shaker.libs.http_client.get_client().get(remote_file_url,
+                                                            auth=(github_token, 'x-oauth-basic')
+                                                            )
         shaker.libs.logger.Logger().debug("ShakerMetadata::_fetch_remote_file: "
                                           "Calling github.validate_github_access with raw_data: " + str(raw_data)) 
         if shaker.libs.github.validate_github_access(raw_data,remote_file_url):
@@ -575,17 +894,25 @@ class ShakerMetadata:
                 parsed_metadata_dependencies = shaker.libs.metadata.parse_metadata_requirements(metadata_dependencies)
                 for dep_key, dep_info in parsed_metadata_dependencies.items():
                     if dep_key != self.root_metadata.get('formula', None):
+                        self._apply_root_pin(dep_key, dep_info)
                         if dep_key not in self.dependencies:
                             shaker.libs.logger.Logger().debug("ShakerMetadata::_add_dependencies_from_metadata: "
                                                               "New Metadata added '%s"
                                                               % (dep_key))
                             self.dependencies[dep_key] = dep_info
                         else:
-                            # Resolve constraints
-                            current_constraint = self.dependencies[dep_key].get('constraint', {})
+                            # Resolve constraints, failing as soon as no version can satisfy them
+                            current_constraint = self.dependencies[dep_key].get('constraint', None)
                             new_constraint = dep_info.get('constraint', None)
-                            self.dependencies[dep_key]['constraint'] = shaker.libs.metadata.resolve_constraints(new_constraint,
-                                                                                                                current_constraint)
+                            try:
+                                interval = shaker.libs.metadata.resolve_constraint_interval(new_constraint,
+                                                                                           current_constraint)
+                            except ConstraintResolutionException as e:
+                                msg = ("ShakerMetadata::_add_dependencies_from_metadata: "
+                                       "Conflicting constraints on '%s': %s"
+                                       % (dep_key, e))
+                                raise ConstraintResolutionException(msg)
+                            self.dependencies[dep_key]['constraint'] = str(interval)
                             shaker.libs.logger.Logger().debug("ShakerMetadata::_add_dependencies_from_metadata: "
                                                               "Updating constraint for '%s"
                                                               % (dep_key))
@@ -616,6 +943,47 @@ class ShakerMetadata:
 
         return parsed_metadata_dependencies
 
+    def _get_root_pin(self, dependency_key):
+        """
+        Get the constraint the root metadata pins a dependency to
+
+        Args:
+            dependency_key(string): The key name of the dependency
+
+        Returns:
+            string: The '==' constraint, None type if the root
+                metadata does not pin the dependency
+        """
+        root_dependencies = self.root_metadata.get('dependencies', None) or {}
+        root_constraint = root_dependencies.get(dependency_key, {}).get('constraint', None)
+        if root_constraint and VersionInterval.parse(root_constraint).pin is not None:
+            return root_constraint
+        return None
+
+    def _apply_root_pin(self, dependency_key, dependency_info):
+        """
+        Replace a sub-formula's constraint on a dependency with the root
+        metadata's pin on it, if the two conflict. The root pin wins
+        wherever in the tree the constraint was found, so the user can
+        settle any conflict by pinning the formula in the root metadata
+
+        Args:
+            dependency_key(string): The key name of the dependency
+            dependency_info(dictionary): The dependency's info, as found
+                in a sub-formula's requirements or metadata
+        """
+        root_pin = self._get_root_pin(dependency_key)
+        if root_pin is None:
+            return
+        constraint = dependency_info.get('constraint', None)
+        try:
+            shaker.libs.metadata.resolve_constraint_interval(constraint, root_pin)
+        except ConstraintResolutionException:
+            shaker.libs.logger.Logger().warning("ShakerMetadata::_add_dependencies_from_metadata: "
+                                                "Using root pin '%s' for '%s' over conflicting '%s'"
+                                                % (root_pin, dependency_key, constraint))
+            dependency_info['constraint'] = root_pin
+
     def _add_dependency_sourced(self,
                                 dependency_key,
                                 constraint):
@@ -1,13 +1,21 @@
-import errno
 import os
 import shutil
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
 
 import shaker.libs.github
 import shaker.libs.logger
+import shaker.libs.metadata
+import shaker.libs.tree_store
 from shaker.libs.errors import ConstraintResolutionException
+from shaker.libs.resolution_cache import ResolutionCache
 import re
 import yaml
 
+# The format version of formula-requirements.lock
+LOCKFILE_VERSION = 2
+
 
 class ShakerRemote:
     """
@@ -25,16 +33,34 @@ class ShakerRemote:
     _salt_root = ''
     _dynamic_modules_dirs = ['_modules', '_grains', '_renderers',
                              '_returners', '_states']
+    _jobs = 1
+    _clone_mode = shaker.libs.github.CLONE_MODE_FULL
+    _install_mode = shaker.libs.github.INSTALL_MODE_GIT
+    install_results = {}
+    root_link_stats = {}
 
     def __init__(self,
                  dependencies,
                  working_directory='vendor',
                  install_directory='formula-repos',
-                 salt_root='_root'):
+                 salt_root='_root',
+                 resolution_cache=None,
+                 jobs=1,
+                 clone_mode=shaker.libs.github.CLONE_MODE_FULL,
+                 install_mode=shaker.libs.github.INSTALL_MODE_GIT):
         self._dependencies = dependencies
+        self._jobs = jobs
+        self._clone_mode = clone_mode
+        self._install_mode = install_mode
+        self.install_results = {}
+        self.root_link_stats = {}
+        self._install_results_lock = threading.Lock()
         self._working_directory = working_directory
         self._install_directory = install_directory
         self._salt_root = salt_root
+        if resolution_cache is None:
+            resolution_cache = ResolutionCache()
+        self._resolution_cache = resolution_cache
 
     def update_dependencies(self):
         """
@@ -45,6 +71,12 @@ class ShakerRemote:
                                           "Updating the dependencies \n%s\n\n"
                                           % (self._dependencies.keys()))
         for dependency in self._dependencies.values():
+            if dependency.get("locked", False):
+                shaker.libs.logger.Logger().debug("ShakerRemote::update_dependencies: "
+                                                  "Using locked sha '%s' for '%s'"
+                                                  % (dependency.get("sha", None),
+                                                     dependency.get("name", None)))
+                continue
             target_sha = self._resolve_constraint_to_sha(dependency)
             shaker.libs.logger.Logger().debug("ShakerRemote::update_dependencies: "
                                               "Found sha '%s'"
@@ -75,80 +107,166 @@ class ShakerRemote:
         unsuccessful_updates = 0
         install_dir = os.path.join(self._working_directory,
                                    self._install_directory)
-        for dependency in self._dependencies.values():
-            dependency_name = dependency.get("name", None)
-
-            use_tag = False
-            if not enable_remote_check:
-                dependency_constraint = dependency.get("constraint", None)
-                parsed_dependency_constraint = shaker.libs.metadata.parse_constraint(dependency_constraint)
-                dependency_tag = parsed_dependency_constraint.get("tag", None)
-                shaker.libs.logger.Logger().debug("ShakerRemote::install_dependencies: "
-                                                  "No remote checks, found tag '%s'"
-                                                  % (dependency_tag))
-                if dependency_tag is not None:
-                    dependency["tag"] = dependency_tag
-                    use_tag = True
-                else:
-                    msg = ("ShakerRemote::install_dependencies: "
-                           "No tag found when remote checks disabled")
-                    raise ConstraintResolutionException(msg)
-            else:
-                shaker.libs.logger.Logger().debug("ShakerRemote::install_dependencies: "
-                                                  "Remote checks enabled on dependency %s"
-                                                  % (dependency))
-
-            success = shaker.libs.github.install_source(dependency,
-                                                        install_dir,
-                                                        use_tag)
-            shaker.libs.logger.Logger().debug("ShakerRemote::install_dependencies: "
-                                              "Installed '%s to directory '%s': %s"
-                                              % (dependency_name,
-                                                 install_dir,
-                                                 success))
+        self.install_results = {}
+        dependencies = self._dependencies.values()
+        if self._jobs > 1 and len(dependencies) > 1:
+            pool = ThreadPool(min(self._jobs, len(dependencies)))
+            try:
+                results = pool.map(lambda dependency: self._install_dependency(dependency,
+                                                                               install_dir,
+                                                                               enable_remote_check),
+                                   dependencies)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self._install_dependency(dependency,
+                                                install_dir,
+                                                enable_remote_check)
+                       for dependency in dependencies]
+
+        for success in results:
             if success:
                 successful_updates += 1
             else:
                 unsuccessful_updates += 1
 
-            success_message = "FAIL"
-            if success:
-                success_message = "OK"
-
-            if (use_tag):
-                shaker.libs.logger.Logger().info("ShakerRemote::install_dependencies: "
-                                                 "Updating '%s' from tag '%s'...%s"
-                                                 % (dependency_name,
-                                                    dependency_tag,
-                                                    success_message))
-            else:
-                shaker.libs.logger.Logger().info("ShakerRemote::install_dependencies: "
-                                                 "Updating '%s' from raw sha '%s'...%s"
-                                                 % (dependency_name,
-                                                    dependency.get("sha", None),
-                                                    success_message))
-        if remove_directories:
-            for pathname in os.listdir(install_dir):
-                    found = False
-                    for value in self._dependencies.values():
-                        name = value.get("name", None)
-                        if pathname == name:
-                            found = True
-                            break
-                    if not found:
-                        shaker.libs.logger.Logger().debug("ShakerRemote::install_dependencies: "
-                                                          "Deleting directory on non-existent "
-                                                          "dependency '%s'"
-                                                          % (pathname))
-                        fullpath = os.path.join(self._working_directory,
-                                                self._install_directory,
-                                                pathname)
-                        shutil.rmtree(fullpath)
-
-        # Do linking of modules
-        self._update_root_links()
+        failed_names = sorted(name for name, success in self.install_results.items()
+                              if not success)
+        if failed_names:
+            shaker.libs.logger.Logger().error("ShakerRemote::install_dependencies: "
+                                              "Failed to install %s"
+                                              % (', '.join(failed_names)))
+
+        # Do linking of modules, now all the installs have finished,
+        # leaving the current salt root in place if any of them failed.
+        # Only the salt root's links are kept back, the formulas they
+        # point into are updated in place by the installs that succeeded
+        if unsuccessful_updates > 0:
+            shaker.libs.logger.Logger().error("ShakerRemote::install_dependencies: "
+                                              "Not updating the salt root, %s installs failed"
+                                              % (unsuccessful_updates))
+        else:
+            self._update_root_links()
+            # The previous salt root may link into formulas that are no
+            # longer wanted, so only remove them once it's been replaced
+            if remove_directories:
+                self._remove_unused_directories(install_dir)
         return (successful_updates, unsuccessful_updates)
 
+    def _remove_unused_directories(self, install_dir):
+        """
+        Delete the directories in the install directory that don't
+        belong to a dependency
+
+        Args:
+            install_dir(string): The install directory
+        """
+        names = set(value.get("name", None) for value in self._dependencies.values())
+        for pathname in os.listdir(install_dir):
+            if pathname not in names:
+                shaker.libs.logger.Logger().debug("ShakerRemote::install_dependencies: "
+                                                  "Deleting directory on non-existent "
+                                                  "dependency '%s'"
+                                                  % (pathname))
+                shutil.rmtree(os.path.join(install_dir, pathname))
+
+    def _install_dependency(self,
+                            dependency,
+                            install_dir,
+                            enable_remote_check=False):
+        """
+        Install a single dependency into the install directory
+
+        Args:
+            dependency(dictionary): The dependency to install
+            install_dir(string): The directory to install into
+            enable_remote_check(bool): False to install from the tag in the
+                dependency's constraint, True to use the resolved sha
+
+        Returns:
+            bool: True if the install succeeded, False otherwise
+        """
+        dependency_name = dependency.get("name", None)
+
+        use_tag = False
+        if not enable_remote_check:
+            dependency_constraint = dependency.get("constraint", None)
+            parsed_dependency_constraint = shaker.libs.metadata.parse_constraint(dependency_constraint)
+            dependency_tag = parsed_dependency_constraint.tag
+            shaker.libs.logger.Logger().debug("ShakerRemote::install_dependencies: "
+                                              "No remote checks, found tag '%s'"
+                                              % (dependency_tag))
+            if dependency_tag is not None:
+                dependency["tag"] = dependency_tag
+                use_tag = True
+            else:
+                msg = ("ShakerRemote::install_dependencies: "
+                       "No tag found when remote checks disabled")
+                raise ConstraintResolutionException(msg)
+        else:
+            shaker.libs.logger.Logger().debug("ShakerRemote::install_dependencies: "
+                                              "Remote checks enabled on dependency %s"
+                                              % (dependency))
+
+        if self._install_mode == shaker.libs.github.INSTALL_MODE_TARBALL:
+            success = shaker.libs.github.install_tarball(dependency,
+                                                         install_dir,
+                                                         use_tag)
+        elif self._install_mode == shaker.libs.github.INSTALL_MODE_STORE:
+            success = self._get_tree_store().install(dependency,
+                                                     install_dir,
+                                                     use_tag)
+        elif self._install_mode == shaker.libs.github.INSTALL_MODE_SPARSE:
+            success = shaker.libs.github.install_source(dependency,
+                                                        install_dir,
+                                                        use_tag,
+                                                        clone_mode=self._clone_mode,
+                                                        sparse_paths=self._dynamic_modules_dirs)
+        else:
+            success = shaker.libs.github.install_source(dependency,
+                                                        install_dir,
+                                                        use_tag,
+                                                        clone_mode=self._clone_mode)
+        shaker.libs.logger.Logger().debug("ShakerRemote::install_dependencies: "
+                                          "Installed '%s to directory '%s': %s"
+                                          % (dependency_name,
+                                             install_dir,
+                                             success))
+        with self._install_results_lock:
+            self.install_results[dependency_name] = success
+
+        success_message = "FAIL"
+        if success:
+            success_message = "OK"
+
+        if (use_tag):
+            shaker.libs.logger.Logger().info("ShakerRemote::install_dependencies: "
+                                             "Updating '%s' from tag '%s'...%s"
+                                             % (dependency_name,
+                                                dependency_tag,
+                                                success_message))
+        else:
+            shaker.libs.logger.Logger().info("ShakerRemote::install_dependencies: "
+                                             "Updating '%s' from raw sha '%s'...%s"
+                                             % (dependency_name,
+                                                dependency.get("sha", None),
+                                                success_message))
+        return success
+
+    def _get_tree_store(self):
+        """
+        Get the tree store to install from, configuring one for
+        the run if there isn't one yet
+
+        Returns:
+            TreeStore: The tree store
+        """
+        with self._install_results_lock:
+            if shaker.libs.tree_store.get_tree_store() is None:
+                shaker.libs.tree_store.set_tree_store(shaker.libs.tree_store.TreeStore())
+            return shaker.libs.tree_store.get_tree_store()
+
     def write_requirements(self,
                            output_directory='.',
                            output_filename='formula-requirements.txt',
@@ -204,6 +322,114 @@ class ShakerRemote:
 
         return False
 
+    def write_lockfile(self,
+                       output_directory='.',
+                       output_filename='formula-requirements.lock'):
+        """
+        Write out the resolved dependencies with their source, tag, sha
+        and exports, so that pinned installs can go straight to the shas
+        without asking github for them again
+
+        The file is of the form,
+            version: 2
+            formulas:
+              test_organisation/some-formula:
+                source: git@github.com:test_organisation/some-formula.git
+                tag: v1.0.1
+                sha: <sha>
+                exports:
+                - some
+
+        Args:
+            output_directory(string): The directory of the output file
+            output_filename(string): The filename of the output file
+
+        Returns:
+            bool: True if file written, false otherwise
+        """
+        path = os.path.join(output_directory, output_filename)
+        formulas = {}
+        for key, info in self._dependencies.items():
+            formulas[key] = {
+                'source': info.get('source', None),
+                'tag': info.get('version', None),
+                'sha': info.get('sha', None),
+                'exports': self._get_formula_exports(info),
+            }
+
+        try:
+            with open(path, 'w') as outfile:
+                yaml.safe_dump({'version': LOCKFILE_VERSION, 'formulas': formulas},
+                               outfile,
+                               default_flow_style=False)
+        except IOError as e:
+            shaker.libs.logger.Logger().error("ShakerRemote::write_lockfile: "
+                                              "Problem writing '%s': %s"
+                                              % (path, e))
+            return False
+
+        shaker.libs.logger.Logger().debug("ShakerRemote::write_lockfile: "
+                                          "Wrote file '%s'"
+                                          % (path))
+        return True
+
+    def load_lockfile(self,
+                      input_directory='.',
+                      input_filename='formula-requirements.lock'):
+        """
+        Load the shas of a lockfile into the dependencies pinned to the
+        same tags, marking them as locked so update_dependencies does
+        not resolve them again
+
+        Args:
+            input_directory(string): The directory of the input file
+            input_filename(string): The filename of the input file
+
+        Returns:
+            int: The number of dependencies locked
+        """
+        path = os.path.join(input_directory, input_filename)
+        if not os.path.exists(path):
+            shaker.libs.logger.Logger().debug("ShakerRemote::load_lockfile: "
+                                              "File not found %s"
+                                              % (path))
+            return 0
+
+        with open(path, 'r') as infile:
+            lock_data = yaml.safe_load(infile) or {}
+        if lock_data.get('version', None) != LOCKFILE_VERSION:
+            shaker.libs.logger.Logger().warning("ShakerRemote::load_lockfile: "
+                                                "Ignoring '%s' with unknown version '%s'"
+                                                % (path, lock_data.get('version', None)))
+            return 0
+
+        locked = 0
+        formulas = lock_data.get('formulas', None) or {}
+        for key, dependency in self._dependencies.items():
+            lock_entry = formulas.get(key, None)
+            if not lock_entry or not lock_entry.get('sha', None):
+                continue
+            # Only trust the lock for the exact tag the requirements pin
+            constraint = dependency.get('constraint', None)
+            if not constraint:
+                continue
+            parsed_constraint = shaker.libs.metadata.parse_constraint(constraint)
+            if parsed_constraint.comparator != '==' or \
+                    parsed_constraint.tag != lock_entry.get('tag', None):
+                shaker.libs.logger.Logger().debug("ShakerRemote::load_lockfile: "
+                                                  "Lock for '%s' is at '%s', not '%s'"
+                                                  % (key, lock_entry.get('tag', None), constraint))
+                continue
+            dependency['version'] = lock_entry['tag']
+            dependency['sha'] = lock_entry['sha']
+            dependency['locked'] = True
+            locked += 1
+
+        shaker.libs.logger.Logger().debug("ShakerRemote::load_lockfile: "
+                                          "Locked %s of %s dependencies from '%s'"
+                                          % (locked, len(self._dependencies), path))
+        return locked
+
     def _get_formula_exports(self, dependency_info):
         """
         based on metadata.yml generates a list of exports
@@ -238,6 +464,167 @@ class ShakerRemote:
         return exports
 
     def _update_root_links(self):
+        """
+        Bring the salt root's links into line with the installed formulas,
+        creating, updating or removing only the links that differ.
+
+        The new links are reconciled in a staged copy of the salt root
+        beside it, which the salt root symlink is then flipped to, so
+        the salt master only ever sees a complete set of links, old or
+        new. Only the links are staged, the formulas they point into
+        have already been updated in place by the installs.
+        A salt root whose links are already right is left as it is
+
+        Returns:
+            dictionary: The links touched, as for _reconcile_root_links
+        """
+        salt_root_path = os.path.join(self._working_directory,
+                                      self._salt_root)
+        links = self._get_root_links()
+        if os.path.islink(salt_root_path):
+            self.root_link_stats = self._reconcile_root_links(salt_root_path,
+                                                              links,
+                                                              simulate=True)
+            if not (self.root_link_stats['created'] or
+                    self.root_link_stats['updated'] or
+                    self.root_link_stats['removed']):
+                shaker.libs.logger.Logger().info("ShakerRemote::update_root_links: "
+                                                 "Links unchanged %s"
+                                                 % (self.root_link_stats['unchanged']))
+                return self.root_link_stats
+        staging_path = self._stage_salt_root(salt_root_path)
+        try:
+            self.root_link_stats = self._reconcile_root_links(staging_path, links)
+            self._swap_salt_root(salt_root_path, staging_path)
+        except:
+            # Once the salt root points at the staged root it is live,
+            # so only clear the staged root away if it never got there
+            if os.path.realpath(salt_root_path) != os.path.realpath(staging_path):
+                shutil.rmtree(staging_path)
+            raise
+        shaker.libs.logger.Logger().info("ShakerRemote::update_root_links: "
+                                         "Links created %s, updated %s, removed %s, unchanged %s"
+                                         % (self.root_link_stats['created'],
+                                            self.root_link_stats['updated'],
+                                            self.root_link_stats['removed'],
+                                            self.root_link_stats['unchanged']))
+        return self.root_link_stats
+
+    def _stage_salt_root(self, salt_root_path):
+        """
+        Copy the current salt root's links into a new staging directory
+        beside it, so links resolve the same from either
+
+        Args:
+            salt_root_path(string): The salt root
+
+        Returns:
+            string: The path of the staging directory
+        """
+        staging_path = tempfile.mkdtemp(dir=os.path.dirname(salt_root_path),
+                                        prefix="%s." % (os.path.basename(salt_root_path)))
+        os.chmod(staging_path, 0755)
+        if os.path.isdir(salt_root_path):
+            for name in os.listdir(salt_root_path):
+                source = os.path.join(salt_root_path, name)
+                target = os.path.join(staging_path, name)
+                if os.path.islink(source):
+                    os.symlink(os.readlink(source), target)
+                elif os.path.isdir(source):
+                    shutil.copytree(source, target, symlinks=True)
+                else:
+                    shutil.copy2(source, target)
+        shaker.libs.logger.Logger().debug("ShakerRemote::_stage_salt_root: "
+                                          "Staging salt root in '%s'"
+                                          % (staging_path))
+        return staging_path
+
+    def _swap_salt_root(self, salt_root_path, staging_path):
+        """
+        Point the salt root symlink at a staged salt root with a rename,
+        then remove the salt root it replaced if we can, leaving it for
+        _remove_stale_salt_roots if we can't
+
+        A salt root that is still a plain directory, from before roots
+        were staged, is first moved aside, and moved back if the symlink
+        can't be put in its place
+
+        Args:
+            salt_root_path(string): The salt root
+            staging_path(string): The staged salt root to swap in
+        """
+        previous_path = None
+        moved_aside = False
+        if os.path.islink(salt_root_path):
+            previous_path = os.path.join(os.path.dirname(salt_root_path),
+                                         os.readlink(salt_root_path))
+        elif os.path.isdir(salt_root_path):
+            previous_path = tempfile.mkdtemp(dir=os.path.dirname(salt_root_path),
+                                             prefix="%s." % (os.path.basename(salt_root_path)))
+            os.rename(salt_root_path, previous_path)
+            moved_aside = True
+
+        link_path = "%s.tmp-%s" % (salt_root_path, os.getpid())
+        try:
+            os.symlink(os.path.basename(staging_path), link_path)
+            os.rename(link_path, salt_root_path)
+        except:
+            if os.path.lexists(link_path):
+                os.remove(link_path)
+            if moved_aside and not os.path.lexists(salt_root_path):
+                os.rename(previous_path, salt_root_path)
+            raise
+        shaker.libs.logger.Logger().debug("ShakerRemote::_swap_salt_root: "
+                                          "Swapped salt root '%s' to '%s'"
+                                          % (salt_root_path, staging_path))
+
+        if (previous_path is not None and
+                os.path.isdir(previous_path) and
+                os.path.realpath(previous_path) != os.path.realpath(staging_path)):
+            try:
+                shutil.rmtree(previous_path)
+            except (IOError, OSError) as e:
+                shaker.libs.logger.Logger().warning("ShakerRemote::_swap_salt_root: "
+                                                    "Could not remove previous salt root '%s', "
+                                                    "leaving it for the next run: %s"
+                                                    % (previous_path, e))
+
+    def _remove_stale_salt_roots(self):
+        """
+        Remove the staged salt roots and temporary links that a run
+        interrupted before swapping in its salt root left behind,
+        keeping the salt root the salt root symlink points at
+        """
+        salt_root_path = os.path.join(self._working_directory,
+                                      self._salt_root)
+        current_path = None
+        if os.path.islink(salt_root_path):
+            current_path = os.path.realpath(salt_root_path)
+        prefix = "%s." % (os.path.basename(salt_root_path))
+        for name in os.listdir(self._working_directory):
+            path = os.path.join(self._working_directory, name)
+            if not name.startswith(prefix):
+                continue
+            if not os.path.islink(path) and os.path.realpath(path) == current_path:
+                continue
+            shaker.libs.logger.Logger().debug("ShakerRemote::_remove_stale_salt_roots: "
+                                              "Removing stale salt root '%s'"
+                                              % (path))
+            if os.path.islink(path) or not os.path.isdir(path):
+                os.remove(path)
+            else:
+                shutil.rmtree(path)
+
+    def _get_root_links(self):
+        """
+        Work out the links the salt root should contain, from each
+        formula's exports and dynamic module directories
+
+        Returns:
+            dictionary: The link sources keyed by their path relative
+                to the salt root, eg, {'docker': '../formula-repos/docker-formula/docker'}
+        """
+        links = {}
         for dependency_info in self._dependencies.values():
             shaker.libs.logger.Logger().debug("ShakerRemote::update_root_links: "
                                               "Updating '%s"
@@ -255,18 +642,13 @@ class ShakerRemote:
                                                name,
                                                export
                                                ),
-                        "target": os.path.join(self._working_directory,
-                                               self._salt_root,
-                                               export
-                                               )
+                        "target": export
                     },
                     {
                         "source": os.path.join(self._working_directory,
                                                self._install_directory,
                                                name),
-                        "target": os.path.join(self._working_directory,
-                                               self._salt_root,
-                                               name)
+                        "target": name
                     },
                 ]
                 subdir_found = False
@@ -274,13 +656,12 @@ class ShakerRemote:
                     source = subdir_candidate["source"]
                     target = subdir_candidate["target"]
                     if os.path.exists(source):
-                        if not os.path.exists(target):
+                        if target not in links:
                             subdir_found = True
-                            relative_source = os.path.relpath(source, os.path.dirname(target))
-                            os.symlink(relative_source, target)
-                            shaker.libs.logger.Logger().info("ShakerRemote::update_root_links: "
-                                                              "Linking %s to %s"
-                                                              % (source, target))
+                            target_path = os.path.join(self._working_directory,
+                                                       self._salt_root,
+                                                       target)
+                            links[target] = os.path.relpath(source, os.path.dirname(target_path))
                         else:
                             msg = ("ShakerRemote::update_root_links: "
                                    "Target '%s' conflicts with something else"
@@ -296,10 +677,20 @@ class ShakerRemote:
                            % (name))
                     raise IOError(msg)
                 else:
-                    self._link_dynamic_modules(name)
+                    self._get_dynamic_module_links(name, links)
+        return links
+
+    def _get_dynamic_module_links(self, dependency_name, links):
+        """
+        Add the links for a formula's dynamic modules to a set of
+        salt root links, the first formula to provide a module
+        winning
 
-    def _link_dynamic_modules(self, dependency_name):
-        shaker.libs.logger.Logger().debug("ShakerRemote::_link_dynamic_modules(%s) "
+        Args:
+            dependency_name(string): The name of the formula
+            links(dictionary): The salt root links, as for _get_root_links
+        """
+        shaker.libs.logger.Logger().debug("ShakerRemote::_get_dynamic_module_links(%s) "
                                           % (dependency_name))
 
         repo_dir = os.path.join(self._working_directory, self._install_directory, dependency_name)
@@ -314,22 +705,112 @@ class ShakerRemote:
 
             if os.path.isdir(sourcedir):
                 for name in os.listdir(sourcedir):
-                    if not os.path.isdir(targetdir):
-                        os.mkdir(targetdir)
                     sourcefile = os.path.join(relative_source, name)
-                    targetfile = os.path.join(targetdir, name)
-                    try:
-                        shaker.libs.logger.Logger().debug("ShakerRemote::_link_dynamic_modules"
-                                                          "linking %s"
-                                                          % (sourcefile))
-                        os.symlink(sourcefile, targetfile)
-                    except OSError as e:
-                        if e.errno == errno.EEXIST:  # already exist
-                            shaker.libs.logger.Logger().warning("ShakerRemote::_link_dynamic_modules: "
+                    target = os.path.join(libdir, name)
+                    if target in links:
+                        if links[target] != sourcefile:
+                            shaker.libs.logger.Logger().warning("ShakerRemote::_get_dynamic_module_links: "
                                                                 "Not linking %s as link already exists"
                                                                 % (sourcefile))
-                        else:
-                            raise
+                        continue
+                    links[target] = sourcefile
+
+    def _reconcile_root_links(self, salt_root_path, links, simulate=False):
+        """
+        Make the links in a salt root match a desired set of links,
+        leaving links that are already correct untouched so the salt
+        master's view of the root never goes empty
+
+        Args:
+            salt_root_path(string): The salt root directory
+            links(dictionary): The desired links, as for _get_root_links
+            simulate(bool): True to only count the links that would be
+                touched, without changing anything
+
+        Returns:
+            dictionary: The links touched, of the form,
+                {
+                    'created': <links created>,
+                    'updated': <links pointed at a new source>,
+                    'removed': <links removed>,
+                    'unchanged': <links left as they were>,
+                }
+        """
+        stats = {'created': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        if not os.path.isdir(salt_root_path):
+            if simulate:
+                stats['created'] = len(links)
+                return stats
+            os.makedirs(salt_root_path)
+
+        # Remove what is no longer wanted, descending only into
+        # the dynamic module directories we manage
+        for name in os.listdir(salt_root_path):
+            path = os.path.join(salt_root_path, name)
+            if (name in self._dynamic_modules_dirs and
+                    name not in links and
+                    not os.path.islink(path) and
+                    os.path.isdir(path)):
+                for module_name in os.listdir(path):
+                    if os.path.join(name, module_name) not in links:
+                        if not simulate:
+                            self._remove_root_entry(os.path.join(path, module_name))
+                        stats['removed'] += 1
+                if not simulate and not os.listdir(path):
+                    os.rmdir(path)
+            elif name not in links:
+                if not simulate:
+                    self._remove_root_entry(path)
+                stats['removed'] += 1
+
+        for target, source in sorted(links.items()):
+            path = os.path.join(salt_root_path, target)
+            if os.path.islink(path):
+                if os.readlink(path) == source:
+                    stats['unchanged'] += 1
+                    continue
+                if simulate:
+                    stats['updated'] += 1
+                    continue
+                # Swap the link in place with a rename, so it never goes missing
+                temporary_path = "%s.tmp-%s" % (path, os.getpid())
+                os.symlink(source, temporary_path)
+                os.rename(temporary_path, path)
+                stats['updated'] += 1
+                shaker.libs.logger.Logger().info("ShakerRemote::update_root_links: "
+                                                 "Relinking %s to %s"
+                                                 % (source, path))
+            elif os.path.lexists(path):
+                msg = ("ShakerRemote::update_root_links: "
+                       "Target '%s' conflicts with something else"
+                       % (path))
+                raise IOError(msg)
+            elif simulate:
+                stats['created'] += 1
+            else:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.mkdir(os.path.dirname(path))
+                os.symlink(source, path)
+                stats['created'] += 1
+                shaker.libs.logger.Logger().info("ShakerRemote::update_root_links: "
+                                                 "Linking %s to %s"
+                                                 % (source, path))
+        return stats
+
+    def _remove_root_entry(self, path):
+        """
+        Remove an entry from the salt root that is no longer wanted
+
+        Args:
+            path(string): The path of the entry
+        """
+        shaker.libs.logger.Logger().info("ShakerRemote::update_root_links: "
+                                         "Removing %s"
+                                         % (path))
+        if os.path.islink(path) or not os.path.isdir(path):
+            os.remove(path)
+        else:
+            shutil.rmtree(path)
 
     def _resolve_constraint_to_sha(self,
                                    dependency):
@@ -343,7 +824,7 @@ class ShakerRemote:
         constraint = dependency.get('constraint', None)
 
         # Resolve the constraint to an actual tag
-        target_obj = shaker.libs.github.resolve_constraint_to_object(org, name, constraint)
+        target_obj = self._resolution_cache.resolve(org, name, constraint)
         if target_obj:
             dependency["version"] = target_obj['name']
             dependency["sha"] = target_obj["commit"]['sha']
@@ -358,20 +839,19 @@ class ShakerRemote:
     def _create_directories(self, overwrite=False):
         """
         Make sure all our required directories are set up correctly
+
+        Args:
+            overwrite(bool): True to delete the install directory and
+                its formulas, False to keep existing formulas to be
+                updated in place
         """
         if not os.path.exists(self._working_directory):
             os.makedirs(self._working_directory, 0755)
 
-        # Delete the salt roots dir on each run.
-        # This is because the files in roots_dir are just symlinks
-        salt_root_path = os.path.join(self._working_directory,
-                                      self._salt_root)
-        if os.path.exists(salt_root_path):
-            shutil.rmtree(salt_root_path)
-            shaker.libs.logger.Logger().debug("_create_directories: Deleting salt root directory '%s'"
-                                              % (salt_root_path))
-        os.makedirs(salt_root_path)
-
+        # The salt root is staged and swapped in after installing,
+        # so keep what is there for the salt master to serve until then,
+        # only clearing out what an interrupted run left beside it
+        self._remove_stale_salt_roots()
         # Ensure the repos_dir exists
         install_path = os.path.join(self._working_directory,
                                     self._install_directory)
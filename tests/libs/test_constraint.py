@@ -0,0 +1,61 @@
+import unittest
+
+from shaker.libs.constraint import Constraint
+from shaker.libs.constraint import Version
+from shaker.libs.constraint import VersionInterval
+from shaker.libs.errors import ConstraintResolutionException
+from shaker.libs import metadata
+
+
+class TestConstraint(unittest.TestCase):
+
+    def test_parse(self):
+        """
+        TestConstraint: Test constraints are parsed once and usable as the dictionary form
+        """
+        constraint = metadata.parse_constraint('>=v1.2.3-rc1')
+        self.assertTrue(constraint is metadata.parse_constraint('>=v1.2.3-rc1'))
+        self.assertTrue(metadata.parse_constraint(constraint) is constraint)
+        self.assertEqual(constraint,
+                         {'comparator': '>=', 'tag': 'v1.2.3-rc1', 'version': '1.2.3', 'postfix': 'rc1'})
+        self.assertEqual(constraint['tag'], 'v1.2.3-rc1')
+        self.assertEqual(constraint.get('missing', 'default'), 'default')
+        self.assertEqual(str(constraint), '>=v1.2.3-rc1')
+        self.assertEqual(metadata.parse_constraint('==master'),
+                         {'comparator': '==', 'tag': 'master', 'version': None, 'postfix': None})
+        self.assertRaises(AttributeError, setattr, constraint, 'tag', 'v2.0.0')
+
+    def test_version_ordering(self):
+        """
+        TestConstraint: Test versions compare numerically
+        """
+        self.assertTrue(Version.parse('v1.9.0') < Version.parse('v1.10.0'))
+        self.assertTrue(Version.parse('v1.10.0-rc1') < Version.parse('v1.10.0'))
+        self.assertEqual(max(Constraint.parse('>=v1.9.0').target,
+                             Constraint.parse('>=v1.10.0').target).tag,
+                         'v1.10.0')
+        self.assertEqual(metadata.resolve_constraints('<=v1.10.0', '<=v1.9.0'), '<=v1.9.0')
+        self.assertEqual(Version.parse('v1.0.0').__lt__('v2.0.0'), NotImplemented)
+        self.assertEqual(Version.parse('v1.0.0').__ge__(None), NotImplemented)
+
+    def test_version_interval(self):
+        """
+        TestConstraint: Test intervals intersect, and empty intervals are reported
+        """
+        interval = VersionInterval.parse('>=v1.2.0').intersect(VersionInterval.parse('<=v1.10.0'))
+        self.assertEqual(str(interval), '>=v1.2.0,<=v1.10.0')
+        self.assertTrue(VersionInterval.parse('>=v1.2.0,<=v1.10.0') is VersionInterval.parse(str(interval)))
+        self.assertTrue(interval.contains('v1.9.0'))
+        self.assertFalse(interval.contains('v1.11.0'))
+        self.assertEqual(str(interval.intersect(VersionInterval.parse('>=v1.3.0,<=v1.20.0'))),
+                         '>=v1.3.0,<=v1.10.0')
+        self.assertEqual(str(interval.intersect(VersionInterval.parse('==v1.9.0'))), '==v1.9.0')
+        self.assertEqual(str(VersionInterval.parse('>=v1.2.0,<=v1.2.0')), '==v1.2.0')
+        self.assertEqual(str(VersionInterval.parse('==master').intersect(interval)), '==master')
+        self.assertEqual(str(VersionInterval.parse('')), '')
+        self.assertRaises(ConstraintResolutionException,
+                          interval.intersect, VersionInterval.parse('>=v1.11.0'))
+        self.assertRaises(ConstraintResolutionException,
+                          interval.intersect, VersionInterval.parse('==v1.1.0'))
+        self.assertRaises(ConstraintResolutionException,
+                          VersionInterval.parse('==v1.2.0').intersect, VersionInterval.parse('==v1.3.0'))
@@ -4,6 +4,12 @@ import requests
 import responses
 import json
 import pygit2
+import shutil
+import tarfile
+import tempfile
+from StringIO import StringIO
+from mock import MagicMock
+from mock import patch
 from nose.tools import raises
 
 import shaker.libs.github
@@ -50,8 +56,11 @@ class TestGithub(unittest.TestCase):
     def setUp(self):
         unittest.TestCase.setUp(self)
         os.environ['GITHUB_TOKEN'] = 'false'
+        # The .git directory of mock repositories
+        self._git_directory = tempfile.mkdtemp()
 
     def tearDown(self):
+        shutil.rmtree(self._git_directory)
         unittest.TestCase.tearDown(self)
 
     def test_parse_github_url(self):
@@ -378,6 +387,117 @@ class TestGithub(unittest.TestCase):
                                                                    constraint)
         self.assertTrue(False, "TODO")
 
+    def test_resolve_constraint_to_object_greater_than_numeric(self):
+        """
+        TestGithub: Test that versions are compared numerically, not as strings
+        """
+        tags_data = [{"name": "v1.9.0"}, {"name": "v1.10.0"}, {"name": "v1.10.1-rc1"}]
+        valid_tags = shaker.libs.github.get_valid_tags_from_data(tags_data)
+        tag_data = shaker.libs.github.resolve_constraint_to_object('ministryofjustice',
+                                                                   'test-formula',
+                                                                   '>=v1.9.1',
+                                                                   valid_tags=valid_tags)
+        self.assertEqual(tag_data, {"name": "v1.10.0"})
+        tag_data = shaker.libs.github.resolve_constraint_to_object('ministryofjustice',
+                                                                   'test-formula',
+                                                                   '<=v1.9.9',
+                                                                   valid_tags=valid_tags)
+        self.assertEqual(tag_data, {"name": "v1.9.0"})
+        tag_data = shaker.libs.github.resolve_constraint_to_object('ministryofjustice',
+                                                                   'test-formula',
+                                                                   '>=v1.9.0,<=v1.10.1',
+                                                                   valid_tags=valid_tags)
+        self.assertEqual(tag_data, {"name": "v1.10.0"})
+
+    @patch('shaker.libs.github.VersionIndex', wraps=shaker.libs.github.VersionIndex)
+    def test_get_version_index(self, mock_version_index):
+        """
+        TestGithub: Test a repository's version index is only rebuilt when its tags change
+        """
+        tags_data = [{"name": "v1.0.0"}, {"name": "v1.1.0"}]
+        first_index = shaker.libs.github.get_version_index('ministryofjustice',
+                                                           'index-formula',
+                                                           tags_data)
+        second_index = shaker.libs.github.get_version_index('ministryofjustice',
+                                                            'index-formula',
+                                                            list(tags_data))
+        self.assertIs(first_index, second_index)
+        self.assertEqual(mock_version_index.call_count, 1)
+
+        changed_index = shaker.libs.github.get_version_index('ministryofjustice',
+                                                             'index-formula',
+                                                             tags_data + [{"name": "v1.2.0"}])
+        self.assertIsNot(changed_index, first_index)
+        self.assertEqual(changed_index.find_latest(), 'v1.2.0')
+        self.assertEqual(mock_version_index.call_count, 2)
+
+    @responses.activate
+    def test_get_tag_data(self):
+        """
+        TestGithub: Test single tags are looked up with the refs api, peeling annotated tags
+        """
+        refs_url = 'https://api.github.com/repos/ministryofjustice/test-formula/git/ref/tags/%s'
+        responses.add(responses.GET,
+                      refs_url % ('v1.0.1'),
+                      content_type="application/json",
+                      body=json.dumps({"ref": "refs/tags/v1.0.1",
+                                       "object": {"type": "commit", "sha": "1" * 40}}),
+                      status=200)
+        responses.add(responses.GET,
+                      refs_url % ('v2.0.1'),
+                      content_type="application/json",
+                      body=json.dumps({"ref": "refs/tags/v2.0.1",
+                                       "object": {"type": "tag", "sha": "a" * 40}}),
+                      status=200)
+        responses.add(responses.GET,
+                      'https://api.github.com/repos/ministryofjustice/test-formula/git/tags/%s' % ("a" * 40),
+                      content_type="application/json",
+                      body=json.dumps({"tag": "v2.0.1",
+                                       "object": {"type": "commit", "sha": "2" * 40}}),
+                      status=200)
+        responses.add(responses.GET,
+                      refs_url % ('v3.0.1'),
+                      content_type="application/json",
+                      body=json.dumps({"message": "Not Found"}),
+                      status=404)
+
+        self.assertEqual(shaker.libs.github.get_tag_data('ministryofjustice', 'test-formula', 'v1.0.1'),
+                         {'name': 'v1.0.1', 'commit': {'sha': "1" * 40}})
+        self.assertEqual(shaker.libs.github.get_tag_data('ministryofjustice', 'test-formula', 'v2.0.1'),
+                         {'name': 'v2.0.1', 'commit': {'sha': "2" * 40}})
+        self.assertEqual(shaker.libs.github.get_tag_data('ministryofjustice', 'test-formula', 'v3.0.1'),
+                         None)
+
+    @patch('shaker.libs.github.get_valid_tags')
+    @patch('shaker.libs.github.get_tag_data')
+    def test_resolve_minimal_constraint_to_object(self,
+                                                  mock_get_tag_data,
+                                                  mock_get_valid_tags):
+        """
+        TestGithub: Test constraints resolve to their lowest version, listing tags only when needed
+        """
+        tags_data = [{"name": "v1.2.0"}, {"name": "v1.10.0"}, {"name": "v2.0.0"}]
+        tags_by_name = dict((tag_data['name'], tag_data) for tag_data in tags_data)
+        mock_get_tag_data.side_effect = lambda org_name, formula_name, tag_name: tags_by_name.get(tag_name, None)
+        mock_get_valid_tags.return_value = ('v2.0.0', ['1.2.0', '1.10.0', '2.0.0'], tags_data)
+
+        tag_data = shaker.libs.github.resolve_minimal_constraint_to_object('ministryofjustice',
+                                                                           'test-formula',
+                                                                           '>=v1.10.0,<=v2.0.0')
+        self.assertEqual(tag_data, {"name": "v1.10.0"})
+        self.assertEqual(mock_get_valid_tags.call_count, 0)
+        # There's no tag v1.3, so the tags are listed for the release above it
+        tag_data = shaker.libs.github.resolve_minimal_constraint_to_object('ministryofjustice',
+                                                                           'test-formula',
+                                                                           '>=v1.3')
+        self.assertEqual(tag_data, {"name": "v1.10.0"})
+        self.assertEqual(mock_get_valid_tags.call_count, 1)
+        self.assertRaises(ConstraintResolutionException,
+                          shaker.libs.github.resolve_minimal_constraint_to_object,
+                          'ministryofjustice',
+                          'test-formula',
+                          '==v1.3.0')
+
     @responses.activate
     def test_get_valid_tags(self):
         responses.add(responses.GET,
@@ -397,6 +517,48 @@ class TestGithub(unittest.TestCase):
         self.assertEqual(tag_versions, expected_tag_versions, "Actual wanted tag '%s, expected '%s'"
                          % (tag_versions, expected_tag_versions))
 
+    @responses.activate
+    def test_get_valid_tags_paginated(self):
+        """
+        TestGithub: Test every page of tags is fetched and merged
+        """
+        tags_url = 'https://api.github.com/repos/ministryofjustice/test-formula/tags'
+        responses.add(responses.GET,
+                      '%s?per_page=100&page=1' % (tags_url),
+                      content_type="application/json",
+                      body=json.dumps(self._sample_response_tags[:1]),
+                      status=200,
+                      adding_headers={
+                          "Link": ('<%s?per_page=100&page=2>; rel="next", '
+                                   '<%s?per_page=100&page=3>; rel="last"'
+                                   % (tags_url, tags_url))
+                      },
+                      match_querystring=True
+                      )
+        responses.add(responses.GET,
+                      '%s?per_page=100&page=2' % (tags_url),
+                      content_type="application/json",
+                      body=json.dumps(self._sample_response_tags[1:]),
+                      status=200,
+                      match_querystring=True
+                      )
+        responses.add(responses.GET,
+                      '%s?per_page=100&page=3' % (tags_url),
+                      content_type="application/json",
+                      body=json.dumps(self._sample_response_tags[1:]),
+                      status=200,
+                      match_querystring=True
+                      )
+        org = 'ministryofjustice'
+        formula = 'test-formula'
+        wanted_tag, tag_versions, tags_data = shaker.libs.github.get_valid_tags(org, formula)
+
+        self.assertEqual(wanted_tag, "v2.0.1")
+        self.assertEqual(tag_versions, ["1.0.1", "2.0.1"])
+        self.assertEqual(len(tags_data), 2)
+        fetch_stats = shaker.libs.github.get_tag_fetch_stats()
+        self.assertEqual(fetch_stats["%s/%s" % (org, formula)]['pages'], 3)
+
     def test_get_latest_tag_no_prereleases(self):
         """
         Test latest tag with no prerelease
@@ -509,6 +671,24 @@ class TestGithub(unittest.TestCase):
                          % (result,
                             expected_result))
 
+    def test_parse_semver_tag_no_dots(self):
+        """
+        Parse a tag without dots between its version numbers
+        """
+        tag = "v1x2x3"
+        result = shaker.libs.github.parse_semver_tag(tag)
+        expected_result = {
+            "major": None,
+            "minor": None,
+            "patch": None,
+            "postfix": None
+        }
+        self.assertEqual(result,
+                         expected_result,
+                         "%s != %s"
+                         % (result,
+                            expected_result))
+
     def test_is_tag_release(self):
         """
         Test tag is a valid release
@@ -626,3 +806,614 @@ class TestGithub(unittest.TestCase):
                                                         formula,
                                                         constraint)
         # We're testing for exceptions, No assertion needed
+
+    def test_get_clone_refspecs(self):
+        """
+        TestGithub: Test the refspecs fetched for each clone mode
+        """
+        sha = '1d7d509b534b08b08b1f85253990b6c3f0dec007'
+        self.assertEqual(shaker.libs.github.get_clone_refspecs('tags', 'v1.0.1'),
+                         ['+refs/tags/*:refs/tags/*'])
+        self.assertEqual(shaker.libs.github.get_clone_refspecs('shallow', sha),
+                         [sha])
+        self.assertEqual(shaker.libs.github.get_clone_refspecs('shallow', 'v1.0.1'),
+                         ['+refs/tags/v1.0.1:refs/tags/v1.0.1',
+                          '+refs/heads/v1.0.1:refs/remotes/origin/v1.0.1'])
+        self.assertEqual(shaker.libs.github.get_clone_refspecs('shallow', sha, 'v1.0.1'),
+                         ['+refs/tags/v1.0.1:refs/tags/v1.0.1',
+                          '+refs/heads/v1.0.1:refs/remotes/origin/v1.0.1'])
+
+    @patch('pygit2.RemoteCallbacks')
+    @patch('pygit2.init_repository')
+    @patch('os.path.isdir')
+    def test_open_repository__shallow(self,
+                                      mock_isdir,
+                                      mock_init_repository,
+                                      mock_remote_callbacks):
+        """
+        TestGithub: Test a shallow clone fetches only the ref at depth 1 and records its transfer
+        """
+        def fetch(refspecs, callbacks=None, depth=0):
+            progress = MagicMock()
+            progress.received_bytes = 1024
+            callbacks.transfer_progress(progress)
+
+        mock_isdir.return_value = False
+        remote = MagicMock()
+        remote.name = 'origin'
+        remote.fetch.side_effect = fetch
+        repo = mock_init_repository.return_value
+        repo.create_remote.return_value = remote
+        repo.remotes = [remote]
+
+        target_directory = 'vendor/formula-repos/test-formula'
+        result = shaker.libs.github.open_repository('git@github.com:ministryofjustice/test-formula.git',
+                                                    target_directory,
+                                                    clone_mode='shallow',
+                                                    ref='v1.0.1')
+
+        self.assertEqual(result, repo)
+        mock_init_repository.assert_called_once_with(target_directory)
+        self.assertEqual(remote.fetch.call_count, 1)
+        self.assertEqual(remote.fetch.call_args[0][0],
+                         ['+refs/tags/v1.0.1:refs/tags/v1.0.1',
+                          '+refs/heads/v1.0.1:refs/remotes/origin/v1.0.1'])
+        self.assertEqual(remote.fetch.call_args[1]['depth'], 1)
+        clone_stats = shaker.libs.github.get_clone_stats()[target_directory]
+        self.assertEqual(clone_stats['mode'], 'shallow')
+        self.assertEqual(clone_stats['bytes'], 1024)
+
+    @patch('pygit2.RemoteCallbacks')
+    def test_fetch_refs__no_tags(self,
+                                 mock_remote_callbacks):
+        """
+        TestGithub: Test fetches without tag following drop only the new tags they weren't asked for
+        """
+        repo = MagicMock()
+        repo.listall_references.side_effect = [
+            ['refs/tags/v0.0.1'],
+            ['refs/tags/v0.0.1', 'refs/tags/v1.0.1', 'refs/tags/v2.0.1',
+             'refs/remotes/origin/v1.0.1'],
+        ]
+        remote = MagicMock()
+        refspecs = ['+refs/tags/v1.0.1:refs/tags/v1.0.1',
+                    '+refs/heads/v1.0.1:refs/remotes/origin/v1.0.1']
+
+        shaker.libs.github.fetch_refs(repo, remote, refspecs, follow_tags=False)
+
+        repo.lookup_reference.assert_called_once_with('refs/tags/v2.0.1')
+        self.assertTrue(repo.lookup_reference.return_value.delete.called)
+        self.assertFalse(repo.config.__setitem__.called)
+        self.assertTrue(shaker.libs.github._is_refspec_destination('refs/tags/v2.0.1',
+                                                                   ['+refs/tags/*:refs/tags/*']))
+
+    @patch('pygit2.RemoteCallbacks')
+    @patch('pygit2.Repository')
+    @patch('os.path.isdir')
+    def test_open_repository__fetch_missing_ref(self,
+                                                mock_isdir,
+                                                mock_repository,
+                                                mock_remote_callbacks):
+        """
+        TestGithub: Test an existing repository fetches a tag it does not have, then every tag and branch
+        """
+        mock_isdir.return_value = True
+        remote = MagicMock()
+        remote.name = 'origin'
+        repo = mock_repository.return_value
+        repo.remotes = [remote]
+        repo.revparse_single.side_effect = KeyError('v2.0.1')
+        repo.lookup_reference.side_effect = KeyError('refs/tags/v2.0.1')
+        repo.lookup_branch.return_value = None
+
+        result = shaker.libs.github.open_repository('git@github.com:ministryofjustice/test-formula.git',
+                                                    'vendor/formula-repos/test-formula',
+                                                    ref='v2.0.1')
+
+        self.assertEqual(result, False)
+        self.assertEqual(remote.fetch.call_count, 2)
+        self.assertEqual(remote.fetch.call_args_list[0][0][0],
+                         ['+refs/tags/v2.0.1:refs/tags/v2.0.1',
+                          '+refs/heads/v2.0.1:refs/remotes/origin/v2.0.1'])
+        self.assertEqual(remote.fetch.call_args_list[1][0][0],
+                         shaker.libs.github.TAGS_AND_BRANCHES_REFSPECS)
+
+    @patch('pygit2.Repository')
+    @patch('os.path.isdir')
+    def test_open_repository__have_ref(self,
+                                       mock_isdir,
+                                       mock_repository):
+        """
+        TestGithub: Test an existing repository with the ref makes no fetch
+        """
+        mock_isdir.return_value = True
+        remote = MagicMock()
+        remote.name = 'origin'
+        repo = mock_repository.return_value
+        repo.remotes = [remote]
+
+        shaker.libs.github.open_repository('git@github.com:ministryofjustice/test-formula.git',
+                                           'vendor/formula-repos/test-formula',
+                                           ref='v1.0.1')
+
+        repo.lookup_reference.assert_called_once_with('refs/tags/v1.0.1')
+        self.assertFalse(remote.fetch.called)
+
+    def _commit_and_tag(self, repo, tag):
+        """
+        Commit a new version to master in a bare repository and tag it
+        """
+        signature = pygit2.Signature('test', 'test@example.com')
+        builder = repo.TreeBuilder()
+        builder.insert('VERSION', repo.create_blob(tag), pygit2.GIT_FILEMODE_BLOB)
+        parents = [] if repo.head_is_unborn else [repo.head.target]
+        oid = repo.create_commit('refs/heads/master',
+                                 signature,
+                                 signature,
+                                 tag,
+                                 builder.write(),
+                                 parents)
+        repo.create_reference('refs/tags/%s' % (tag), oid)
+        return oid.hex
+
+    def test_install_source__new_upstream_tag(self):
+        """
+        TestGithub: Test an existing clone is updated in place to the sha of a new upstream tag
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            origin_url = os.path.join(directory, 'test-formula.git')
+            origin = pygit2.init_repository(origin_url, bare=True)
+            target_source = {
+                'name': 'test-formula',
+                'source': origin_url,
+                'sha': self._commit_and_tag(origin, 'v1.0.1'),
+                'tag': 'v1.0.1',
+            }
+            install_directory = os.path.join(directory, 'formula-repos')
+            target_path = os.path.join(install_directory, 'test-formula')
+            self.assertTrue(shaker.libs.github.install_source(target_source, install_directory))
+
+            target_source['sha'] = self._commit_and_tag(origin, 'v2.0.1')
+            target_source['tag'] = 'v2.0.1'
+            with patch('shutil.rmtree') as mock_rmtree:
+                self.assertTrue(shaker.libs.github.install_source(target_source, install_directory))
+            self.assertFalse(mock_rmtree.called)
+
+            self.assertEqual(shaker.libs.github.get_head_sha(pygit2.Repository(target_path)),
+                             target_source['sha'])
+            self.assertTrue(target_path in shaker.libs.github.get_incremental_fetch_stats())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_open_repository__moved_branch(self):
+        """
+        TestGithub: Test an existing repository fetches a branch it has again, in case it moved upstream
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            origin_url = os.path.join(directory, 'test-formula.git')
+            origin = pygit2.init_repository(origin_url, bare=True)
+            self._commit_and_tag(origin, 'v1.0.1')
+            target_path = os.path.join(directory, 'test-formula')
+            self.assertTrue(shaker.libs.github.open_repository(origin_url,
+                                                               target_path,
+                                                               ref='master'))
+
+            sha = self._commit_and_tag(origin, 'v2.0.1')
+            repo = shaker.libs.github.open_repository(origin_url,
+                                                      target_path,
+                                                      ref='master')
+
+            self.assertEqual(repo.lookup_branch('origin/master', pygit2.GIT_BRANCH_REMOTE).target.hex,
+                             sha)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_open_repository__missing_upstream(self):
+        """
+        TestGithub: Test an existing repository without a ref that upstream doesn't have either is not returned
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            origin_url = os.path.join(directory, 'test-formula.git')
+            origin = pygit2.init_repository(origin_url, bare=True)
+            self._commit_and_tag(origin, 'v1.0.1')
+            target_path = os.path.join(directory, 'test-formula')
+            self.assertTrue(shaker.libs.github.open_repository(origin_url,
+                                                               target_path,
+                                                               ref='v1.0.1'))
+
+            self.assertEqual(shaker.libs.github.open_repository(origin_url,
+                                                                target_path,
+                                                                ref='v2.0.1'),
+                             False)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_open_repository__not_a_repository(self):
+        """
+        TestGithub: Test an install directory without a repository, eg, from a tarball, is replaced by a clone
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            origin_url = os.path.join(directory, 'test-formula.git')
+            origin = pygit2.init_repository(origin_url, bare=True)
+            sha = self._commit_and_tag(origin, 'v1.0.1')
+            target_path = os.path.join(directory, 'test-formula')
+            os.makedirs(target_path)
+            with open(os.path.join(target_path, shaker.libs.github.INSTALL_MARKER), 'w') as marker_file:
+                marker_file.write('%s\n' % (sha))
+
+            repo = shaker.libs.github.open_repository(origin_url,
+                                                      target_path,
+                                                      ref='v1.0.1')
+
+            self.assertTrue(sha in repo)
+            self.assertFalse(os.path.exists(os.path.join(target_path,
+                                                         shaker.libs.github.INSTALL_MARKER)))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_open_repository__shallow_sha(self):
+        """
+        TestGithub: Test a shallow clone of a sha falls back to the tags and branches it is on
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            origin_url = os.path.join(directory, 'test-formula.git')
+            origin = pygit2.init_repository(origin_url, bare=True)
+            sha = self._commit_and_tag(origin, 'v1.0.1')
+            self._commit_and_tag(origin, 'v2.0.1')
+            target_path = os.path.join(directory, 'test-formula')
+
+            repo = shaker.libs.github.open_repository(origin_url,
+                                                      target_path,
+                                                      clone_mode='shallow',
+                                                      ref=sha)
+
+            self.assertTrue(sha in repo)
+            self.assertEqual(shaker.libs.github.get_clone_stats()[target_path]['mode'],
+                             'shallow')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_open_repository__shallow_sha_with_tag(self):
+        """
+        TestGithub: Test a shallow clone of a sha fetches only the tag it was resolved from
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            origin_url = os.path.join(directory, 'test-formula.git')
+            origin = pygit2.init_repository(origin_url, bare=True)
+            sha = self._commit_and_tag(origin, 'v1.0.1')
+            self._commit_and_tag(origin, 'v2.0.1')
+            target_path = os.path.join(directory, 'test-formula')
+
+            repo = shaker.libs.github.open_repository(origin_url,
+                                                      target_path,
+                                                      clone_mode='shallow',
+                                                      ref=sha,
+                                                      tag='v1.0.1')
+
+            self.assertTrue(sha in repo)
+            self.assertEqual(repo.listall_references(), ['refs/tags/v1.0.1'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_clone_refs__tags_branch(self):
+        """
+        TestGithub: Test a tags clone of a branch falls back to fetching the branches
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            origin_url = os.path.join(directory, 'test-formula.git')
+            origin = pygit2.init_repository(origin_url, bare=True)
+            self._commit_and_tag(origin, 'v1.0.1')
+            target_path = os.path.join(directory, 'test-formula')
+
+            repo = shaker.libs.github._clone_refs(origin_url,
+                                                  target_path,
+                                                  None,
+                                                  'tags',
+                                                  ref='master')
+
+            self.assertTrue(shaker.libs.github.has_ref(repo, 'master'))
+        finally:
+            shutil.rmtree(directory)
+
+    @patch('shutil.rmtree')
+    @patch('shaker.libs.github.open_repository')
+    def test_install_source__reclone(self,
+                                     mock_open_repository,
+                                     mock_rmtree):
+        """
+        TestGithub: Test an existing clone that can't get the ref is cloned again
+        """
+        sha = '1d7d509b534b08b08b1f85253990b6c3f0dec007'
+        head_object = MagicMock()
+        head_object.hex = sha
+        repo = MagicMock()
+        repo.path = self._git_directory
+        repo.revparse_single.return_value = head_object
+        mock_open_repository.side_effect = [False, repo]
+
+        target_source = {
+            'name': 'test-formula',
+            'source': 'git@github.com:ministryofjustice/test-formula.git',
+            'sha': sha,
+        }
+        result = shaker.libs.github.install_source(target_source,
+                                                   'vendor/formula-repos')
+
+        self.assertTrue(result)
+        mock_rmtree.assert_called_once_with('vendor/formula-repos/test-formula')
+        self.assertEqual(mock_open_repository.call_count, 2)
+
+    @patch('shaker.libs.github.open_repository')
+    def test_install_source__missing_sha(self,
+                                         mock_open_repository):
+        """
+        TestGithub: Test an install fails when the repository does not have the sha
+        """
+        sha = '1d7d509b534b08b08b1f85253990b6c3f0dec007'
+        repo = MagicMock()
+        repo.__getitem__.side_effect = KeyError(sha)
+        mock_open_repository.return_value = repo
+
+        target_source = {
+            'name': 'test-formula',
+            'source': 'git@github.com:ministryofjustice/test-formula.git',
+            'sha': sha,
+        }
+        result = shaker.libs.github.install_source(target_source,
+                                                   'vendor/formula-repos')
+
+        self.assertFalse(result)
+        self.assertFalse(repo.checkout_tree.called)
+
+    @responses.activate
+    def test_install_tarball(self):
+        """
+        TestGithub: Test a tarball is extracted without its top directory, and reinstalls are skipped
+        """
+        sha = '1d7d509b534b08b08b1f85253990b6c3f0dec007'
+        tarball_data = StringIO()
+        tarball = tarfile.open(fileobj=tarball_data, mode='w:gz')
+        for name, contents in [('metadata.yml', 'exports:\n- test\n'),
+                               ('test/init.sls', 'test: {}\n')]:
+            member = tarfile.TarInfo('ministryofjustice-test-formula-1d7d509/%s' % (name))
+            member.size = len(contents)
+            tarball.addfile(member, StringIO(contents))
+        tarball.close()
+        responses.add(responses.GET,
+                      'https://api.github.com/repos/ministryofjustice/test-formula/tarball/%s' % (sha),
+                      content_type="application/x-gzip",
+                      body=tarball_data.getvalue(),
+                      status=200
+                      )
+
+        install_directory = tempfile.mkdtemp()
+        try:
+            target_source = {
+                'name': 'test-formula',
+                'organisation': 'ministryofjustice',
+                'sha': sha,
+            }
+            self.assertTrue(shaker.libs.github.install_tarball(target_source, install_directory))
+            self.assertTrue(shaker.libs.github.install_tarball(target_source, install_directory))
+
+            target_path = os.path.join(install_directory, 'test-formula')
+            self.assertEqual(sorted(os.listdir(install_directory)), ['test-formula'])
+            with open(os.path.join(target_path, 'test', 'init.sls')) as sls_file:
+                self.assertEqual(sls_file.read(), 'test: {}\n')
+            with open(os.path.join(target_path, shaker.libs.github.INSTALL_MARKER)) as marker_file:
+                self.assertEqual(marker_file.read(), '%s\n' % (sha))
+            self.assertEqual(len(responses.calls), 1)
+        finally:
+            shutil.rmtree(install_directory)
+
+    def test_get_sparse_checkout_paths(self):
+        """
+        TestGithub: Test sparse paths come from the exports in metadata.yml, or are unknown without them
+        """
+        metadata_blob = MagicMock()
+        metadata_blob.data = "exports:\n- test\n- test-extra\n"
+        metadata_entry = MagicMock()
+        metadata_entry.hex = 'a' * 40
+        repo = {'a' * 40: metadata_blob}
+        tree = {'metadata.yml': metadata_entry}
+        self.assertEqual(shaker.libs.github.get_sparse_checkout_paths(repo, tree, ['_modules']),
+                         ['metadata.yml', 'test', 'test-extra', '_modules'])
+
+        metadata_blob.data = "dependencies:\n- test_organisation/test2-formula\n"
+        self.assertEqual(shaker.libs.github.get_sparse_checkout_paths(repo, tree, ['_modules']),
+                         None)
+        self.assertEqual(shaker.libs.github.get_sparse_checkout_paths(repo, {}, ['_modules']),
+                         None)
+
+    @patch('shaker.libs.github.open_repository')
+    def test_install_source__sparse(self,
+                                    mock_open_repository):
+        """
+        TestGithub: Test a sparse install checks out only the exports and module paths, without a hard reset
+        """
+        sha = '1d7d509b534b08b08b1f85253990b6c3f0dec007'
+        metadata_blob = MagicMock()
+        metadata_blob.data = "exports:\n- test\n"
+        metadata_entry = MagicMock()
+        metadata_entry.hex = 'a' * 40
+        commit = MagicMock()
+        commit.tree = {'metadata.yml': metadata_entry}
+        repo = MagicMock()
+        repo.path = self._git_directory
+        repo.__getitem__.side_effect = lambda oid: metadata_blob if oid == 'a' * 40 else commit
+        tag_object = MagicMock()
+        tag_object.type = pygit2.GIT_OBJ_COMMIT
+        tag_object.hex = sha
+        head_object = MagicMock()
+        head_object.hex = '6826533980361f54b9de17d181830fa4ec94138c'
+        repo.revparse_single.side_effect = lambda ref: {'v2.0.1': tag_object, 'HEAD': head_object}[ref]
+        mock_open_repository.return_value = repo
+
+        target_source = {
+            'name': 'test-formula',
+            'source': 'git@github.com:ministryofjustice/test-formula.git',
+            'tag': 'v2.0.1',
+        }
+        result = shaker.libs.github.install_source(target_source,
+                                                   'vendor/formula-repos',
+                                                   use_tag=True,
+                                                   sparse_paths=['_modules', '_states'])
+
+        self.assertTrue(result)
+        repo.checkout_tree.assert_called_once_with(commit.tree,
+                                                   paths=['metadata.yml', 'test', '_modules', '_states'],
+                                                   strategy=pygit2.GIT_CHECKOUT_FORCE)
+        self.assertFalse(repo.reset.called)
+
+    def _create_sparse_origin(self, directory):
+        """
+        Create a bare formula repository with a tag v1.0.1 of exports,
+        dynamic modules and other files, and master moved on past it
+        """
+        origin_url = os.path.join(directory, 'test-formula.git')
+        origin = pygit2.init_repository(origin_url, bare=True)
+        signature = pygit2.Signature('test', 'test@example.com')
+        test_builder = origin.TreeBuilder()
+        test_builder.insert('init.sls', origin.create_blob('test: {}\n'), pygit2.GIT_FILEMODE_BLOB)
+        modules_builder = origin.TreeBuilder()
+        modules_builder.insert('test.py', origin.create_blob(''), pygit2.GIT_FILEMODE_BLOB)
+        docs_builder = origin.TreeBuilder()
+        docs_builder.insert('README.md', origin.create_blob(''), pygit2.GIT_FILEMODE_BLOB)
+        builder = origin.TreeBuilder()
+        builder.insert('metadata.yml', origin.create_blob('exports:\n- test\n'), pygit2.GIT_FILEMODE_BLOB)
+        builder.insert('test', test_builder.write(), pygit2.GIT_FILEMODE_TREE)
+        builder.insert('_modules', modules_builder.write(), pygit2.GIT_FILEMODE_TREE)
+        builder.insert('docs', docs_builder.write(), pygit2.GIT_FILEMODE_TREE)
+        sha = origin.create_commit('refs/heads/master',
+                                   signature,
+                                   signature,
+                                   'v1.0.1',
+                                   builder.write(),
+                                   []).hex
+        origin.create_reference('refs/tags/v1.0.1', sha)
+        # Move master on, so a clone's default checkout is the wrong version
+        builder.insert('NEWER', origin.create_blob('newer'), pygit2.GIT_FILEMODE_BLOB)
+        origin.create_commit('refs/heads/master',
+                             signature,
+                             signature,
+                             'newer',
+                             builder.write(),
+                             [origin.head.target])
+        return origin_url, sha
+
+    def test_install_source__sparse_repository(self):
+        """
+        TestGithub: Test a sparse install of a real clone leaves only the sparse paths, at the target version
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            origin_url, sha = self._create_sparse_origin(directory)
+
+            target_source = {
+                'name': 'test-formula',
+                'source': origin_url,
+                'sha': sha,
+                'tag': 'v1.0.1',
+            }
+            install_directory = os.path.join(directory, 'formula-repos')
+            target_path = os.path.join(install_directory, 'test-formula')
+            self.assertTrue(shaker.libs.github.install_source(target_source,
+                                                              install_directory,
+                                                              sparse_paths=['_modules']))
+
+            self.assertEqual(sorted(os.listdir(target_path)),
+                             ['.git', '_modules', 'metadata.yml', 'test'])
+            with open(os.path.join(target_path, 'test', 'init.sls')) as sls_file:
+                self.assertEqual(sls_file.read(), 'test: {}\n')
+            self.assertEqual(shaker.libs.github.get_head_sha(pygit2.Repository(target_path)),
+                             sha)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_install_source__sparse_then_full(self):
+        """
+        TestGithub: Test switching an existing clone between sparse and full installs checks the tree out again
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            origin_url, sha = self._create_sparse_origin(directory)
+            target_source = {
+                'name': 'test-formula',
+                'source': origin_url,
+                'sha': sha,
+                'tag': 'v1.0.1',
+            }
+            install_directory = os.path.join(directory, 'formula-repos')
+            target_path = os.path.join(install_directory, 'test-formula')
+            self.assertTrue(shaker.libs.github.install_source(target_source,
+                                                              install_directory,
+                                                              sparse_paths=['_modules']))
+            self.assertFalse(os.path.exists(os.path.join(target_path, 'docs')))
+
+            self.assertTrue(shaker.libs.github.install_source(target_source,
+                                                              install_directory))
+            self.assertEqual(sorted(os.listdir(target_path)),
+                             ['.git', '_modules', 'docs', 'metadata.yml', 'test'])
+            repo = pygit2.Repository(target_path)
+            self.assertEqual(repo.status(), {})
+            self.assertEqual(shaker.libs.github.get_checkout_mode(repo), 'full')
+
+            self.assertTrue(shaker.libs.github.install_source(target_source,
+                                                              install_directory,
+                                                              sparse_paths=['_modules']))
+            self.assertEqual(sorted(os.listdir(target_path)),
+                             ['.git', '_modules', 'metadata.yml', 'test'])
+            self.assertEqual(shaker.libs.github.get_checkout_mode(pygit2.Repository(target_path)),
+                             'sparse')
+        finally:
+            shutil.rmtree(directory)
+
+    @patch('shaker.libs.github.open_repository')
+    def test_install_source__tag_at_head(self,
+                                         mock_open_repository):
+        """
+        TestGithub: Test a tag install is skipped when HEAD is already at the tag's commit, checked out in full
+        """
+        sha = '1d7d509b534b08b08b1f85253990b6c3f0dec007'
+        tag_object = MagicMock()
+        tag_object.type = pygit2.GIT_OBJ_TAG
+        tag_object.peel.return_value.hex = sha
+        head_object = MagicMock()
+        head_object.hex = sha
+        repo = MagicMock()
+        repo.path = self._git_directory
+        repo.revparse_single.side_effect = lambda ref: {'v2.0.1': tag_object, 'HEAD': head_object}[ref]
+        mock_open_repository.return_value = repo
+        shaker.libs.github.set_checkout_mode(repo, shaker.libs.github.CHECKOUT_MODE_FULL)
+
+        target_source = {
+            'name': 'test-formula',
+            'source': 'git@github.com:ministryofjustice/test-formula.git',
+            'tag': 'v2.0.1',
+        }
+        result = shaker.libs.github.install_source(target_source,
+                                                   'vendor/formula-repos',
+                                                   use_tag=True)
+
+        self.assertTrue(result)
+        self.assertEqual(mock_open_repository.call_count, 1)
+        self.assertFalse(repo.checkout_tree.called)
+        self.assertFalse(repo.set_head.called)
+        self.assertFalse(repo.reset.called)
+
+        # A sparse checkout at the tag's commit is missing files, so is checked out again
+        shaker.libs.github.set_checkout_mode(repo, shaker.libs.github.CHECKOUT_MODE_SPARSE)
+        result = shaker.libs.github.install_source(target_source,
+                                                   'vendor/formula-repos',
+                                                   use_tag=True)
+
+        self.assertTrue(result)
+        self.assertEqual(repo.checkout_tree.call_args[1]['strategy'], pygit2.GIT_CHECKOUT_FORCE)
+        self.assertEqual(shaker.libs.github.get_checkout_mode(repo), shaker.libs.github.CHECKOUT_MODE_FULL)
@@ -0,0 +1,168 @@
+import unittest
+import os
+import json
+import responses
+import shutil
+import tempfile
+from nose.tools import raises
+
+import shaker.libs.github_graphql
+import shaker.libs.tag_cache
+from shaker.libs.errors import GithubRepositoryConnectionException
+from shaker.libs.github_graphql import GraphQLBackend
+from shaker.libs.tag_cache import TagCache
+
+
+class TestGithubGraphQL(unittest.TestCase):
+
+    _sample_response_tags = {
+        "data": {
+            "r0": {
+                "refs": {
+                    "pageInfo": {"hasNextPage": False, "endCursor": None},
+                    "nodes": [
+                        {
+                            "name": "v1.0.1",
+                            "target": {"oid": "6826533980361f54b9de17d181830fa4ec94138c"}
+                        },
+                        {
+                            "name": "v2.0.1",
+                            "target": {
+                                "oid": "aaaa509b534b08b08b1f85253990b6c3f0dec007",
+                                "target": {"oid": "1d7d509b534b08b08b1f85253990b6c3f0dec007"}
+                            }
+                        },
+                    ]
+                }
+            }
+        }
+    }
+
+    _sample_response_files = {
+        "data": {
+            "f0": {
+                "requirements": None,
+                "metadata": {"text": "dependencies:\n- test_organisation/test2-formula\n"}
+            }
+        }
+    }
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        os.environ['GITHUB_TOKEN'] = 'false'
+
+    def tearDown(self):
+        shaker.libs.tag_cache.set_tag_cache(None)
+        unittest.TestCase.tearDown(self)
+
+    @responses.activate
+    def test_prefetch(self):
+        """
+        TestGithubGraphQL: Test tags and files are prefetched in batched queries
+        """
+        responses.add(responses.POST,
+                      shaker.libs.github_graphql.GRAPHQL_URL,
+                      content_type="application/json",
+                      body=json.dumps(self._sample_response_tags),
+                      status=200
+                      )
+        responses.add(responses.POST,
+                      shaker.libs.github_graphql.GRAPHQL_URL,
+                      content_type="application/json",
+                      body=json.dumps(self._sample_response_files),
+                      status=200
+                      )
+        backend = GraphQLBackend()
+        backend.prefetch([('test_organisation', 'test1-formula', '>=v1.0.0')])
+
+        tag_data = backend.resolve('test_organisation', 'test1-formula', '>=v1.0.0')
+        self.assertEqual(tag_data,
+                         {'name': 'v2.0.1',
+                          'commit': {'sha': '1d7d509b534b08b08b1f85253990b6c3f0dec007'}})
+        self.assertEqual(backend.get_file('test_organisation',
+                                          'test1-formula',
+                                          'v2.0.1',
+                                          'metadata.yml'),
+                         "dependencies:\n- test_organisation/test2-formula\n")
+        self.assertEqual(backend.get_file('test_organisation',
+                                          'test1-formula',
+                                          'v2.0.1',
+                                          'formula-requirements.txt'),
+                         None)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(backend.get_stats(), {'queries': 2, 'repositories': 1})
+        self.assertTrue('refs/tags/' in json.loads(responses.calls[0].request.body)['query'])
+        self.assertTrue('v2.0.1:metadata.yml' in json.loads(responses.calls[1].request.body)['query'])
+
+    @responses.activate
+    def test_prefetch__missing_repository(self):
+        """
+        TestGithubGraphQL: Test a repository github does not return is neither loaded nor cached
+        """
+        responses.add(responses.POST,
+                      shaker.libs.github_graphql.GRAPHQL_URL,
+                      content_type="application/json",
+                      body=json.dumps({
+                          "data": {"r0": None},
+                          "errors": [{"type": "NOT_FOUND",
+                                      "path": ["r0"],
+                                      "message": "Could not resolve to a Repository"}]
+                      }),
+                      status=200
+                      )
+        cache_directory = tempfile.mkdtemp()
+        try:
+            tag_cache = TagCache(cache_directory=cache_directory)
+            shaker.libs.tag_cache.set_tag_cache(tag_cache)
+            backend = GraphQLBackend()
+            backend.prefetch([('test_organisation', 'test1-formula', '>=v1.0.0')])
+
+            self.assertEqual(backend.get_stats(), {'queries': 1, 'repositories': 0})
+            self.assertEqual(tag_cache.load('test_organisation', 'test1-formula'), None)
+        finally:
+            shutil.rmtree(cache_directory)
+
+    @raises(GithubRepositoryConnectionException)
+    @responses.activate
+    def test_resolve__missing_repository(self):
+        """
+        TestGithubGraphQL: Test resolving a repository github does not return raises
+        """
+        responses.add(responses.POST,
+                      shaker.libs.github_graphql.GRAPHQL_URL,
+                      content_type="application/json",
+                      body=json.dumps({"data": {"r0": None}}),
+                      status=200
+                      )
+        backend = GraphQLBackend()
+        backend.resolve('test_organisation', 'test1-formula', '>=v1.0.0')
+
+    @raises(GithubRepositoryConnectionException)
+    @responses.activate
+    def test_query__errors(self):
+        """
+        TestGithubGraphQL: Test a query with errors for the query as a whole raises
+        """
+        responses.add(responses.POST,
+                      shaker.libs.github_graphql.GRAPHQL_URL,
+                      content_type="application/json",
+                      body=json.dumps({"errors": [{"message": "Something went wrong"}]}),
+                      status=200
+                      )
+        backend = GraphQLBackend()
+        backend.resolve('test_organisation', 'test1-formula', '>=v1.0.0')
+
+    @raises(GithubRepositoryConnectionException)
+    @responses.activate
+    def test_query__null_data(self):
+        """
+        TestGithubGraphQL: Test a query returning null data raises
+        """
+        responses.add(responses.POST,
+                      shaker.libs.github_graphql.GRAPHQL_URL,
+                      content_type="application/json",
+                      body=json.dumps({"data": None}),
+                      status=200
+                      )
+        backend = GraphQLBackend()
+        backend.resolve('test_organisation', 'test1-formula', '>=v1.0.0')
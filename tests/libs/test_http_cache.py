@@ -0,0 +1,162 @@
+import unittest
+import json
+import shutil
+import tempfile
+import responses
+
+from shaker.libs.http_cache import HttpCache
+from shaker.libs.http_cache import _get_identity
+from shaker.libs.http_client import HttpClient
+
+
+class TestHttpCache(unittest.TestCase):
+
+    _sample_url = "https://api.github.com/repos/test_organisation/test-formula/tags"
+    _sample_auth = ('token-1', 'x-oauth-basic')
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self._cache_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._cache_directory)
+        unittest.TestCase.tearDown(self)
+
+    @responses.activate
+    def test_get__not_modified(self):
+        """
+        TestHttpCache: Test a 304 response is served from the cache
+        """
+        body = json.dumps([{"name": "v1.0.0"}])
+        responses.add(responses.GET,
+                      self._sample_url,
+                      content_type="application/json",
+                      body=body,
+                      status=200,
+                      adding_headers={"ETag": '"abc"'}
+                      )
+        responses.add(responses.GET,
+                      self._sample_url,
+                      status=304
+                      )
+        cache = HttpCache(self._cache_directory)
+        client = HttpClient(cache=cache)
+
+        first_response = client.get(self._sample_url, auth=self._sample_auth, use_cache=True)
+        second_response = client.get(self._sample_url, auth=self._sample_auth, use_cache=True)
+
+        self.assertEqual(first_response.text, body)
+        self.assertEqual(second_response.status_code, 200)
+        self.assertEqual(second_response.text, body)
+        self.assertEqual(responses.calls[1].request.headers.get('If-None-Match'),
+                         '"abc"')
+        self.assertEqual(cache.get_stats(),
+                         {'hits': 1, 'misses': 1, 'revalidated': 1})
+
+    @responses.activate
+    def test_get__modified(self):
+        """
+        TestHttpCache: Test a changed response replaces the cached entry
+        """
+        responses.add(responses.GET,
+                      self._sample_url,
+                      body="first",
+                      status=200,
+                      adding_headers={"ETag": '"abc"'}
+                      )
+        responses.add(responses.GET,
+                      self._sample_url,
+                      body="second",
+                      status=200,
+                      adding_headers={"ETag": '"def"'}
+                      )
+        cache = HttpCache(self._cache_directory)
+        client = HttpClient(cache=cache)
+
+        client.get(self._sample_url, auth=self._sample_auth, use_cache=True)
+        response = client.get(self._sample_url, auth=self._sample_auth, use_cache=True)
+
+        self.assertEqual(response.text, "second")
+        self.assertEqual(cache._load(self._sample_url, _get_identity(self._sample_auth, {}))['etag'], '"def"')
+        self.assertEqual(cache.get_stats(),
+                         {'hits': 0, 'misses': 1, 'revalidated': 1})
+
+    @responses.activate
+    def test_get__no_cache_requested(self):
+        """
+        TestHttpCache: Test the cache is bypassed unless asked for
+        """
+        responses.add(responses.GET,
+                      self._sample_url,
+                      body="first",
+                      status=200,
+                      adding_headers={"ETag": '"abc"'}
+                      )
+        cache = HttpCache(self._cache_directory)
+        client = HttpClient(cache=cache)
+
+        client.get(self._sample_url, auth=self._sample_auth)
+        self.assertEqual(cache._load(self._sample_url, _get_identity(self._sample_auth, {})), None)
+        self.assertEqual(cache.get_stats(),
+                         {'hits': 0, 'misses': 0, 'revalidated': 0})
+
+    @responses.activate
+    def test_get__not_modified_restores_link(self):
+        """
+        TestHttpCache: Test a 304 response keeps the cached Link header
+        """
+        link = '<%s?per_page=100&page=3>; rel="last"' % (self._sample_url)
+        responses.add(responses.GET,
+                      self._sample_url,
+                      body="first",
+                      status=200,
+                      adding_headers={"ETag": '"abc"', "Link": link}
+                      )
+        responses.add(responses.GET,
+                      self._sample_url,
+                      status=304
+                      )
+        cache = HttpCache(self._cache_directory)
+        client = HttpClient(cache=cache)
+
+        client.get(self._sample_url, auth=self._sample_auth, use_cache=True)
+        response = client.get(self._sample_url, auth=self._sample_auth, use_cache=True)
+
+        self.assertEqual(response.headers.get('Link'), link)
+        self.assertEqual(response.links['last']['url'],
+                         "%s?per_page=100&page=3" % (self._sample_url))
+
+    @responses.activate
+    def test_get__keyed_by_credentials(self):
+        """
+        TestHttpCache: Test entries are only served to the credentials that fetched them
+        """
+        responses.add(responses.GET,
+                      self._sample_url,
+                      body="private",
+                      status=200,
+                      adding_headers={"ETag": '"abc"'}
+                      )
+        cache = HttpCache(self._cache_directory)
+        client = HttpClient(cache=cache)
+
+        client.get(self._sample_url, auth=self._sample_auth, use_cache=True)
+        client.get(self._sample_url, auth=('token-2', 'x-oauth-basic'), use_cache=True)
+        client.get(self._sample_url, use_cache=True)
+
+        self.assertEqual(responses.calls[1].request.headers.get('If-None-Match'), None)
+        self.assertEqual(responses.calls[2].request.headers.get('If-None-Match'), None)
+        self.assertEqual(cache.get_stats(),
+                         {'hits': 0, 'misses': 3, 'revalidated': 0})
+
+    def test_get_identity(self):
+        """
+        TestHttpCache: Test credentials are identified by a hash, never the token
+        """
+        identity = _get_identity(self._sample_auth, {})
+        self.assertNotEqual(identity, None)
+        self.assertFalse('token-1' in identity)
+        self.assertNotEqual(identity, _get_identity(('token-2', 'x-oauth-basic'), {}))
+        self.assertEqual(_get_identity((None, 'x-oauth-basic'), {}), None)
+        self.assertEqual(_get_identity(None, {}), None)
+        self.assertNotEqual(_get_identity(None, {'Authorization': 'bearer token-1'}), None)
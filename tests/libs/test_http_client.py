@@ -0,0 +1,65 @@
+import unittest
+import os
+import json
+import responses
+from mock import MagicMock
+
+import shaker.libs.github
+import shaker.libs.http_client
+from shaker.libs.http_client import HttpClient
+
+
+class TestHttpClient(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        os.environ['GITHUB_TOKEN'] = 'false'
+        shaker.libs.http_client.set_client(None)
+
+    def tearDown(self):
+        shaker.libs.http_client.set_client(None)
+        unittest.TestCase.tearDown(self)
+
+    @responses.activate
+    def test_get(self):
+        """
+        TestHttpClient: Test requests are made and counted
+        """
+        responses.add(responses.GET,
+                      "https://api.github.com",
+                      content_type="application/json",
+                      body=json.dumps({"mock": "True"}),
+                      status=200
+                      )
+        client = HttpClient()
+        response = client.get("https://api.github.com")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.request_count, 1)
+        pool_stats = client.get_pool_stats()
+        self.assertEqual(pool_stats['requests'], 1)
+
+    def test_get_client__shared(self):
+        """
+        TestHttpClient: Test the same client is shared between calls
+        """
+        first_client = shaker.libs.http_client.get_client()
+        second_client = shaker.libs.http_client.get_client()
+        self.assertTrue(first_client is second_client,
+                        "Expected the client to be shared")
+
+    def test_set_client__injected(self):
+        """
+        TestHttpClient: Test an injected client is used for github calls
+        """
+        mock_response = MagicMock()
+        mock_client = MagicMock()
+        mock_client.get.return_value = mock_response
+        shaker.libs.http_client.set_client(mock_client)
+
+        shaker.libs.github.get_branch_data('test_organisation',
+                                           'test-formula',
+                                           'master')
+        mock_client.get.assert_called_once_with("https://api.github.com/repos/"
+                                                "test_organisation/test-formula/branches/master",
+                                                auth=('false', 'x-oauth-basic'),
+                                                use_cache=True)
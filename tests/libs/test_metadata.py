@@ -33,17 +33,51 @@ class TestMetadata(TestCase):
         TestMetadata: Test == constraints are resolved correctly
         """
 
-        # Under a simple resolve, the current constraint should win
-        new_constraint = '==v0.1'
-        current_constraint = '==v1.1'
+        # An equality within a range pins the version
+        new_constraint = '==v1.1'
+        current_constraint = '>=v0.1'
         constraint = metadata.resolve_constraints(new_constraint,
                                                   current_constraint)
         self.assertEqual(constraint,
-                         current_constraint,
-                         "Under a simple resolve, the current constraint should win. "
+                         new_constraint,
+                         "An equality within a range should pin the version. "
                          "Actual '%s', Expected %s"
                          % (constraint,
-                            current_constraint))
+                            new_constraint))
+
+    def test_resolve_constraints_both_orders(self):
+        """
+        TestMetadata: Test constraints resolve the same whichever is current
+        """
+        pairs = [
+            ('==v1.1', '>=v0.1'),
+            ('>=v1.0', '<=v2.0'),
+            ('>=v1.0', '>=v1.2'),
+        ]
+        for first, second in pairs:
+            constraint = metadata.resolve_constraints(first, second)
+            reversed_constraint = metadata.resolve_constraints(second, first)
+            self.assertEqual(constraint,
+                             reversed_constraint,
+                             "Resolving '%s' with '%s' should not depend on order. "
+                             "Actual '%s', Expected %s"
+                             % (first,
+                                second,
+                                reversed_constraint,
+                                constraint))
+
+        # A conflict fails whichever side arrives first
+        for first, second in [('>=v2.0', '==v1.0'), ('==v0.1', '==v1.1')]:
+            for new_constraint, current_constraint in [(first, second), (second, first)]:
+                with self.assertRaises(ConstraintResolutionException):
+                    metadata.resolve_constraints(new_constraint, current_constraint)
+
+    @raises(ConstraintResolutionException)
+    def test_resolve_constraints_equality_conflict(self):
+        """
+        TestMetadata: Test a new == constraint outside the current bounds raises an exception
+        """
+        metadata.resolve_constraints('==v0.1', '>=v1.1')
 
     def test_resolve_constraints_greater_than(self):
         """
@@ -77,21 +111,28 @@ class TestMetadata(TestCase):
                          % (constraint,
                             current_constraint))
 
-    @raises(ConstraintResolutionException)
     def test_resolve_constraints_unequal(self):
             """
             TestMetadata: Test unequal constraints are resolved correctly
             """
-            # Expect an exception on unequal constraints
+            # Opposite bounds combine into a compound constraint
             new_constraint = '<=v1.2'
             current_constraint = '>=v1.1'
             constraint = metadata.resolve_constraints(new_constraint,
                                                       current_constraint)
             self.assertEqual(constraint,
-                             current_constraint,
-                             "Expect an exception on unequal constraints"
+                             '>=v1.1,<=v1.2',
+                             "Expect the bounds to combine. "
+                             "Actual '%s', Expected %s"
                              % (constraint,
-                                current_constraint))
+                                '>=v1.1,<=v1.2'))
+
+    @raises(ConstraintResolutionException)
+    def test_resolve_constraints_unequal_conflict(self):
+            """
+            TestMetadata: Test opposite constraints with no version between raise an exception
+            """
+            metadata.resolve_constraints('<=v1.1', '>=v1.2')
 
     def test_resolve_metadata_duplicates(self):
         """
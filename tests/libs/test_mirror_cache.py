@@ -0,0 +1,97 @@
+import unittest
+import os
+import shutil
+import tempfile
+from mock import MagicMock
+from mock import patch
+
+import shaker.libs.mirror_cache
+from shaker.libs.mirror_cache import MirrorCache
+
+
+class TestMirrorCache(unittest.TestCase):
+
+    _sample_url = 'git@github.com:test_organisation/test-formula.git'
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self._cache_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shaker.libs.mirror_cache.set_mirror_cache(None)
+        shutil.rmtree(self._cache_directory)
+        unittest.TestCase.tearDown(self)
+
+    def test_get_mirror_path(self):
+        """
+        TestMirrorCache: Test mirrors are kept by organisation and name
+        """
+        cache = MirrorCache(self._cache_directory)
+        self.assertEqual(cache.get_mirror_path(self._sample_url),
+                         os.path.join(self._cache_directory,
+                                      'test_organisation',
+                                      'test-formula.git'))
+
+    @patch('shaker.libs.github.fetch_refs')
+    @patch('shaker.libs.github.has_fixed_ref')
+    @patch('pygit2.Repository')
+    @patch('pygit2.init_repository')
+    def test_update__hit_and_miss(self,
+                                  mock_init_repository,
+                                  mock_repository,
+                                  mock_has_fixed_ref,
+                                  mock_fetch_refs):
+        """
+        TestMirrorCache: Test the mirror is only fetched into when it is missing the ref
+        """
+        remote = MagicMock()
+        remote.name = 'origin'
+        mirror = MagicMock()
+        mirror.remotes = [remote]
+
+        def init_repository(path, bare=False):
+            os.makedirs(path)
+            return mirror
+
+        mock_init_repository.side_effect = init_repository
+        mock_repository.return_value = mirror
+        mock_fetch_refs.return_value = 2048
+        cache = MirrorCache(self._cache_directory)
+
+        mock_has_fixed_ref.return_value = False
+        cache.update(self._sample_url, 'v1.0.1')
+        mock_has_fixed_ref.return_value = True
+        cache.update(self._sample_url, 'v1.0.1')
+
+        mock_init_repository.assert_called_once_with(cache.get_mirror_path(self._sample_url),
+                                                     bare=True)
+        self.assertEqual(mock_fetch_refs.call_count, 1)
+        self.assertEqual(mock_fetch_refs.call_args[0][2],
+                         shaker.libs.mirror_cache.MIRROR_REFSPECS)
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1, 'bytes': 2048})
+
+    @patch('pygit2.Repository')
+    def test_link_repository(self,
+                             mock_repository):
+        """
+        TestMirrorCache: Test a project repository uses the mirror's objects and refs
+        """
+        mirror_path = os.path.join(self._cache_directory, 'test_organisation', 'test-formula.git')
+        repo_path = os.path.join(self._cache_directory, 'project', '.git')
+        repo = MagicMock()
+        repo.path = repo_path
+        mirror = MagicMock()
+        mirror.listall_references.return_value = ['refs/heads/master',
+                                                  'refs/tags/v1.0.1']
+        mirror.lookup_reference.return_value.resolve.return_value.target = 'fake_oid'
+        # The repository is reopened after linking, then the mirror opened
+        mock_repository.side_effect = [repo, mirror]
+
+        cache = MirrorCache(self._cache_directory)
+        cache._link_repository(repo, mirror_path)
+
+        with open(os.path.join(repo_path, 'objects', 'info', 'alternates')) as alternates_file:
+            self.assertEqual(alternates_file.read(),
+                             "%s\n" % (os.path.join(mirror_path, 'objects')))
+        repo.create_reference.assert_any_call('refs/remotes/origin/master', 'fake_oid', force=True)
+        repo.create_reference.assert_any_call('refs/tags/v1.0.1', 'fake_oid', force=True)
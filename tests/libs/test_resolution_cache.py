@@ -0,0 +1,86 @@
+from unittest import TestCase
+from mock import patch
+
+from shaker.libs.resolution_cache import ResolutionCache
+from shaker.shaker_remote import ShakerRemote
+
+
+class TestResolutionCache(TestCase):
+
+    _sample_tag_object = {
+        "name": "v1.0.1",
+        "commit": {
+            "sha": "6826533980361f54b9de17d181830fa4ec94138c",
+        }
+    }
+
+    @patch('shaker.libs.github.resolve_constraint_to_object')
+    def test_resolve__memoised(self,
+                               mock_resolve_constraint_to_object):
+        """
+        TestResolutionCache: Test repeat resolutions do not call github
+        """
+        mock_resolve_constraint_to_object.return_value = self._sample_tag_object
+        cache = ResolutionCache()
+        first_object = cache.resolve('test_organisation', 'test1-formula', '==v1.0.1')
+        second_object = cache.resolve('test_organisation', 'test1-formula', '==v1.0.1')
+
+        self.assertEqual(first_object, self._sample_tag_object)
+        self.assertEqual(second_object, self._sample_tag_object)
+        mock_resolve_constraint_to_object.assert_called_once_with('test_organisation',
+                                                                  'test1-formula',
+                                                                  '==v1.0.1')
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1})
+
+    @patch('shaker.libs.github.resolve_constraint_to_object')
+    def test_resolve__distinct_constraints(self,
+                                           mock_resolve_constraint_to_object):
+        """
+        TestResolutionCache: Test different constraints are resolved separately
+        """
+        mock_resolve_constraint_to_object.return_value = self._sample_tag_object
+        cache = ResolutionCache()
+        cache.resolve('test_organisation', 'test1-formula', '==v1.0.1')
+        cache.resolve('test_organisation', 'test1-formula', '>=v1.0.0')
+        self.assertEqual(mock_resolve_constraint_to_object.call_count, 2)
+
+    @patch('shaker.libs.github.resolve_minimal_constraint_to_object')
+    @patch('shaker.libs.github.resolve_constraint_to_object')
+    def test_resolve__minimal(self,
+                              mock_resolve_constraint_to_object,
+                              mock_resolve_minimal_constraint_to_object):
+        """
+        TestResolutionCache: Test minimal version selection resolves without listing tags
+        """
+        mock_resolve_minimal_constraint_to_object.return_value = self._sample_tag_object
+        cache = ResolutionCache(minimal=True)
+        self.assertEqual(cache.resolve('test_organisation', 'test1-formula', '>=v1.0.1'),
+                         self._sample_tag_object)
+        mock_resolve_minimal_constraint_to_object.assert_called_once_with('test_organisation',
+                                                                          'test1-formula',
+                                                                          '>=v1.0.1')
+        self.assertEqual(mock_resolve_constraint_to_object.call_count, 0)
+
+    @patch('shaker.libs.github.resolve_constraint_to_object')
+    def test_resolve__shared_with_remote(self,
+                                         mock_resolve_constraint_to_object):
+        """
+        TestResolutionCache: Test a cache shared with ShakerRemote is reused
+        """
+        mock_resolve_constraint_to_object.return_value = self._sample_tag_object
+        dependencies = {
+            'test_organisation/test1-formula': {
+                'source': 'git@github.com:test_organisation/test1-formula.git',
+                'constraint': '==v1.0.1',
+                'organisation': 'test_organisation',
+                'name': 'test1-formula'
+            },
+        }
+        cache = ResolutionCache()
+        cache.resolve('test_organisation', 'test1-formula', '==v1.0.1')
+        testobj = ShakerRemote(dependencies, resolution_cache=cache)
+        testobj.update_dependencies()
+
+        self.assertEqual(dependencies['test_organisation/test1-formula']['sha'],
+                         "6826533980361f54b9de17d181830fa4ec94138c")
+        self.assertEqual(mock_resolve_constraint_to_object.call_count, 1)
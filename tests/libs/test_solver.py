@@ -0,0 +1,114 @@
+import unittest
+from nose.tools import raises
+
+from shaker.libs.errors import ConstraintResolutionException
+from shaker.libs.metadata import parse_metadata_requirements
+from shaker.libs.solver import satisfies
+from shaker.libs.solver import Solver
+from shaker.libs.version_index import VersionIndex
+
+
+class TestSolver(unittest.TestCase):
+
+    # The tags of each formula, and their dependencies at each tag
+    _sample_repositories = {
+        'test_organisation/test1-formula': {
+            'v1.0.0': ["test_organisation/test3-formula>=v1.0.0"],
+            'v2.0.0': ["test_organisation/test3-formula>=v2.0.0"],
+        },
+        'test_organisation/test2-formula': {
+            'v1.0.0': ["test_organisation/test3-formula<=v1.5.0"],
+        },
+        'test_organisation/test3-formula': {
+            'v1.0.0': [],
+            'v1.5.0': ["test_organisation/root-formula>=v1.0.0"],
+            'v2.0.0': [],
+        },
+    }
+
+    def _get_index(self, dependency_key, dependency_info):
+        return VersionIndex([{'name': tag} for tag in self._sample_repositories[dependency_key]])
+
+    def _get_dependencies(self, dependency_key, dependency_info, tag):
+        return parse_metadata_requirements(self._sample_repositories[dependency_key][tag])
+
+    def test_satisfies(self):
+        """
+        TestSolver: Test tags are compared to constraints numerically
+        """
+        self.assertTrue(satisfies('>=v1.9.0', 'v1.10.0'))
+        self.assertFalse(satisfies('<=v1.9.0', 'v1.10.0'))
+        self.assertTrue(satisfies('==v1.10.0', 'v1.10.0'))
+        self.assertTrue(satisfies('', 'v1.0.0'))
+        self.assertTrue(satisfies('>=v1.0.0', 'master'))
+        self.assertFalse(satisfies('==master', 'v1.0.0'))
+
+    def test_solve__backtracks(self):
+        """
+        TestSolver: Test a conflicting version is backtracked out of, with only versions reached fetched
+        """
+        solver = Solver(self._get_index,
+                        self._get_dependencies,
+                        root_key='test_organisation/root-formula')
+        base_dependencies = parse_metadata_requirements([
+            "test_organisation/test1-formula",
+            "test_organisation/test2-formula>=v1.0.0",
+        ])
+        expected_dependencies = {
+            'test_organisation/test1-formula': {
+                'source': 'git@github.com:test_organisation/test1-formula.git',
+                'constraint': '==v1.0.0',
+                'sourced_constraints': [],
+                'organisation': 'test_organisation',
+                'name': 'test1-formula'
+            },
+            'test_organisation/test2-formula': {
+                'source': 'git@github.com:test_organisation/test2-formula.git',
+                'constraint': '==v1.0.0',
+                'sourced_constraints': ['>=v1.0.0'],
+                'organisation': 'test_organisation',
+                'name': 'test2-formula'
+            },
+            'test_organisation/test3-formula': {
+                'source': 'git@github.com:test_organisation/test3-formula.git',
+                'constraint': '==v1.5.0',
+                'sourced_constraints': ['>=v1.0.0', '<=v1.5.0'],
+                'organisation': 'test_organisation',
+                'name': 'test3-formula'
+            },
+        }
+        self.assertEqual(solver.solve(base_dependencies), expected_dependencies)
+        # test1-formula v2.0.0 needs a test3-formula that test2-formula rules out
+        self.assertEqual(solver.get_stats(), {'backtracks': 2, 'fetches': 4, 'repositories': 3})
+
+    def test_solve__minimal(self):
+        """
+        TestSolver: Test versions are tried lowest first with minimal version selection
+        """
+        solver = Solver(self._get_index,
+                        self._get_dependencies,
+                        root_key='test_organisation/root-formula',
+                        minimal=True)
+        base_dependencies = parse_metadata_requirements([
+            "test_organisation/test1-formula",
+            "test_organisation/test2-formula>=v1.0.0",
+        ])
+        dependencies = solver.solve(base_dependencies)
+        self.assertEqual(dict((key, dependency['constraint'])
+                              for key, dependency in dependencies.items()),
+                         {'test_organisation/test1-formula': '==v1.0.0',
+                          'test_organisation/test2-formula': '==v1.0.0',
+                          'test_organisation/test3-formula': '==v1.0.0'})
+        self.assertEqual(solver.get_stats()['backtracks'], 0)
+
+    @raises(ConstraintResolutionException)
+    def test_solve__unsatisfiable(self):
+        """
+        TestSolver: Test an exception is raised when no versions satisfy the constraints
+        """
+        solver = Solver(self._get_index, self._get_dependencies)
+        base_dependencies = parse_metadata_requirements([
+            "test_organisation/test1-formula>=v2.0.0",
+            "test_organisation/test2-formula",
+        ])
+        solver.solve(base_dependencies)
@@ -0,0 +1,84 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import responses
+from mock import patch
+
+import shaker.libs.github
+import shaker.libs.tag_cache
+from shaker.libs.tag_cache import TagCache
+
+
+class TestTagCache(unittest.TestCase):
+
+    _sample_tags_data = [
+        {
+            "name": "v1.0.1",
+            "commit": {
+                "sha": "6826533980361f54b9de17d181830fa4ec94138c",
+            }
+        },
+        {
+            "name": "v2.0.1",
+            "commit": {
+                "sha": "1d7d509b534b08b08b1f85253990b6c3f0dec007",
+            }
+        },
+    ]
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        os.environ['GITHUB_TOKEN'] = 'false'
+        self._cache_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shaker.libs.tag_cache.set_tag_cache(None)
+        shutil.rmtree(self._cache_directory)
+        unittest.TestCase.tearDown(self)
+
+    def test_load__fresh(self):
+        """
+        TestTagCache: Test a fresh entry is loaded
+        """
+        cache = TagCache(self._cache_directory)
+        cache.store('test_organisation', 'test-formula', 'v2.0.1', self._sample_tags_data)
+        wanted_tag, tags_data = cache.load('test_organisation', 'test-formula')
+        self.assertEqual(wanted_tag, 'v2.0.1')
+        self.assertEqual(tags_data, self._sample_tags_data)
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 0})
+
+    def test_load__expired(self):
+        """
+        TestTagCache: Test an entry older than the ttl is not used
+        """
+        cache = TagCache(self._cache_directory, ttl=60)
+        cache.store('test_organisation', 'test-formula', 'v2.0.1', self._sample_tags_data)
+        with patch('time.time', return_value=time.time() + 120):
+            self.assertEqual(cache.load('test_organisation', 'test-formula'), None)
+        self.assertEqual(cache.get_stats(), {'hits': 0, 'misses': 1})
+
+    def test_load__refresh(self):
+        """
+        TestTagCache: Test entries are ignored when refreshing
+        """
+        cache = TagCache(self._cache_directory, refresh=True)
+        cache.store('test_organisation', 'test-formula', 'v2.0.1', self._sample_tags_data)
+        self.assertEqual(cache.load('test_organisation', 'test-formula'), None)
+
+    @responses.activate
+    def test_get_valid_tags__cached(self):
+        """
+        TestTagCache: Test get_valid_tags resolves from a fresh entry without github
+        """
+        cache = TagCache(self._cache_directory)
+        cache.store('test_organisation', 'test-formula', 'v2.0.1', self._sample_tags_data)
+        shaker.libs.tag_cache.set_tag_cache(cache)
+
+        wanted_tag, tag_versions, tags_data = shaker.libs.github.get_valid_tags('test_organisation',
+                                                                                'test-formula')
+        self.assertEqual(wanted_tag, 'v2.0.1')
+        self.assertEqual(tag_versions, ['1.0.1', '2.0.1'])
+        self.assertEqual(tags_data, self._sample_tags_data)
+        self.assertEqual(len(responses.calls), 0)
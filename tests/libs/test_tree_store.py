@@ -0,0 +1,96 @@
+import unittest
+import os
+import shutil
+import tempfile
+from mock import MagicMock
+from mock import patch
+
+import shaker.libs.github
+import shaker.libs.tree_store
+from shaker.libs.tree_store import TreeStore
+
+
+class FakeEntry(object):
+
+    def __init__(self, name, filemode, hex):
+        self.name = name
+        self.filemode = filemode
+        self.hex = hex
+
+
+class FakeTree(list):
+
+    hex = None
+
+
+class TestTreeStore(unittest.TestCase):
+
+    _sample_sha = '1d7d509b534b08b08b1f85253990b6c3f0dec007'
+    _sample_tree_sha = '6826533980361f54b9de17d181830fa4ec94138c'
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self._directory = tempfile.mkdtemp()
+        self._install_directory = os.path.join(self._directory, 'formula-repos')
+        os.makedirs(self._install_directory)
+
+        # A formula with a state file and a metadata.yml
+        sub_tree = FakeTree([FakeEntry('init.sls', 0100644, 'blob-init')])
+        tree = FakeTree([FakeEntry('metadata.yml', 0100644, 'blob-metadata'),
+                         FakeEntry('test', shaker.libs.tree_store.FILEMODE_TREE, 'tree-test')])
+        tree.hex = self._sample_tree_sha
+        commit = MagicMock()
+        commit.tree = tree
+        objects = {
+            self._sample_sha: commit,
+            'tree-test': sub_tree,
+            'blob-init': MagicMock(data='test: {}\n'),
+            'blob-metadata': MagicMock(data='exports:\n- test\n'),
+        }
+        self._mirror = MagicMock()
+        self._mirror.__getitem__.side_effect = lambda key: objects[key]
+        self._mirror_cache = MagicMock()
+        self._mirror_cache.update.return_value = 'mirror.git'
+
+    def tearDown(self):
+        shaker.libs.tree_store.set_tree_store(None)
+        for root, directory_names, file_names in os.walk(self._directory):
+            for file_name in file_names:
+                os.chmod(os.path.join(root, file_name), 0644)
+        shutil.rmtree(self._directory)
+        unittest.TestCase.tearDown(self)
+
+    @patch('pygit2.Repository')
+    def test_install__stores_once_and_links(self,
+                                            mock_repository):
+        """
+        TestTreeStore: Test a version is stored once and hardlinked into each install
+        """
+        mock_repository.return_value = self._mirror
+        store = TreeStore(os.path.join(self._directory, 'store'),
+                          mirror_cache=self._mirror_cache)
+        target_source = {
+            'name': 'test-formula',
+            'source': 'git@github.com:test_organisation/test-formula.git',
+            'sha': self._sample_sha,
+        }
+        other_install_directory = os.path.join(self._directory, 'other-formula-repos')
+        os.makedirs(other_install_directory)
+
+        self.assertTrue(store.install(target_source, self._install_directory))
+        self.assertTrue(store.install(target_source, other_install_directory))
+        # Already installed, so there's nothing to do
+        self.assertTrue(store.install(target_source, other_install_directory))
+
+        first_path = os.path.join(self._install_directory, 'test-formula', 'test', 'init.sls')
+        second_path = os.path.join(other_install_directory, 'test-formula', 'test', 'init.sls')
+        with open(second_path) as sls_file:
+            self.assertEqual(sls_file.read(), 'test: {}\n')
+        self.assertEqual(os.stat(first_path).st_ino, os.stat(second_path).st_ino)
+        with open(os.path.join(other_install_directory,
+                               'test-formula',
+                               shaker.libs.github.INSTALL_MARKER)) as marker_file:
+            self.assertEqual(marker_file.read(), '%s\n' % (self._sample_sha))
+        # The second install found the tree through the commit index
+        self.assertEqual(self._mirror_cache.update.call_count, 1)
+        self.assertEqual(store.get_stats(), {'hits': 1, 'misses': 1, 'linked': 4, 'copied': 0})
@@ -0,0 +1,65 @@
+import unittest
+
+from shaker.libs.version_index import get_version_key
+from shaker.libs.version_index import VersionIndex
+
+
+class TestVersionIndex(unittest.TestCase):
+
+    _sample_tags_data = [
+        {"name": "v1.9.0"},
+        {"name": "v1.10.0-rc1"},
+        {"name": "v1.10.0"},
+        {"name": "v1.2.0"},
+        {"name": "v2.0.0-rc1"},
+        {"name": "master-snapshot"},
+    ]
+
+    def test_get_version_key(self):
+        """
+        TestVersionIndex: Test versions sort numerically, pre-releases before their release
+        """
+        versions = ['1.10.0', '1.9.0', '1.10.0-rc1', '1.10.0rc2', '1.2']
+        self.assertEqual(sorted(versions, key=get_version_key),
+                         ['1.2', '1.9.0', '1.10.0-rc1', '1.10.0rc2', '1.10.0'])
+        self.assertEqual(get_version_key('master'), None)
+
+    def test_find(self):
+        """
+        TestVersionIndex: Test constraints resolve to releases with numeric comparisons
+        """
+        index = VersionIndex(self._sample_tags_data)
+        self.assertEqual(index.versions, ['1.2.0', '1.9.0', '1.10.0-rc1', '1.10.0', '2.0.0-rc1'])
+        self.assertEqual(index.find_latest(), 'v1.10.0')
+        self.assertEqual(index.find_at_least('1.9.1'), 'v1.10.0')
+        self.assertEqual(index.find_at_least('2.0.0'), None)
+        self.assertEqual(index.find_at_most('1.10.0'), 'v1.10.0')
+        self.assertEqual(index.find_at_most('1.9.9'), 'v1.9.0')
+        self.assertEqual(index.find_at_most('1.1'), None)
+        self.assertEqual(index.find_between('1.9', '1.10.0'), ['v1.10.0', 'v1.9.0'])
+        self.assertEqual(index.find_between(highest='1.9.9'), ['v1.9.0', 'v1.2.0'])
+        self.assertEqual(index.find_between('1.10.1'), [])
+        self.assertEqual(index.find_latest_between('1.2', '1.9.9'), 'v1.9.0')
+        self.assertEqual(index.find_latest_between('1.9.1', '1.9.9'), None)
+        self.assertEqual(index.find_earliest_between('1.3', '1.10.0'), 'v1.9.0')
+        self.assertEqual(index.find_earliest_between('1.10.1'), None)
+        self.assertTrue(index.has_version('2.0.0-rc1'))
+        self.assertEqual(index.get('v1.9.0'), {"name": "v1.9.0"})
+        self.assertRaises(ValueError, index.find_at_most, 'latest')
+
+    def test_find__non_semver_tags(self):
+        """
+        TestVersionIndex: Test 'v' tags short of a patch number are not indexed
+        """
+        index = VersionIndex([{"name": "v1.0.0"},
+                              {"name": "v1.1.0"},
+                              {"name": "v2"},
+                              {"name": "v3.0"},
+                              {"name": "v1.0"}])
+        self.assertEqual(index.versions, ['1.0.0', '1.1.0'])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.find_latest(), 'v1.1.0')
+        self.assertEqual(index.find_at_least('1.0.0'), 'v1.1.0')
+        self.assertEqual(index.find_at_most('1.0.0'), 'v1.0.0')
+        self.assertFalse(index.has_version('2'))
+        self.assertFalse(index.has_version('1.0'))
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import patch
+
+import shaker.libs.http_client
+import shaker.libs.mirror_cache
+import shaker.libs.tag_cache
+import shaker.libs.tree_store
+from shaker import salt_shaker
+from shaker.salt_shaker import Shaker
+
+
+class TestSaltShaker(TestCase):
+
+    _sample_metadata = ("formula: test_organisation/root-formula\n"
+                        "dependencies:\n"
+                        "- test_organisation/test1-formula==v1.0.1\n")
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self._directory = tempfile.mkdtemp()
+        self._cache_home = os.environ.get('XDG_CACHE_HOME', None)
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self._directory, 'cache')
+        self._root_dir = os.path.join(self._directory, 'root')
+        os.makedirs(self._root_dir)
+        with open(os.path.join(self._root_dir, 'metadata.yml'), 'w') as metadata_file:
+            metadata_file.write(self._sample_metadata)
+
+    def tearDown(self):
+        shaker.libs.http_client.set_client(None)
+        shaker.libs.tag_cache.set_tag_cache(None)
+        shaker.libs.mirror_cache.set_mirror_cache(None)
+        shaker.libs.tree_store.set_tree_store(None)
+        if self._cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self._cache_home
+        shutil.rmtree(self._directory)
+        TestCase.tearDown(self)
+
+    @patch.object(Shaker, 'update_requirements', autospec=True)
+    @patch('shaker.libs.pygit2_utils.pygit2_check')
+    def test_shaker__passes_options(self,
+                                    mock_pygit2_check,
+                                    mock_update_requirements):
+        """
+        TestSaltShaker: Test the run options reach the Shaker it builds
+        """
+        salt_shaker.shaker(root_dir=self._root_dir,
+                           fetch_jobs=2,
+                           jobs=3,
+                           clone_mode='shallow')
+        shaker_instance = mock_update_requirements.call_args[0][0]
+        self.assertEqual(shaker_instance._jobs, 3)
+        self.assertEqual(shaker_instance._clone_mode, 'shallow')
+        self.assertEqual(shaker_instance._shaker_metadata.fetch_jobs, 2)
+
+    @patch.object(Shaker, 'update_requirements', autospec=True)
+    @patch('shaker.libs.pygit2_utils.pygit2_check')
+    def test_shaker__tag_cache_opt_in(self,
+                                      mock_pygit2_check,
+                                      mock_update_requirements):
+        """
+        TestSaltShaker: Test the tag cache is only used when given a ttl
+        """
+        salt_shaker.shaker(root_dir=self._root_dir)
+        self.assertEqual(shaker.libs.tag_cache.get_tag_cache(), None)
+
+        salt_shaker.shaker(root_dir=self._root_dir,
+                           tag_cache_ttl=600)
+        run_tag_cache = shaker.libs.tag_cache.get_tag_cache()
+        self.assertEqual(run_tag_cache.ttl, 600)
+        self.assertFalse(run_tag_cache.refresh)
+
+    @patch.object(Shaker, 'check_requirements', autospec=True)
+    @patch('shaker.libs.pygit2_utils.pygit2_check')
+    def test_shaker__tag_cache_refreshed_for_check(self,
+                                                   mock_pygit2_check,
+                                                   mock_check_requirements):
+        """
+        TestSaltShaker: Test checks never serve tag lists from the cache
+        """
+        salt_shaker.shaker(root_dir=self._root_dir,
+                           check_requirements=True,
+                           tag_cache_ttl=600)
+        self.assertTrue(shaker.libs.tag_cache.get_tag_cache().refresh)
+
+    @patch.object(Shaker, 'update_requirements', autospec=True)
+    @patch('shaker.libs.pygit2_utils.pygit2_check')
+    def test_shaker__mirror_cache_reset(self,
+                                        mock_pygit2_check,
+                                        mock_update_requirements):
+        """
+        TestSaltShaker: Test a run without mirroring drops an earlier run's mirror cache
+        """
+        salt_shaker.shaker(root_dir=self._root_dir,
+                           mirror=True)
+        self.assertNotEqual(shaker.libs.mirror_cache.get_mirror_cache(), None)
+
+        salt_shaker.shaker(root_dir=self._root_dir)
+        self.assertEqual(shaker.libs.mirror_cache.get_mirror_cache(), None)
+
+    @patch.object(Shaker, 'update_requirements', autospec=True)
+    @patch('shaker.libs.pygit2_utils.pygit2_check')
+    def test_shaker__tree_store_reset(self,
+                                      mock_pygit2_check,
+                                      mock_update_requirements):
+        """
+        TestSaltShaker: Test a run outside store mode drops an earlier run's tree store
+        """
+        salt_shaker.shaker(root_dir=self._root_dir,
+                           install_mode='store')
+        self.assertNotEqual(shaker.libs.tree_store.get_tree_store(), None)
+
+        salt_shaker.shaker(root_dir=self._root_dir)
+        self.assertEqual(shaker.libs.tree_store.get_tree_store(), None)
@@ -8,7 +8,10 @@ import json
 
 import logging
 import shaker.libs.logger
+import shaker.libs.metadata
 from shaker.shaker_metadata import ShakerMetadata
+from shaker.libs.resolution_cache import ResolutionCache
+from shaker.libs.errors import ConstraintResolutionException
 from shaker.libs.errors import GithubRepositoryConnectionException
 
 
@@ -47,7 +50,7 @@ class TestShakerMetadata(TestCase):
     _sample_metadata_test2 = {
         "name": "test_organisation/test2-formula",
         "dependencies": [
-            "git@github.com:test_organisation/test3-formula.git==v3.0.2",
+            "git@github.com:test_organisation/test3-formula.git>=v3.0.1",
         ]
     }
     _sample_metadata_test3 = {
@@ -543,6 +546,215 @@ class TestShakerMetadata(TestCase):
 
         testfixtures.compare(tempobj.dependencies, expected_dependencies)
 
+    @patch('shaker.shaker_metadata.ShakerMetadata._fetch_remote_metadata')
+    @patch('shaker.shaker_metadata.ShakerMetadata._fetch_remote_requirements')
+    def test_crawl_dependencies__matches_fetch_dependencies(self,
+                                                            mock_fetch_remote_requirements,
+                                                            mock_fetch_remote_metadata):
+        """
+        TestShakerMetadata::test_crawl_dependencies__matches_fetch_dependencies: Concurrent crawl finds the same dependencies
+        """
+        remote_metadata = {
+            'test1-formula': self._sample_metadata_test1,
+            'test2-formula': self._sample_metadata_test2,
+            'test3-formula': self._sample_metadata_test3,
+        }
+
+        def fetch_remote_metadata(org_name, formula_name, constraint=None):
+            return remote_metadata.get(formula_name, None)
+
+        mock_fetch_remote_metadata.side_effect = fetch_remote_metadata
+        mock_fetch_remote_requirements.return_value = None
+
+        results = []
+        for fetch_jobs in [1, 4]:
+            tempobj = ShakerMetadata(autoload=False, fetch_jobs=fetch_jobs)
+            tempobj.root_metadata = {'formula': 'test_organisation/root-formula'}
+            tempobj.dependencies = json.loads(json.dumps(self._sample_metadata_root['dependencies']))
+            tempobj._update_from_base(tempobj.dependencies)
+            results.append(tempobj)
+
+        testfixtures.compare(results[1].dependencies, results[0].dependencies)
+        self.assertEqual(results[0].crawl_timings, [])
+        self.assertEqual([(timing['level'], timing['nodes']) for timing in results[1].crawl_timings],
+                         [(0, 2), (1, 2), (2, 1)])
+
+    @patch('shaker.shaker_metadata.ShakerMetadata._fetch_remote_metadata')
+    @patch('shaker.shaker_metadata.ShakerMetadata._fetch_remote_requirements')
+    def test_crawl_dependencies__conflicting_diamond(self,
+                                                     mock_fetch_remote_requirements,
+                                                     mock_fetch_remote_metadata):
+        """
+        TestShakerMetadata::test_crawl_dependencies__conflicting_diamond: Conflicting pins resolve the same for any fetch_jobs
+        """
+        # root -> a -> d -> c==v1.0.0 is found after root -> b -> c==v2.0.0
+        # breadth first, but before it depth first
+        remote_metadata = {
+            'testa-formula': {'dependencies': ["test_organisation/testd-formula==v4.0.0"]},
+            'testb-formula': {'dependencies': ["test_organisation/testc-formula==v2.0.0"]},
+            'testd-formula': {'dependencies': ["test_organisation/testc-formula==v1.0.0"]},
+        }
+
+        def fetch_remote_metadata(org_name, formula_name, constraint=None):
+            return remote_metadata.get(formula_name, None)
+
+        mock_fetch_remote_metadata.side_effect = fetch_remote_metadata
+        mock_fetch_remote_requirements.return_value = None
+
+        root_dependencies = shaker.libs.metadata.parse_metadata_requirements([
+            "test_organisation/testa-formula==v1.0.0",
+            "test_organisation/testb-formula==v2.0.0",
+        ])
+        pinned_root_dependencies = shaker.libs.metadata.parse_metadata_requirements([
+            "test_organisation/testa-formula==v1.0.0",
+            "test_organisation/testb-formula==v2.0.0",
+            "test_organisation/testc-formula==v2.0.0",
+        ])
+
+        for fetch_jobs in [1, 4]:
+            tempobj = ShakerMetadata(autoload=False, fetch_jobs=fetch_jobs)
+            tempobj.root_metadata = {
+                'formula': 'test_organisation/root-formula',
+                'dependencies': json.loads(json.dumps(root_dependencies)),
+            }
+            with self.assertRaises(ConstraintResolutionException):
+                tempobj.update_dependencies(ignore_local_requirements=True)
+
+        results = []
+        for fetch_jobs in [1, 4]:
+            tempobj = ShakerMetadata(autoload=False, fetch_jobs=fetch_jobs)
+            tempobj.root_metadata = {
+                'formula': 'test_organisation/root-formula',
+                'dependencies': json.loads(json.dumps(pinned_root_dependencies)),
+            }
+            tempobj.update_dependencies(ignore_local_requirements=True)
+            results.append(tempobj)
+
+        testfixtures.compare(results[1].dependencies, results[0].dependencies)
+        self.assertEqual(results[0].dependencies['test_organisation/testc-formula']['constraint'],
+                         '==v2.0.0')
+
+    @patch('shaker.shaker_metadata.ShakerMetadata._fetch_remote_metadata')
+    @patch('shaker.shaker_metadata.ShakerMetadata._fetch_remote_requirements')
+    def test_update_dependencies__root_pin_wins(self,
+                                                mock_fetch_remote_requirements,
+                                                mock_fetch_remote_metadata):
+        """
+        TestShakerMetadata::test_update_dependencies__root_pin_wins: A root pin overrides conflicting sub-formula pins
+        """
+        root_metadata = json.loads(json.dumps(self._sample_metadata_root))
+        root_metadata['dependencies']['test_organisation/test3-formula'] = {
+            'source': 'git@github.com:test_organisation/test3-formula.git',
+            'constraint': '==v3.0.2',
+            'sourced_constraints': [],
+            'organisation': 'test_organisation',
+            'name': 'test3-formula'
+        }
+        remote_metadata = {
+            'test1-formula': self._sample_metadata_test1,
+            'test2-formula': self._sample_metadata_test2,
+            'test3-formula': self._sample_metadata_test3,
+        }
+
+        def fetch_remote_metadata(org_name, formula_name, constraint=None):
+            return remote_metadata.get(formula_name, None)
+
+        mock_fetch_remote_metadata.side_effect = fetch_remote_metadata
+        mock_fetch_remote_requirements.return_value = None
+
+        for fetch_jobs in [1, 4]:
+            tempobj = ShakerMetadata(autoload=False, fetch_jobs=fetch_jobs)
+            tempobj.root_metadata = json.loads(json.dumps(root_metadata))
+            tempobj.update_dependencies(ignore_local_requirements=True)
+
+            self.assertEqual(tempobj.dependencies['test_organisation/test3-formula']['constraint'],
+                             '==v3.0.2',
+                             "fetch_jobs=%s: Root pin should win over test1's '==v3.0.1'"
+                             % (fetch_jobs))
+            testfixtures.compare(tempobj.root_metadata, root_metadata)
+
+    @patch('shaker.libs.github.get_valid_tags')
+    @patch('shaker.shaker_metadata.ShakerMetadata._fetch_remote_file')
+    def test_update_from_base__solve(self,
+                                     mock_fetch_remote_file,
+                                     mock_get_valid_tags):
+        """
+        TestShakerMetadata::test_update_from_base__solve: Solve mixed range constraints over the available tags
+        """
+        remote_metadata = {
+            ('test1-formula', '==v1.0.1'): {'dependencies': ["test_organisation/test3-formula>=v3.0.1"]},
+            ('test2-formula', '==v2.0.1'): {'dependencies': ["test_organisation/test3-formula<=v3.0.2"]},
+            ('test3-formula', '==v3.0.2'): self._sample_metadata_test3,
+        }
+
+        def fetch_remote_file(org_name, formula_name, remote_file, constraint=None):
+            if remote_file == 'metadata.yml':
+                return remote_metadata.get((formula_name, constraint), None)
+            return None
+
+        mock_fetch_remote_file.side_effect = fetch_remote_file
+        mock_get_valid_tags.return_value = ('v3.1.0',
+                                            ['1.0.1', '2.0.1', '3.0.1', '3.0.2', '3.1.0'],
+                                            [{'name': 'v1.0.1'},
+                                             {'name': 'v2.0.1'},
+                                             {'name': 'v3.0.1'},
+                                             {'name': 'v3.0.2'},
+                                             {'name': 'v3.1.0'}])
+
+        tempobj = ShakerMetadata(autoload=False, solve=True)
+        tempobj.root_metadata = {'formula': 'test_organisation/root-formula'}
+        tempobj._update_from_base(json.loads(json.dumps(self._sample_metadata_root['dependencies'])))
+
+        self.assertEqual(dict((dependency_key, dependency_info['constraint'])
+                              for dependency_key, dependency_info in tempobj.dependencies.items()),
+                         {
+                             'test_organisation/test1-formula': '==v1.0.1',
+                             'test_organisation/test2-formula': '==v2.0.1',
+                             'test_organisation/test3-formula': '==v3.0.2',
+                         })
+        self.assertEqual(tempobj.dependencies['test_organisation/test3-formula']['sourced_constraints'],
+                         ['>=v3.0.1', '<=v3.0.2'])
+        self.assertEqual([(stats['backtracks'], stats['fetches'], stats['repositories'])
+                          for stats in tempobj.solve_stats],
+                         [(0, 3, 3)])
+
+    @patch('shaker.libs.github.get_valid_tags')
+    @patch('shaker.shaker_metadata.ShakerMetadata._fetch_remote_file')
+    def test_update_from_base__solve_minimal(self,
+                                             mock_fetch_remote_file,
+                                             mock_get_valid_tags):
+        """
+        TestShakerMetadata::test_update_from_base__solve_minimal: Solve to the lowest versions with minimal version selection
+        """
+        remote_metadata = {
+            ('test1-formula', '==v1.0.1'): {'dependencies': ["test_organisation/test3-formula>=v3.0.1"]},
+            ('test2-formula', '==v2.0.1'): {'dependencies': ["test_organisation/test3-formula<=v3.0.2"]},
+            ('test3-formula', '==v3.0.1'): self._sample_metadata_test3,
+        }
+
+        def fetch_remote_file(org_name, formula_name, remote_file, constraint=None):
+            if remote_file == 'metadata.yml':
+                return remote_metadata.get((formula_name, constraint), None)
+            return None
+
+        mock_fetch_remote_file.side_effect = fetch_remote_file
+        mock_get_valid_tags.return_value = ('v3.1.0',
+                                            ['1.0.1', '2.0.1', '3.0.1', '3.0.2', '3.1.0'],
+                                            [{'name': 'v1.0.1'},
+                                             {'name': 'v2.0.1'},
+                                             {'name': 'v3.0.1'},
+                                             {'name': 'v3.0.2'},
+                                             {'name': 'v3.1.0'}])
+
+        tempobj = ShakerMetadata(autoload=False,
+                                 resolution_cache=ResolutionCache(minimal=True),
+                                 solve=True)
+        tempobj.root_metadata = {'formula': 'test_organisation/root-formula'}
+        tempobj._update_from_base(json.loads(json.dumps(self._sample_metadata_root['dependencies'])))
+
+        self.assertEqual(tempobj.dependencies['test_organisation/test3-formula']['constraint'],
+                         '==v3.0.1')
+
     @raises(GithubRepositoryConnectionException)
     @patch('shaker.libs.github.validate_github_access')
     @patch('shaker.libs.github.resolve_constraint_to_object')
@@ -1,5 +1,10 @@
 from unittest import TestCase
 from mock import patch
+import copy
+import os
+import pygit2
+import shutil
+import tempfile
 from shaker.shaker_remote import ShakerRemote
 from nose.tools import raises
 
@@ -34,6 +39,8 @@ class TestShakerRemote(TestCase):
                             "git@github.com:test_organisation/test2-formula.git==v2.0.1\n"
                             "git@github.com:test_organisation/test3-formula.git==v3.0.1\n")
 
+    _sample_root_link_stats = {'created': 1, 'updated': 0, 'removed': 0, 'unchanged': 0}
+
     def setUp(self):
         TestCase.setUp(self)
 
@@ -119,6 +126,39 @@ class TestShakerRemote(TestCase):
         self.assertFalse(mock_write.called, ("With overwrite disabled, "
                                              "we shouldn't have called to write"))
 
+    @patch('shaker.shaker_remote.ShakerRemote._get_formula_exports')
+    @patch('shaker.shaker_remote.ShakerRemote._resolve_constraint_to_sha')
+    def test_lockfile__locks_shas(self,
+                                  mock_resolve_constraint_to_sha,
+                                  mock_get_formula_exports):
+        """
+        TestShakerRemote: Test locked shas are loaded for matching tags and not resolved again
+        """
+        mock_get_formula_exports.return_value = ['test']
+        resolved_dependencies = copy.deepcopy(self._sample_dependencies)
+        for key, info in resolved_dependencies.items():
+            info['version'] = info['constraint'][2:]
+            info['sha'] = 'sha-%s' % (info['name'])
+        output_directory = tempfile.mkdtemp()
+        try:
+            self.assertTrue(ShakerRemote(resolved_dependencies).write_lockfile(output_directory))
+
+            pinned_dependencies = copy.deepcopy(self._sample_dependencies)
+            # A pin that has moved on from the lock has to be resolved
+            pinned_dependencies['test_organisation/test3-formula']['constraint'] = '==v3.0.2'
+            testobj = ShakerRemote(pinned_dependencies)
+            self.assertEqual(testobj.load_lockfile(output_directory), 2)
+            testobj.update_dependencies()
+        finally:
+            shutil.rmtree(output_directory)
+
+        self.assertEqual(pinned_dependencies['test_organisation/test1-formula']['sha'],
+                         'sha-test1-formula')
+        self.assertEqual(pinned_dependencies['test_organisation/test2-formula']['version'],
+                         'v2.0.1')
+        self.assertEqual(mock_resolve_constraint_to_sha.call_count, 1)
+        mock_resolve_constraint_to_sha.assert_called_once_with(pinned_dependencies['test_organisation/test3-formula'])
+
     @patch('shaker.libs.github.install_source')
     @patch('shaker.libs.github.get_repository_sha')
     @patch('shaker.shaker_remote.ShakerRemote._create_directories')
@@ -134,13 +174,56 @@ class TestShakerRemote(TestCase):
                                                None]
         mock_install_source.return_value = True
 
-    @patch('shaker.shaker_remote.ShakerRemote._link_dynamic_modules')
-    @patch('os.symlink')
+    @patch('shaker.shaker_remote.ShakerRemote._remove_unused_directories')
+    @patch('shaker.shaker_remote.ShakerRemote._update_root_links')
+    @patch('shaker.libs.github.install_source')
+    @patch('shaker.shaker_remote.ShakerRemote._create_directories')
+    def test_install_dependencies__jobs(self,
+                                        mock_create_directories,
+                                        mock_install_source,
+                                        mock_update_root_links,
+                                        mock_remove_unused_directories):
+        """
+        TestShakerRemote: Test installing dependencies in a pool counts each outcome, not linking on failures
+        """
+        def install_source(target_source, target_directory, use_tag, clone_mode):
+            # Linking must wait for every install to finish
+            self.assertFalse(mock_update_root_links.called)
+            return target_source['name'] != 'test2-formula'
+
+        mock_install_source.side_effect = install_source
+        testobj = ShakerRemote(self._sample_dependencies, jobs=3)
+        result = testobj.install_dependencies(enable_remote_check=True)
+
+        self.assertEqual(result, (2, 1))
+        self.assertEqual(mock_install_source.call_count, 3)
+        self.assertEqual(testobj.install_results,
+                         {'test1-formula': True,
+                          'test2-formula': False,
+                          'test3-formula': True})
+        # The current salt root, and the formulas it links to, are
+        # kept when any install fails
+        self.assertFalse(mock_update_root_links.called)
+        self.assertFalse(mock_remove_unused_directories.called)
+
+        mock_install_source.side_effect = None
+        mock_install_source.return_value = True
+        result = testobj.install_dependencies(enable_remote_check=True)
+        self.assertEqual(result, (3, 0))
+        mock_update_root_links.assert_called_once_with()
+        mock_remove_unused_directories.assert_called_once_with('vendor/formula-repos')
+
+    @patch('shaker.shaker_remote.ShakerRemote._swap_salt_root')
+    @patch('shaker.shaker_remote.ShakerRemote._stage_salt_root')
+    @patch('shaker.shaker_remote.ShakerRemote._reconcile_root_links')
+    @patch('shaker.shaker_remote.ShakerRemote._get_dynamic_module_links')
     @patch('os.path.exists')
     def test__update_root_links__formula_subdir_exists(self,
                                                        mock_path_exists,
-                                                       mock_symlink,
-                                                       mock_link_dynamic_modules):
+                                                       mock_get_dynamic_module_links,
+                                                       mock_reconcile_root_links,
+                                                       mock_stage_salt_root,
+                                                       mock_swap_salt_root):
         """
         Test root links are made when our formula has docker-formula/docker structure
         """
@@ -156,24 +239,29 @@ class TestShakerRemote(TestCase):
         testobj = ShakerRemote(sample_dependencies)
         # Set path exists check values
         # True: formula-repos/docker-formula/docker exists
-        # False: _root/docker exists
         mock_path_exists.side_effect = [
             True,
-            False
         ]
+        mock_reconcile_root_links.return_value = self._sample_root_link_stats
+        mock_stage_salt_root.return_value = "vendor/_root.staged"
         testobj._update_root_links()
         relative_source = "../formula-repos/test1-formula/test1"
-        target = "vendor/_root/test1"
-        mock_symlink.assert_called_once_with(relative_source, target)
-        mock_link_dynamic_modules.assert_called_once_with("test1-formula")
+        mock_swap_salt_root.assert_called_once_with("vendor/_root", "vendor/_root.staged")
+        mock_reconcile_root_links.assert_called_once_with("vendor/_root.staged",
+                                                          {"test1": relative_source})
+        self.assertEqual(mock_get_dynamic_module_links.call_args[0][0], "test1-formula")
 
-    @patch('shaker.shaker_remote.ShakerRemote._link_dynamic_modules')
-    @patch('os.symlink')
+    @patch('shaker.shaker_remote.ShakerRemote._swap_salt_root')
+    @patch('shaker.shaker_remote.ShakerRemote._stage_salt_root')
+    @patch('shaker.shaker_remote.ShakerRemote._reconcile_root_links')
+    @patch('shaker.shaker_remote.ShakerRemote._get_dynamic_module_links')
     @patch('os.path.exists')
     def test__update_root_links__formula_subdir_not_exist(self,
                                                           mock_path_exists,
-                                                          mock_symlink,
-                                                          mock_link_dynamic_modules):
+                                                          mock_get_dynamic_module_links,
+                                                          mock_reconcile_root_links,
+                                                          mock_stage_salt_root,
+                                                          mock_swap_salt_root):
         """
         Test root links are made when our formula has no subdir docker/ structure
         """
@@ -190,47 +278,32 @@ class TestShakerRemote(TestCase):
         # Set path exists check values
         # False: formula-repos/docker-formula/docker exists
         # True: formula-repos/docker/ exists
-        # False: _root/docker exists
         mock_path_exists.side_effect = [
             False,
             True,
-            False
         ]
+        mock_reconcile_root_links.return_value = self._sample_root_link_stats
+        mock_stage_salt_root.return_value = "vendor/_root.staged"
         testobj._update_root_links()
         relative_source = "../formula-repos/test1"
-        target = "vendor/_root/test1"
-        mock_symlink.assert_called_once_with(relative_source, target)
-        mock_link_dynamic_modules.assert_called_once_with("test1")
+        mock_swap_salt_root.assert_called_once_with("vendor/_root", "vendor/_root.staged")
+        mock_reconcile_root_links.assert_called_once_with("vendor/_root.staged",
+                                                          {"test1": relative_source})
+        self.assertEqual(mock_get_dynamic_module_links.call_args[0][0], "test1")
 
     @raises(IOError)
-    @patch('shaker.shaker_remote.ShakerRemote._link_dynamic_modules')
-    @patch('os.symlink')
-    @patch('os.path.exists')
-    def test__update_root_links__formula_link_exists(self,
-                                                     mock_path_exists,
-                                                     mock_symlink,
-                                                     mock_link_dynamic_modules):
+    def test__update_root_links__formula_link_exists(self):
         """
-        Test root links are made when our formula has no subdir docker-formula/ structure
+        Test we have an exception when something other than a link is in the way
         """
-        # Setup
-        sample_dependencies = {
-            'test_organisation/test1-formula': {
-                'source': 'git@github.com:test_organisation/test1-formula.git',
-                'constraint': '==v1.0.1',
-                'organisation': 'test_organisation',
-                'name': 'test1-formula'
-            },
-        }
-        testobj = ShakerRemote(sample_dependencies)
-        # Set path exists check values
-        # True: formula-repos/docker-formula/docker exists
-        # True: _root/docker exists
-        mock_path_exists.side_effect = [
-            True,
-            True
-        ]
-        testobj._update_root_links()
+        working_directory = tempfile.mkdtemp()
+        try:
+            testobj = ShakerRemote({}, working_directory=working_directory)
+            os.makedirs(os.path.join(working_directory, '_root', 'test1'))
+            testobj._reconcile_root_links(os.path.join(working_directory, '_root'),
+                                          {'test1': '../formula-repos/test1-formula/test1'})
+        finally:
+            shutil.rmtree(working_directory)
 
     @raises(IOError)
     @patch('os.path.exists')
@@ -261,3 +334,177 @@ class TestShakerRemote(TestCase):
         target = "vendor/_root/test1"
         mock_symlink.assert_called_with(source, target)
         mock_link_dynamic_modules.assert_called_with()
+
+    def test__create_directories__keeps_clones(self):
+        """
+        TestShakerRemote: Test existing formula clones are kept unless overwriting
+        """
+        working_directory = tempfile.mkdtemp()
+        try:
+            testobj = ShakerRemote(self._sample_dependencies,
+                                   working_directory=working_directory)
+            clone_path = os.path.join(working_directory, 'formula-repos', 'test1-formula')
+            os.makedirs(clone_path)
+
+            testobj._create_directories(overwrite=False)
+            self.assertTrue(os.path.isdir(clone_path))
+            testobj._create_directories(overwrite=True)
+            self.assertFalse(os.path.exists(clone_path))
+            self.assertTrue(os.path.isdir(os.path.join(working_directory, 'formula-repos')))
+        finally:
+            shutil.rmtree(working_directory)
+
+    def test__create_directories__removes_stale_roots(self):
+        """
+        TestShakerRemote: Test staged salt roots left by an interrupted run are removed
+        """
+        working_directory = tempfile.mkdtemp()
+        try:
+            testobj = ShakerRemote(self._sample_dependencies,
+                                   working_directory=working_directory)
+            os.makedirs(os.path.join(working_directory, '_root.current', 'test1'))
+            os.makedirs(os.path.join(working_directory, '_root.stale', 'test1'))
+            os.symlink('_root.current', os.path.join(working_directory, '_root'))
+            os.symlink('_root.stale', os.path.join(working_directory, '_root.tmp-1'))
+
+            testobj._create_directories()
+            self.assertEqual(sorted(os.listdir(working_directory)),
+                             ['_root', '_root.current', 'formula-repos'])
+        finally:
+            shutil.rmtree(working_directory)
+
+    def test__update_root_links__reconciles(self):
+        """
+        TestShakerRemote: Test only the salt root links that differ are touched
+        """
+        working_directory = tempfile.mkdtemp()
+        try:
+            install_path = os.path.join(working_directory, 'formula-repos')
+            root_path = os.path.join(working_directory, '_root')
+            os.makedirs(os.path.join(install_path, 'test1-formula', 'test1'))
+            os.makedirs(os.path.join(install_path, 'test1-formula', '_modules'))
+            open(os.path.join(install_path, 'test1-formula', '_modules', 'test1.py'), 'w').close()
+            os.makedirs(os.path.join(install_path, 'test2-formula', 'test2'))
+            # An up to date link, a stale link and a removed formula's links
+            os.makedirs(os.path.join(root_path, '_states'))
+            os.symlink('../formula-repos/test1-formula/test1', os.path.join(root_path, 'test1'))
+            os.symlink('../formula-repos/old-formula/test2', os.path.join(root_path, 'test2'))
+            os.symlink('../formula-repos/old-formula/old', os.path.join(root_path, 'old'))
+            os.symlink('../../formula-repos/old-formula/_states/old.py',
+                       os.path.join(root_path, '_states', 'old.py'))
+
+            dependencies = copy.deepcopy(self._sample_dependencies)
+            del dependencies['test_organisation/test3-formula']
+            testobj = ShakerRemote(dependencies, working_directory=working_directory)
+            result = testobj._update_root_links()
+
+            self.assertEqual(result, {'created': 1, 'updated': 1, 'removed': 2, 'unchanged': 1})
+            self.assertEqual(sorted(os.listdir(root_path)), ['_modules', 'test1', 'test2'])
+            self.assertEqual(os.readlink(os.path.join(root_path, 'test2')),
+                             '../formula-repos/test2-formula/test2')
+            self.assertEqual(os.readlink(os.path.join(root_path, '_modules', 'test1.py')),
+                             '../../formula-repos/test1-formula/_modules/test1.py')
+            # The salt root is flipped between staged roots, and the old ones removed
+            self.assertTrue(os.path.islink(root_path))
+            self.assertEqual(len(os.listdir(working_directory)), 3)
+            # Nothing changed, so the salt root is not staged again
+            staged_path = os.readlink(root_path)
+            self.assertEqual(testobj._update_root_links(),
+                             {'created': 0, 'updated': 0, 'removed': 0, 'unchanged': 3})
+            self.assertEqual(os.readlink(root_path), staged_path)
+            self.assertEqual(len(os.listdir(working_directory)), 3)
+        finally:
+            shutil.rmtree(working_directory)
+
+    def test__swap_salt_root__previous_root_not_removed(self):
+        """
+        TestShakerRemote: Test failing to remove the previous salt root keeps the swapped in one
+        """
+        working_directory = tempfile.mkdtemp()
+        try:
+            root_path = os.path.join(working_directory, '_root')
+            os.makedirs(os.path.join(working_directory, '_root.current', 'test1'))
+            os.symlink('_root.current', root_path)
+
+            testobj = ShakerRemote(self._sample_dependencies, working_directory=working_directory)
+            with patch('shutil.rmtree') as mock_rmtree:
+                mock_rmtree.side_effect = OSError('Permission denied')
+                testobj._swap_salt_root(root_path,
+                                        os.path.join(working_directory, '_root.staged'))
+            self.assertEqual(os.readlink(root_path), '_root.staged')
+
+            os.makedirs(os.path.join(working_directory, '_root.staged'))
+            testobj._remove_stale_salt_roots()
+            self.assertFalse(os.path.exists(os.path.join(working_directory, '_root.current')))
+        finally:
+            shutil.rmtree(working_directory)
+
+    def test__swap_salt_root__restores_plain_root(self):
+        """
+        TestShakerRemote: Test a plain salt root moved aside is put back if the swap fails
+        """
+        working_directory = tempfile.mkdtemp()
+        try:
+            root_path = os.path.join(working_directory, '_root')
+            staging_path = os.path.join(working_directory, '_root.staged')
+            os.makedirs(os.path.join(root_path, 'test1'))
+            os.makedirs(staging_path)
+
+            testobj = ShakerRemote(self._sample_dependencies, working_directory=working_directory)
+            with patch('os.symlink') as mock_symlink:
+                mock_symlink.side_effect = OSError('No space left on device')
+                self.assertRaises(OSError, testobj._swap_salt_root, root_path, staging_path)
+            self.assertFalse(os.path.islink(root_path))
+            self.assertTrue(os.path.isdir(os.path.join(root_path, 'test1')))
+            self.assertEqual(sorted(os.listdir(working_directory)), ['_root', '_root.staged'])
+        finally:
+            shutil.rmtree(working_directory)
+
+    def _commit_and_tag(self, repo, tag):
+        """
+        Commit a new version of a test1 formula to master in a bare
+        repository and tag it
+        """
+        signature = pygit2.Signature('test', 'test@example.com')
+        formula_builder = repo.TreeBuilder()
+        formula_builder.insert('init.sls', repo.create_blob(tag), pygit2.GIT_FILEMODE_BLOB)
+        builder = repo.TreeBuilder()
+        builder.insert('test1', formula_builder.write(), pygit2.GIT_FILEMODE_TREE)
+        parents = [] if repo.head_is_unborn else [repo.head.target]
+        oid = repo.create_commit('refs/heads/master',
+                                 signature,
+                                 signature,
+                                 tag,
+                                 builder.write(),
+                                 parents)
+        repo.create_reference('refs/tags/%s' % (tag), oid)
+        return oid.hex
+
+    def test_install_dependencies__existing_clone(self):
+        """
+        TestShakerRemote: Test an install over an existing clone updates it to a new upstream tag
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            origin_url = os.path.join(directory, 'test1-formula.git')
+            origin = pygit2.init_repository(origin_url, bare=True)
+            dependencies = {
+                'test_organisation/test1-formula': {
+                    'source': origin_url,
+                    'organisation': 'test_organisation',
+                    'name': 'test1-formula',
+                    'sha': self._commit_and_tag(origin, 'v1.0.1'),
+                }
+            }
+            working_directory = os.path.join(directory, 'vendor')
+            testobj = ShakerRemote(dependencies,
+                                   working_directory=working_directory)
+            self.assertEqual(testobj.install_dependencies(enable_remote_check=True), (1, 0))
+
+            dependencies['test_organisation/test1-formula']['sha'] = self._commit_and_tag(origin, 'v2.0.1')
+            self.assertEqual(testobj.install_dependencies(enable_remote_check=True), (1, 0))
+
+            with open(os.path.join(working_directory, '_root', 'test1', 'init.sls')) as sls_file:
+                self.assertEqual(sls_file.read(), 'v2.0.1')
+        finally:
+            shutil.rmtree(directory)